@@ -1 +0,0 @@
-touch ok-nippou-kun/__init__.py
@@ -0,0 +1,87 @@
+import sys
+import time
+import inspect
+import logging
+from db_utils import run_migrations, check_query_plans, rebuild_rollups, HOT_QUERIES
+
+# 使い方:
+#   python db_admin.py migrate          未適用のスキーママイグレーションを適用
+#   python db_admin.py check-plans      主要クエリがインデックスを使っているか確認（問題があれば終了コード1）
+#   python db_admin.py rebuild-rollups  集計テーブルを元データから作り直す
+#   python db_admin.py export-csv <reports | weekly-schedules | store-visits> <出力先.csv>
+#                                       全期間のデータをCSVに出力（PostgreSQL の COPY で出力する）
+#   python db_admin.py export-parquet <reports | store-visits | weekly-schedules | monthly-stats> <出力先.parquet>
+#                                       全期間のデータを分析用のParquetに出力
+
+def migrate():
+    version = run_migrations()
+    if version is None:
+        print("マイグレーションに失敗しました。ログを確認してください。")
+        return 1
+    print(f"スキーマバージョン: {version}")
+    return 0
+
+def check_plans():
+    failures = check_query_plans()
+    for name, problem in failures:
+        print(f"NG {name}: {problem}")
+    failed_names = {name for name, _ in failures}
+    print(f"{len(HOT_QUERIES) - len(failed_names)}/{len(HOT_QUERIES)}件のクエリがインデックスを使用しています。")
+    return 1 if failures else 0
+
+def rebuild():
+    row_counts = rebuild_rollups()
+    if row_counts is None:
+        print("集計テーブルの作り直しに失敗しました。ログを確認してください。")
+        return 1
+    for table, row_count in row_counts.items():
+        print(f"{table}: {row_count}行")
+    return 0
+
+def export_csv(data, output):
+    # pandas などの読み込みに時間がかかるため、使うときだけインポートする
+    import excel_utils
+    exporters = {
+        "reports": excel_utils.export_reports_to_csv,
+        "weekly-schedules": excel_utils.export_weekly_schedules_to_csv,
+        "store-visits": excel_utils.export_store_visits_to_csv
+    }
+    if data not in exporters:
+        print(f"出力するデータは {' | '.join(exporters)} のいずれかを指定してください。")
+        return 2
+    started = time.time()
+    if exporters[data](path=output) is None:
+        print("CSVの出力に失敗しました。ログを確認してください。")
+        return 1
+    print(f"{output} に出力しました（{time.time() - started:.1f}秒）")
+    return 0
+
+def export_parquet(data, output):
+    # pandas などの読み込みに時間がかかるため、使うときだけインポートする
+    import excel_utils
+    dataset = data.replace("-", "_")
+    if dataset not in excel_utils.PARQUET_DATASETS:
+        print(f"出力するデータは {' | '.join(name.replace('_', '-') for name in excel_utils.PARQUET_DATASETS)} のいずれかを指定してください。")
+        return 2
+    started = time.time()
+    if excel_utils.export_to_parquet(dataset, path=output) is None:
+        print("Parquetの出力に失敗しました（データがないか、エラーが発生しました）。ログを確認してください。")
+        return 1
+    print(f"{output} に出力しました（{time.time() - started:.1f}秒）")
+    return 0
+
+COMMANDS = {
+    "migrate": migrate,
+    "check-plans": check_plans,
+    "rebuild-rollups": rebuild,
+    "export-csv": export_csv,
+    "export-parquet": export_parquet
+}
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.WARNING)
+    command = COMMANDS.get(sys.argv[1]) if len(sys.argv) >= 2 else None
+    if command is None or len(sys.argv) - 2 != len(inspect.signature(command).parameters):
+        print(f"使い方: python db_admin.py [{' | '.join(COMMANDS)}]（引数はファイル先頭のコメントを参照）")
+        sys.exit(2)
+    sys.exit(command(*sys.argv[2:]))
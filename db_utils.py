@@ -1,10 +1,17 @@
 import os
 import json
 import logging
+import threading
+import time
+import copy
+import select
+import contextvars
+from collections import OrderedDict
+from functools import wraps
 from datetime import datetime, timedelta, date
 import psycopg2
 from psycopg2 import sql
-from psycopg2.extras import RealDictCursor, Json
+from psycopg2.extras import RealDictCursor, Json, execute_values
 
 # Neon Database connection information - 環境変数から取得
 DB_HOST = os.getenv("PGHOST")
@@ -16,8 +23,250 @@ DB_PORT = os.getenv("PGPORT", "5432")  # デフォルトポートは5432
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 通知アウトボックスの設定
+OUTBOX_BATCH_SIZE = 100  # 1回の処理で取り出すイベント数
+OUTBOX_MAX_ATTEMPTS = 5  # この回数失敗したイベントは再試行しない
+OUTBOX_POLL_INTERVAL = 5  # 秒
+
+# 通知アウトボックス処理の統計（プロセス単位）
+OUTBOX_METRICS = {
+    "batches": 0,
+    "delivered": 0,
+    "notifications": 0,
+    "failed": 0,
+    "last_run": None,
+    "last_lag_seconds": None
+}
+
+outbox_worker_thread = None
+outbox_worker_lock = threading.Lock()
+
+# テーブル変更通知（LISTEN/NOTIFY）の設定
+CHANGE_NOTIFY_CHANNEL = "db_utils_changes"
+CHANGE_LISTENER_RECONNECT_INTERVAL = 5  # 秒
+
+# data_versions でバージョンを管理するテーブル（エクスポートファイルのキャッシュ判定用。commit_changes で更新する）
+DATA_VERSION_TABLES = ("reports", "schedule_days", "store_visits", "weekly_schedules")
+
+# 自プロセスが送った通知を見分けるためのID
+PROCESS_ID = f"{os.getpid()}-{int(time.time() * 1000)}"
+
+change_listener_thread = None
+change_listener_lock = threading.Lock()
+
+# 日報の差分取得の設定
+REPORT_CHANGES_OVERLAP = 30  # 秒（コミットが遅れたトランザクションの更新を取りこぼさないよう、前回位置から遡る幅）
+REPORT_DELETIONS_RETENTION_DAYS = 7  # 削除記録の保持期間（これより前から同期していない場合は全件読み直す）
+
+# エクスポートの設定
+EXPORT_FETCH_SIZE = 2000  # サーバーサイドカーソルから1回に取得する行数
+
+# get_db_connection が返す接続の差し替え（check_query_plans 用）。
+# コンテキストごとの値のため、差し替えは呼び出したスレッドの中だけで有効になる
+connection_override = contextvars.ContextVar("connection_override", default=None)
+
+# 読み取りキャッシュの設定
+QUERY_CACHE_TTL = 300  # 秒（他プロセスの変更は LISTEN/NOTIFY で無効化するため、TTLは保険）
+QUERY_CACHE_MAX_ENTRIES = 256
+
+# 読み取りキャッシュの統計（プロセス単位）
+QUERY_CACHE_METRICS = {
+    "hits": 0,
+    "misses": 0,
+    "stale": 0,  # テーブル更新またはTTL切れで破棄した件数
+    "evictions": 0,  # 件数上限で破棄した件数
+    "errors": 0  # 読み取りに失敗した件数（キャッシュには保存しない）
+}
+
+# テーブルごとの更新バージョン（書き込みのたびに加算し、古いキャッシュを無効にする）
+table_versions = {}
+query_cache = OrderedDict()
+query_cache_lock = threading.Lock()
+
+def bump_table_version(*tables):
+    """テーブルの更新バージョンを進め、そのテーブルを参照するキャッシュを無効にする
+    
+    書き込み関数はコミットの後に呼ぶこと（コミット前に呼ぶと古いデータが新しいバージョンでキャッシュされる）。
+    """
+    with query_cache_lock:
+        for table in tables:
+            table_versions[table] = table_versions.get(table, 0) + 1
+
+def cached_query(*tables, ttl=QUERY_CACHE_TTL, default=None):
+    """読み取り関数の結果をプロセス内にキャッシュするデコレーター
+    
+    キャッシュは関数名と引数ごとに持ち、参照する tables のいずれかのバージョンが
+    進むか ttl 秒が過ぎると破棄する。呼び出し元が結果を書き換えても影響しないよう、コピーを返す。
+    
+    読み取りに失敗した場合、関数はエラーをログに出してから例外を送出すること。
+    例外はここで default に置き換えて返し、キャッシュには保存しない（一時的なエラーの空の結果を使い続けないように）。
+    
+    Args:
+        tables: 関数が参照するテーブル名
+        ttl: キャッシュの有効期間（秒）
+        default: 読み取りに失敗した場合に返す値
+    """
+    def decorator(func):
+        def call(*args, **kwargs):
+            try:
+                return True, func(*args, **kwargs)
+            except Exception:
+                with query_cache_lock:
+                    QUERY_CACHE_METRICS["errors"] += 1
+                return False, copy.deepcopy(default)
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if connection_override.get() is not None:
+                # 接続を差し替えている間（実行計画の確認中）はキャッシュを読み書きしない
+                return call(*args, **kwargs)[1]
+            try:
+                key = (func.__name__, args, tuple(sorted(kwargs.items())))
+                hash(key)
+            except TypeError:
+                # ハッシュできない引数の場合はキャッシュしない
+                return call(*args, **kwargs)[1]
+            
+            with query_cache_lock:
+                # 読み取り前のバージョンを記録（読み取り中に書き込みがあれば次回は破棄される）
+                versions = tuple(table_versions.get(table, 0) for table in tables)
+                entry = query_cache.get(key)
+                if entry is not None:
+                    entry_versions, expires_at, value = entry
+                    if entry_versions == versions and expires_at > time.monotonic():
+                        query_cache.move_to_end(key)
+                        QUERY_CACHE_METRICS["hits"] += 1
+                        return copy.deepcopy(value)
+                    del query_cache[key]
+                    QUERY_CACHE_METRICS["stale"] += 1
+                QUERY_CACHE_METRICS["misses"] += 1
+            
+            succeeded, value = call(*args, **kwargs)
+            if not succeeded:
+                return value
+            
+            with query_cache_lock:
+                query_cache[key] = (versions, time.monotonic() + ttl, copy.deepcopy(value))
+                query_cache.move_to_end(key)
+                while len(query_cache) > QUERY_CACHE_MAX_ENTRIES:
+                    query_cache.popitem(last=False)
+                    QUERY_CACHE_METRICS["evictions"] += 1
+            return value
+        return wrapper
+    return decorator
+
+def commit_changes(conn, changes):
+    """変更内容を通知してからコミットし、自プロセスのキャッシュを無効にする
+    
+    pg_notify はトランザクション内で送るため、コミットされた場合にだけ他のプロセスへ届く。
+    DATA_VERSION_TABLES のテーブルは data_versions のバージョンもここで上げる。行ロックを取るのはコミットの直前だけで、
+    テーブル名の順に取るため、書き込む順番の違うトランザクションどうしでもデッドロックしない。
+    
+    Args:
+        conn: 書き込みを行った接続
+        changes: (テーブル名, キー, 操作) のリスト。キーは日報IDなど（不明な場合は None）
+    """
+    cur = conn.cursor()
+    versioned_tables = sorted({table for table, _, _ in changes if table in DATA_VERSION_TABLES})
+    if versioned_tables:
+        cur.execute("""
+            INSERT INTO data_versions AS v (table_name, version)
+            SELECT table_name, 1 FROM unnest(%s::text[]) AS t (table_name)
+            ORDER BY table_name
+            ON CONFLICT (table_name) DO UPDATE SET version = v.version + 1
+        """, (versioned_tables,))
+    for table, key, op in changes:
+        cur.execute("SELECT pg_notify(%s, %s)", (CHANGE_NOTIFY_CHANNEL, json.dumps({
+            "table": table,
+            "key": key,
+            "op": op,
+            "origin": PROCESS_ID
+        }, ensure_ascii=False, default=str)))
+    conn.commit()
+    bump_table_version(*{table for table, _, _ in changes})
+
+def handle_change_notification(payload):
+    """他のプロセスからのテーブル変更通知を処理する"""
+    try:
+        change = json.loads(payload)
+    except ValueError:
+        logging.warning(f"不正なテーブル変更通知を無視しました: {payload}")
+        return None
+    # 自プロセスの変更はコミット時に無効化済み
+    if change.get("origin") != PROCESS_ID:
+        bump_table_version(change["table"])
+    return change
+
+def listen_for_changes():
+    """テーブル変更通知を受信し続ける（接続が切れた場合は再接続）"""
+    while True:
+        conn = None
+        try:
+            conn = get_db_connection()
+            conn.autocommit = True
+            conn.cursor().execute(sql.SQL("LISTEN {}").format(sql.Identifier(CHANGE_NOTIFY_CHANNEL)))
+            logging.info("テーブル変更通知の受信を開始しました")
+            
+            # 受信していなかった間の変更を取りこぼさないよう、LISTEN の開始後にキャッシュをすべて破棄する
+            # （開始前に破棄すると、再接続までの間に読み込んだ古い結果が残る）
+            with query_cache_lock:
+                query_cache.clear()
+                
+                # 画面側にも変更があったものとして読み直させる
+                for table in table_versions:
+                    table_versions[table] += 1
+            
+            while True:
+                if select.select([conn], [], [], CHANGE_LISTENER_RECONNECT_INTERVAL) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    handle_change_notification(conn.notifies.pop(0).payload)
+        except Exception as e:
+            logging.error(f"テーブル変更通知の受信エラー: {e}")
+        finally:
+            if conn:
+                conn.close()
+        time.sleep(CHANGE_LISTENER_RECONNECT_INTERVAL)
+
+def start_change_listener():
+    """テーブル変更通知を受信するバックグラウンドスレッドを起動（プロセスごとに1回のみ）"""
+    global change_listener_thread
+    with change_listener_lock:
+        if change_listener_thread is not None and change_listener_thread.is_alive():
+            return change_listener_thread
+        change_listener_thread = threading.Thread(
+            target=listen_for_changes,
+            name="db-change-listener",
+            daemon=True
+        )
+        change_listener_thread.start()
+        return change_listener_thread
+
+def is_change_listener_alive():
+    """テーブル変更通知の受信スレッドが動いているか"""
+    return change_listener_thread is not None and change_listener_thread.is_alive()
+
+def get_table_version(table):
+    """テーブルの更新バージョンを取得（前回から変わっていなければ、このプロセスが知る限り変更はない）"""
+    with query_cache_lock:
+        return table_versions.get(table, 0)
+
+def get_query_cache_metrics():
+    """読み取りキャッシュのヒット率などの統計を取得"""
+    with query_cache_lock:
+        metrics = dict(QUERY_CACHE_METRICS)
+        metrics["entries"] = len(query_cache)
+        metrics["table_versions"] = dict(table_versions)
+    lookups = metrics["hits"] + metrics["misses"]
+    metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+    return metrics
+
 def get_db_connection():
     """PostgreSQLデータベースへの接続を作成"""
+    override = connection_override.get()
+    if override is not None:
+        return override()
     try:
         # DATABASE_URL環境変数が設定されている場合はそれを優先
         database_url = os.getenv("DATABASE_URL")
@@ -41,134 +290,846 @@ def get_db_connection():
         logging.error(f"データベース接続エラー: {e}")
         raise
 
-def init_db(keep_existing=True):
-    """初期データベースセットアップ"""
+def data_version_trigger_sql(table):
+    """テーブルの変更時に data_versions のバージョンを上げるトリガーを作成するSQL
+    
+    適用済みのマイグレーション 13・14 用（トリガーはマイグレーション 16・17 で削除し、現在は commit_changes で上げる）。
+    """
+    statements = []
+    for operation, referencing in (("INSERT", "NEW TABLE AS new_rows"),
+                                   ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                                   ("DELETE", "OLD TABLE AS old_rows")):
+        trigger = f"{table}_data_version_{operation.lower()}"
+        statements.append(f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+        statements.append(f"""
+        CREATE TRIGGER {trigger} AFTER {operation} ON {table}
+        REFERENCING {referencing}
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()
+        """)
+    return statements
+
+# 集計テーブルを元データから一括で作成するSQL（マイグレーションと再作成で共通）
+REPORT_COUNTS_MONTHLY_FILL_SQL = """
+    INSERT INTO report_counts_monthly (投稿者, user_code, month, report_count)
+    SELECT COALESCE(投稿者, ''), COALESCE(user_code, ''), date_trunc('month', 日付)::date, COUNT(*)
+    FROM reports
+    WHERE 日付 IS NOT NULL
+    GROUP BY 1, 2, 3
+"""
+
+STORE_VISIT_ROLLUP_FILL_SQL = """
+    INSERT INTO store_visit_rollup (user_code, month, store_code, store_name, visit_type, visit_count,
+                                    first_visit, last_visit, visit_dates, report_ids)
+    SELECT COALESCE(user_code, ''), date_trunc('month', visit_date)::date, COALESCE(store_code, ''),
+           COALESCE(store_name, ''), COALESCE(visit_type, ''), COUNT(DISTINCT visit_date),
+           MIN(visit_date), MAX(visit_date),
+           array_agg(DISTINCT visit_date ORDER BY visit_date),
+           COALESCE(array_agg(DISTINCT report_id) FILTER (WHERE report_id IS NOT NULL), '{}')
+    FROM store_visits
+    WHERE visit_date IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+# スキーマのマイグレーション定義（version, 説明, SQL文のリスト）
+# 既存のデータベースにも適用できるよう、各SQLは何度実行しても同じ結果になるように書く
+# 新しい変更は末尾に追加し、適用済みのエントリは書き換えないこと
+SCHEMA_MIGRATIONS = [
+    (1, "基本テーブル作成", [
+        """
+        CREATE TABLE IF NOT EXISTS reports (
+            id SERIAL PRIMARY KEY,
+            投稿者 TEXT,
+            所属部署 TEXT,
+            日付 DATE,
+            実施内容 TEXT,
+            所感 TEXT,
+            今後のアクション TEXT,
+            投稿日時 TIMESTAMP,
+            reactions JSONB DEFAULT '{}',
+            comments JSONB DEFAULT '[]',
+            visited_stores JSONB DEFAULT '[]',
+            user_code TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS notices (
+            id SERIAL PRIMARY KEY,
+            投稿者 TEXT,
+            タイトル TEXT,
+            内容 TEXT,
+            対象部署 TEXT,
+            投稿日時 TIMESTAMP,
+            既読者 JSONB DEFAULT '[]'
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS weekly_schedules (
+            id SERIAL PRIMARY KEY,
+            投稿者 TEXT,
+            開始日 DATE,
+            終了日 DATE,
+            月曜日 TEXT,
+            火曜日 TEXT,
+            水曜日 TEXT,
+            木曜日 TEXT,
+            金曜日 TEXT,
+            土曜日 TEXT,
+            日曜日 TEXT,
+            投稿日時 TIMESTAMP,
+            コメント JSONB DEFAULT '[]',
+            月曜日_visited_stores JSONB DEFAULT '[]',
+            火曜日_visited_stores JSONB DEFAULT '[]',
+            水曜日_visited_stores JSONB DEFAULT '[]',
+            木曜日_visited_stores JSONB DEFAULT '[]',
+            金曜日_visited_stores JSONB DEFAULT '[]',
+            土曜日_visited_stores JSONB DEFAULT '[]',
+            日曜日_visited_stores JSONB DEFAULT '[]'
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS notifications (
+            id SERIAL PRIMARY KEY,
+            user_name TEXT,
+            content TEXT,
+            link_type TEXT,
+            link_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_read BOOLEAN DEFAULT FALSE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS store_visits (
+            id SERIAL PRIMARY KEY,
+            user_code TEXT,
+            store_code TEXT,
+            store_name TEXT,
+            visit_date DATE,
+            report_id INTEGER,
+            visit_type TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS report_images (
+            id SERIAL PRIMARY KEY,
+            report_id INTEGER,
+            file_name TEXT,
+            file_type TEXT,
+            image_data TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ]),
+    (2, "reportsテーブルにuser_codeカラムを追加", [
+        "ALTER TABLE reports ADD COLUMN IF NOT EXISTS user_code TEXT"
+    ]),
+    (3, "weekly_schedulesテーブルにコメント・期間カラムを追加", [
+        "ALTER TABLE weekly_schedules ADD COLUMN IF NOT EXISTS コメント JSONB DEFAULT '[]'",
+        "ALTER TABLE weekly_schedules ADD COLUMN IF NOT EXISTS 期間 TEXT",
+        """
+        UPDATE weekly_schedules
+        SET 期間 = 開始日 || ' 〜 ' || 終了日
+        WHERE 期間 IS NULL
+        """
+    ]),
+    (4, "お気に入りメンバーテーブル作成", [
+        """
+        CREATE TABLE IF NOT EXISTS favorite_members (
+            id SERIAL PRIMARY KEY,
+            admin_code TEXT NOT NULL,
+            member_code TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (admin_code, member_code)
+        )
+        """
+    ]),
+    (5, "通知アウトボックステーブル作成", [
+        """
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id SERIAL PRIMARY KEY,
+            event_type TEXT NOT NULL,
+            payload JSONB NOT NULL DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS notification_outbox_next_attempt_idx
+        ON notification_outbox (next_attempt_at)
+        """
+    ]),
+    (6, "よく使う検索条件のインデックス作成", [
+        "CREATE INDEX IF NOT EXISTS reports_posted_at_idx ON reports (投稿日時)",
+        "CREATE INDEX IF NOT EXISTS reports_date_department_idx ON reports (日付, 所属部署)",
+        "CREATE INDEX IF NOT EXISTS reports_department_posted_at_idx ON reports (所属部署, 投稿日時)",
+        "CREATE INDEX IF NOT EXISTS reports_author_date_idx ON reports (投稿者, 日付)",
+        "CREATE INDEX IF NOT EXISTS store_visits_user_date_idx ON store_visits (user_code, visit_date)",
+        "CREATE INDEX IF NOT EXISTS store_visits_report_idx ON store_visits (report_id, visit_type)",
+        "CREATE INDEX IF NOT EXISTS notifications_user_read_idx ON notifications (user_name, is_read)",
+        "CREATE INDEX IF NOT EXISTS report_images_report_idx ON report_images (report_id)",
+        "CREATE INDEX IF NOT EXISTS favorite_members_member_idx ON favorite_members (member_code)"
+    ]),
+    (7, "週間予定を日単位の行（schedule_days）に正規化", [
+        "ALTER TABLE weekly_schedules ADD COLUMN IF NOT EXISTS user_code TEXT",
+        """
+        UPDATE weekly_schedules w
+        SET user_code = v.user_code
+        FROM (
+            SELECT DISTINCT ON (report_id) report_id, user_code
+            FROM store_visits
+            WHERE visit_type = 'weekly_schedule' AND COALESCE(user_code, '') <> ''
+            ORDER BY report_id, id
+        ) v
+        WHERE v.report_id = w.id AND w.user_code IS NULL
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS schedule_days (
+            id SERIAL PRIMARY KEY,
+            schedule_id INTEGER NOT NULL REFERENCES weekly_schedules (id) ON DELETE CASCADE,
+            user_code TEXT,
+            投稿者 TEXT,
+            day_date DATE NOT NULL,
+            weekday TEXT NOT NULL,
+            plan TEXT,
+            visited_stores JSONB DEFAULT '[]',
+            UNIQUE (schedule_id, weekday)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS schedule_days_user_date_idx ON schedule_days (user_code, day_date)",
+        "CREATE INDEX IF NOT EXISTS schedule_days_author_date_idx ON schedule_days (投稿者, day_date)",
+        """
+        INSERT INTO schedule_days (schedule_id, user_code, 投稿者, day_date, weekday, plan, visited_stores)
+        SELECT w.id, w.user_code, w.投稿者, w.開始日 + d.day_offset, d.weekday, d.plan,
+               COALESCE(d.visited_stores, '[]'::jsonb)
+        FROM weekly_schedules w
+        CROSS JOIN LATERAL (VALUES
+            (0, '月曜日', w.月曜日, w.月曜日_visited_stores),
+            (1, '火曜日', w.火曜日, w.火曜日_visited_stores),
+            (2, '水曜日', w.水曜日, w.水曜日_visited_stores),
+            (3, '木曜日', w.木曜日, w.木曜日_visited_stores),
+            (4, '金曜日', w.金曜日, w.金曜日_visited_stores),
+            (5, '土曜日', w.土曜日, w.土曜日_visited_stores),
+            (6, '日曜日', w.日曜日, w.日曜日_visited_stores)
+        ) AS d (day_offset, weekday, plan, visited_stores)
+        ON CONFLICT (schedule_id, weekday) DO NOTHING
+        """,
+        """
+        ALTER TABLE weekly_schedules
+            DROP COLUMN 月曜日, DROP COLUMN 火曜日, DROP COLUMN 水曜日, DROP COLUMN 木曜日,
+            DROP COLUMN 金曜日, DROP COLUMN 土曜日, DROP COLUMN 日曜日,
+            DROP COLUMN 月曜日_visited_stores, DROP COLUMN 火曜日_visited_stores,
+            DROP COLUMN 水曜日_visited_stores, DROP COLUMN 木曜日_visited_stores,
+            DROP COLUMN 金曜日_visited_stores, DROP COLUMN 土曜日_visited_stores,
+            DROP COLUMN 日曜日_visited_stores
+        """,
+        # 従来の1行14カラム形式で読む処理向けの互換ビュー
+        """
+        CREATE OR REPLACE VIEW weekly_schedules_compat AS
+        SELECT w.*,
+               d.月曜日, d.火曜日, d.水曜日, d.木曜日, d.金曜日, d.土曜日, d.日曜日,
+               d.月曜日_visited_stores, d.火曜日_visited_stores, d.水曜日_visited_stores,
+               d.木曜日_visited_stores, d.金曜日_visited_stores, d.土曜日_visited_stores,
+               d.日曜日_visited_stores
+        FROM weekly_schedules w
+        LEFT JOIN LATERAL (
+            SELECT
+                MAX(plan) FILTER (WHERE weekday = '月曜日') AS 月曜日,
+                MAX(plan) FILTER (WHERE weekday = '火曜日') AS 火曜日,
+                MAX(plan) FILTER (WHERE weekday = '水曜日') AS 水曜日,
+                MAX(plan) FILTER (WHERE weekday = '木曜日') AS 木曜日,
+                MAX(plan) FILTER (WHERE weekday = '金曜日') AS 金曜日,
+                MAX(plan) FILTER (WHERE weekday = '土曜日') AS 土曜日,
+                MAX(plan) FILTER (WHERE weekday = '日曜日') AS 日曜日,
+                COALESCE(jsonb_agg(visited_stores) FILTER (WHERE weekday = '月曜日') -> 0, '[]') AS 月曜日_visited_stores,
+                COALESCE(jsonb_agg(visited_stores) FILTER (WHERE weekday = '火曜日') -> 0, '[]') AS 火曜日_visited_stores,
+                COALESCE(jsonb_agg(visited_stores) FILTER (WHERE weekday = '水曜日') -> 0, '[]') AS 水曜日_visited_stores,
+                COALESCE(jsonb_agg(visited_stores) FILTER (WHERE weekday = '木曜日') -> 0, '[]') AS 木曜日_visited_stores,
+                COALESCE(jsonb_agg(visited_stores) FILTER (WHERE weekday = '金曜日') -> 0, '[]') AS 金曜日_visited_stores,
+                COALESCE(jsonb_agg(visited_stores) FILTER (WHERE weekday = '土曜日') -> 0, '[]') AS 土曜日_visited_stores,
+                COALESCE(jsonb_agg(visited_stores) FILTER (WHERE weekday = '日曜日') -> 0, '[]') AS 日曜日_visited_stores
+            FROM schedule_days
+            WHERE schedule_id = w.id
+        ) d ON TRUE
+        """
+    ]),
+    (8, "週間予定の絞り込み用インデックス作成", [
+        "CREATE INDEX IF NOT EXISTS weekly_schedules_posted_at_idx ON weekly_schedules (投稿日時)",
+        "CREATE INDEX IF NOT EXISTS weekly_schedules_start_date_idx ON weekly_schedules (開始日)",
+        "CREATE INDEX IF NOT EXISTS weekly_schedules_author_start_idx ON weekly_schedules (投稿者, 開始日)",
+        "CREATE INDEX IF NOT EXISTS weekly_schedules_user_start_idx ON weekly_schedules (user_code, 開始日)"
+    ]),
+    (9, "月別日報投稿数の集計テーブル（report_counts_monthly）作成", [
+        """
+        CREATE TABLE IF NOT EXISTS report_counts_monthly (
+            投稿者 TEXT NOT NULL DEFAULT '',
+            user_code TEXT NOT NULL DEFAULT '',
+            month DATE NOT NULL,
+            report_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (投稿者, user_code, month)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS report_counts_monthly_user_month_idx ON report_counts_monthly (user_code, month)",
+        "CREATE INDEX IF NOT EXISTS report_counts_monthly_month_idx ON report_counts_monthly (month)",
+        # 日報の追加・削除・更新を文単位でまとめて集計テーブルに反映する
+        """
+        CREATE OR REPLACE FUNCTION apply_report_counts_monthly() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO report_counts_monthly AS c (投稿者, user_code, month, report_count)
+                SELECT COALESCE(投稿者, ''), COALESCE(user_code, ''), date_trunc('month', 日付)::date, COUNT(*)
+                FROM new_rows
+                WHERE 日付 IS NOT NULL
+                GROUP BY 1, 2, 3
+                ON CONFLICT (投稿者, user_code, month)
+                DO UPDATE SET report_count = c.report_count + EXCLUDED.report_count;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE report_counts_monthly c
+                SET report_count = c.report_count - o.removed
+                FROM (
+                    SELECT COALESCE(投稿者, '') AS 投稿者, COALESCE(user_code, '') AS user_code,
+                           date_trunc('month', 日付)::date AS month, COUNT(*) AS removed
+                    FROM old_rows
+                    WHERE 日付 IS NOT NULL
+                    GROUP BY 1, 2, 3
+                ) o
+                WHERE c.投稿者 = o.投稿者 AND c.user_code = o.user_code AND c.month = o.month;
+                DELETE FROM report_counts_monthly WHERE report_count <= 0;
+            ELSE
+                -- 投稿者・user_code・日付が変わった行の分だけ付け替える
+                INSERT INTO report_counts_monthly AS c (投稿者, user_code, month, report_count)
+                SELECT 投稿者, user_code, month, SUM(delta)
+                FROM (
+                    SELECT COALESCE(投稿者, '') AS 投稿者, COALESCE(user_code, '') AS user_code,
+                           date_trunc('month', 日付)::date AS month, 1 AS delta
+                    FROM new_rows WHERE 日付 IS NOT NULL
+                    UNION ALL
+                    SELECT COALESCE(投稿者, ''), COALESCE(user_code, ''), date_trunc('month', 日付)::date, -1
+                    FROM old_rows WHERE 日付 IS NOT NULL
+                ) d
+                GROUP BY 1, 2, 3
+                HAVING SUM(delta) <> 0
+                ON CONFLICT (投稿者, user_code, month)
+                DO UPDATE SET report_count = c.report_count + EXCLUDED.report_count;
+                DELETE FROM report_counts_monthly WHERE report_count <= 0;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS reports_counts_monthly_insert ON reports",
+        "DROP TRIGGER IF EXISTS reports_counts_monthly_delete ON reports",
+        "DROP TRIGGER IF EXISTS reports_counts_monthly_update ON reports",
+        """
+        CREATE TRIGGER reports_counts_monthly_insert AFTER INSERT ON reports
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION apply_report_counts_monthly()
+        """,
+        """
+        CREATE TRIGGER reports_counts_monthly_delete AFTER DELETE ON reports
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION apply_report_counts_monthly()
+        """,
+        """
+        CREATE TRIGGER reports_counts_monthly_update AFTER UPDATE ON reports
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION apply_report_counts_monthly()
+        """,
+        "DELETE FROM report_counts_monthly",
+        REPORT_COUNTS_MONTHLY_FILL_SQL
+    ]),
+    (10, "ユーザー・店舗・月別の訪問集計テーブル（store_visit_rollup）作成", [
+        """
+        CREATE TABLE IF NOT EXISTS store_visit_rollup (
+            user_code TEXT NOT NULL,
+            month DATE NOT NULL,
+            store_code TEXT NOT NULL,
+            store_name TEXT NOT NULL,
+            visit_type TEXT NOT NULL,
+            visit_count INTEGER NOT NULL,
+            first_visit DATE NOT NULL,
+            last_visit DATE NOT NULL,
+            visit_dates DATE[] NOT NULL,
+            report_ids INTEGER[] NOT NULL,
+            PRIMARY KEY (user_code, month, store_code, store_name, visit_type)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS store_visit_rollup_month_idx ON store_visit_rollup (month)",
+        # 変更のあった (ユーザー, 月) の集計行だけを store_visits から計算し直す
+        """
+        CREATE OR REPLACE FUNCTION refresh_store_visit_rollup() RETURNS trigger AS $$
+        DECLARE
+            affected_users TEXT[] := '{}';
+            affected_months DATE[] := '{}';
+        BEGIN
+            IF TG_OP <> 'DELETE' THEN
+                SELECT affected_users || array_agg(COALESCE(user_code, '')),
+                       affected_months || array_agg(date_trunc('month', visit_date)::date)
+                INTO affected_users, affected_months
+                FROM new_rows
+                WHERE visit_date IS NOT NULL;
+            END IF;
+            IF TG_OP <> 'INSERT' THEN
+                SELECT affected_users || array_agg(COALESCE(user_code, '')),
+                       affected_months || array_agg(date_trunc('month', visit_date)::date)
+                INTO affected_users, affected_months
+                FROM old_rows
+                WHERE visit_date IS NOT NULL;
+            END IF;
+            
+            -- 同じ (ユーザー, 月) を同時に計算し直さないよう、キー順にロックを取る
+            PERFORM pg_advisory_xact_lock(hashtext('store_visit_rollup:' || a.user_code || ':' || a.month))
+            FROM (SELECT DISTINCT * FROM unnest(affected_users, affected_months) AS a (user_code, month)
+                  ORDER BY 1, 2) a;
+            
+            DELETE FROM store_visit_rollup r
+            USING (SELECT DISTINCT * FROM unnest(affected_users, affected_months) AS a (user_code, month)) a
+            WHERE r.user_code = a.user_code AND r.month = a.month;
+            
+            INSERT INTO store_visit_rollup (user_code, month, store_code, store_name, visit_type, visit_count,
+                                            first_visit, last_visit, visit_dates, report_ids)
+            SELECT a.user_code, a.month, COALESCE(v.store_code, ''), COALESCE(v.store_name, ''),
+                   COALESCE(v.visit_type, ''), COUNT(DISTINCT v.visit_date),
+                   MIN(v.visit_date), MAX(v.visit_date),
+                   array_agg(DISTINCT v.visit_date ORDER BY v.visit_date),
+                   COALESCE(array_agg(DISTINCT v.report_id) FILTER (WHERE v.report_id IS NOT NULL), '{}')
+            FROM (SELECT DISTINCT * FROM unnest(affected_users, affected_months) AS a (user_code, month)) a
+            JOIN store_visits v
+              ON (v.user_code = a.user_code OR (a.user_code = '' AND v.user_code IS NULL))
+             AND v.visit_date >= a.month AND v.visit_date < a.month + INTERVAL '1 month'
+            GROUP BY 1, 2, 3, 4, 5;
+            
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS store_visits_rollup_insert ON store_visits",
+        "DROP TRIGGER IF EXISTS store_visits_rollup_delete ON store_visits",
+        "DROP TRIGGER IF EXISTS store_visits_rollup_update ON store_visits",
+        """
+        CREATE TRIGGER store_visits_rollup_insert AFTER INSERT ON store_visits
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION refresh_store_visit_rollup()
+        """,
+        """
+        CREATE TRIGGER store_visits_rollup_delete AFTER DELETE ON store_visits
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION refresh_store_visit_rollup()
+        """,
+        """
+        CREATE TRIGGER store_visits_rollup_update AFTER UPDATE ON store_visits
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION refresh_store_visit_rollup()
+        """,
+        "DELETE FROM store_visit_rollup",
+        STORE_VISIT_ROLLUP_FILL_SQL
+    ]),
+    (11, "日報の差分取得用インデックス", [
+        # (投稿日時, id) の行比較で新着分だけを取得するため。投稿日時だけの並び替えにも使えるので単独インデックスは置き換える
+        "CREATE INDEX IF NOT EXISTS reports_posted_at_id_idx ON reports (投稿日時, id)",
+        "DROP INDEX IF EXISTS reports_posted_at_idx"
+    ]),
+    (12, "日報の更新日時と削除記録", [
+        # 既存の行はマイグレーション時刻になる（適用直後の1回だけ全件が更新扱いになる）
+        "ALTER TABLE reports ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+        "CREATE INDEX IF NOT EXISTS reports_updated_at_idx ON reports (updated_at)",
+        """
+        CREATE OR REPLACE FUNCTION touch_reports_updated_at() RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.updated_at := now();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS reports_touch_updated_at ON reports",
+        """
+        CREATE TRIGGER reports_touch_updated_at BEFORE UPDATE ON reports
+        FOR EACH ROW EXECUTE FUNCTION touch_reports_updated_at()
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS report_deletions (
+            report_id INTEGER PRIMARY KEY,
+            deleted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS report_deletions_deleted_at_idx ON report_deletions (deleted_at)",
+        f"""
+        CREATE OR REPLACE FUNCTION record_report_deletions() RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO report_deletions (report_id)
+            SELECT id FROM old_rows
+            ON CONFLICT (report_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+            
+            -- 保持期間を過ぎた削除記録はここで片付ける
+            DELETE FROM report_deletions
+            WHERE deleted_at < now() - INTERVAL '{REPORT_DELETIONS_RETENTION_DAYS} days';
+            
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS reports_record_deletions ON reports",
+        """
+        CREATE TRIGGER reports_record_deletions AFTER DELETE ON reports
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION record_report_deletions()
+        """
+    ]),
+    (13, "テーブルごとのデータバージョン（エクスポートファイルのキャッシュ判定用）", [
+        """
+        CREATE TABLE IF NOT EXISTS data_versions (
+            table_name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            -- 1行も変わらなかった文（0件の UPDATE・DELETE）ではバージョンを上げない
+            IF TG_OP = 'DELETE' THEN
+                PERFORM 1 FROM old_rows LIMIT 1;
+            ELSE
+                PERFORM 1 FROM new_rows LIMIT 1;
+            END IF;
+            IF FOUND THEN
+                INSERT INTO data_versions AS v (table_name, version) VALUES (TG_TABLE_NAME, 1)
+                ON CONFLICT (table_name) DO UPDATE SET version = v.version + 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    ] + [
+        statement
+        for table in ("reports", "weekly_schedules", "schedule_days", "report_counts_monthly", "store_visit_rollup")
+        for statement in data_version_trigger_sql(table)
+    ]),
+    (14, "店舗訪問記録のデータバージョン（分析用データのエクスポート用）", data_version_trigger_sql("store_visits")),
+    (15, "月別日報投稿数の集計で0件になった行の削除を変更のあったキーに限定", [
+        # 0件の行を探すのは件数が減る側（old_rows）のキーだけでよい。テーブル全体は走査しない
+        """
+        CREATE OR REPLACE FUNCTION apply_report_counts_monthly() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO report_counts_monthly AS c (投稿者, user_code, month, report_count)
+                SELECT COALESCE(投稿者, ''), COALESCE(user_code, ''), date_trunc('month', 日付)::date, COUNT(*)
+                FROM new_rows
+                WHERE 日付 IS NOT NULL
+                GROUP BY 1, 2, 3
+                ON CONFLICT (投稿者, user_code, month)
+                DO UPDATE SET report_count = c.report_count + EXCLUDED.report_count;
+                RETURN NULL;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE report_counts_monthly c
+                SET report_count = c.report_count - o.removed
+                FROM (
+                    SELECT COALESCE(投稿者, '') AS 投稿者, COALESCE(user_code, '') AS user_code,
+                           date_trunc('month', 日付)::date AS month, COUNT(*) AS removed
+                    FROM old_rows
+                    WHERE 日付 IS NOT NULL
+                    GROUP BY 1, 2, 3
+                ) o
+                WHERE c.投稿者 = o.投稿者 AND c.user_code = o.user_code AND c.month = o.month;
+            ELSE
+                -- 投稿者・user_code・日付が変わった行の分だけ付け替える
+                INSERT INTO report_counts_monthly AS c (投稿者, user_code, month, report_count)
+                SELECT 投稿者, user_code, month, SUM(delta)
+                FROM (
+                    SELECT COALESCE(投稿者, '') AS 投稿者, COALESCE(user_code, '') AS user_code,
+                           date_trunc('month', 日付)::date AS month, 1 AS delta
+                    FROM new_rows WHERE 日付 IS NOT NULL
+                    UNION ALL
+                    SELECT COALESCE(投稿者, ''), COALESCE(user_code, ''), date_trunc('month', 日付)::date, -1
+                    FROM old_rows WHERE 日付 IS NOT NULL
+                ) d
+                GROUP BY 1, 2, 3
+                HAVING SUM(delta) <> 0
+                ON CONFLICT (投稿者, user_code, month)
+                DO UPDATE SET report_count = c.report_count + EXCLUDED.report_count;
+            END IF;
+            
+            DELETE FROM report_counts_monthly c
+            USING (
+                SELECT DISTINCT COALESCE(投稿者, '') AS 投稿者, COALESCE(user_code, '') AS user_code,
+                       date_trunc('month', 日付)::date AS month
+                FROM old_rows
+                WHERE 日付 IS NOT NULL
+            ) o
+            WHERE c.投稿者 = o.投稿者 AND c.user_code = o.user_code AND c.month = o.month
+              AND c.report_count <= 0;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    ]),
+    (16, "データバージョンの更新をトリガーから commit_changes に移動", [
+        # トリガーはテーブルに書き込んだ順にロックを取るため、書き込む順番の違うトランザクションどうしでデッドロックしていた
+        f"DROP TRIGGER IF EXISTS {table}_data_version_{operation} ON {table}"
+        for table in ("reports", "weekly_schedules", "schedule_days", "report_counts_monthly", "store_visit_rollup")
+        for operation in ("insert", "update", "delete")
+    ]),
+    (17, "店舗訪問記録のデータバージョンの更新もトリガーから commit_changes に移動", [
+        f"DROP TRIGGER IF EXISTS store_visits_data_version_{operation} ON store_visits"
+        for operation in ("insert", "update", "delete")
+    ] + [
+        "DROP FUNCTION IF EXISTS bump_data_version()"
+    ])
+]
+
+# 週間予定の曜日（開始日からの日数順）
+WEEKDAYS = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
+
+# 実行計画を確認する主要クエリ（名前, 関数を呼び出す処理）
+# SQLを書き写すと関数側の変更に追従できなくなるため、db_utils の関数そのものを呼び出し、
+# 実際に発行された文の実行計画を確認する（check_query_plans を参照）
+HOT_QUERIES = [
+    ("load_reports", lambda: load_reports(limit=50)),
+    ("load_reports(time_range)", lambda: load_reports(time_range="1w")),
+    ("load_reports(depart)", lambda: load_reports(depart="営業部")),
+    ("load_report_changes", lambda: load_report_changes((datetime(2025, 1, 1), 0), get_database_time())),
+    ("load_reports_by_date", lambda: load_reports_by_date(date(2025, 1, 1), date(2025, 1, 31))),
+    ("iter_reports_by_date", lambda: list(iter_reports_by_date(date(2025, 1, 1), date(2025, 1, 31), depart="営業部"))),
+    ("count_reports_by_date", lambda: count_reports_by_date(date(2025, 1, 1), date(2025, 1, 31), depart="営業部")),
+    ("get_data_versions", lambda: get_data_versions(["reports"])),
+    ("get_monthly_report_count(user_name)", lambda: get_monthly_report_count(user_name="山田太郎", year=2025, month=1)),
+    ("get_monthly_report_count(month)", lambda: get_monthly_report_count(year=2025, month=1)),
+    ("get_user_monthly_report_summary", lambda: get_user_monthly_report_summary(user_code="1001")),
+    ("get_user_store_visits", lambda: get_user_store_visits(user_code="1001", year=2025, month=1)),
+    ("sync_store_visits", lambda: sync_store_visits(get_db_connection().cursor(), 1, "daily_report", [])),
+    ("delete_report", lambda: delete_report(1)),
+    ("get_user_notifications", lambda: get_user_notifications("山田太郎", unread_only=True)),
+    ("get_report_images", lambda: get_report_images(1)),
+    ("build_outbox_notifications", lambda: build_outbox_notifications(
+        get_db_connection().cursor(), "report_posted",
+        {"report_id": 1, "poster_code": "1001", "poster_name": "山田太郎", "report_date": "2025-01-06"}, {})),
+    ("get_daily_schedule", lambda: get_daily_schedule(date(2025, 1, 6), user_code="1001")),
+    ("load_weekly_schedules(week)", lambda: load_weekly_schedules(start_date=date(2025, 1, 6), end_date=date(2025, 1, 6))),
+    ("load_weekly_schedules(user_name)", lambda: load_weekly_schedules(user_name="山田太郎")),
+    ("get_weekly_schedule_grid", lambda: get_weekly_schedule_grid(date(2025, 1, 6))),
+    ("get_planned_stores", lambda: get_planned_stores(date(2025, 1, 6), date(2025, 1, 12), user_name="山田太郎")),
+    ("get_schedule_days", lambda: get_schedule_days(date(2025, 1, 1), date(2025, 1, 31), user_name="山田太郎")),
+    ("get_store_visit_stats", lambda: get_store_visit_stats(user_code="1001", year=2025, month=1)),
+    ("get_all_users_store_visits", lambda: get_all_users_store_visits(year=2025, month=1)),
+    ("get_store_coverage", lambda: get_store_coverage(2025, 1, user_code="1001"))
+]
+
+# 複数プロセスが同時に起動した場合にマイグレーションを直列化するためのロックキー
+SCHEMA_MIGRATION_LOCK_KEY = 7405001
+
+schema_ready = False
+schema_lock = threading.Lock()
+
+def get_schema_version(cur):
+    """適用済みの最新スキーマバージョンを返す（未適用なら0）"""
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+def run_migrations():
+    """未適用のスキーママイグレーションを順番に適用する
+    
+    Returns:
+        適用後のスキーマバージョン。失敗した場合は None（途中までの変更もロールバックされる）
+    """
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         
-        # 日報テーブル作成
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS reports (
-                id SERIAL PRIMARY KEY,
-                投稿者 TEXT,
-                所属部署 TEXT,
-                日付 DATE,
-                実施内容 TEXT,
-                所感 TEXT,
-                今後のアクション TEXT,
-                投稿日時 TIMESTAMP,
-                reactions JSONB DEFAULT '{}',
-                comments JSONB DEFAULT '[]',
-                visited_stores JSONB DEFAULT '[]',
-                user_code TEXT
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_MIGRATION_LOCK_KEY,))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-        ''')
+        """)
         
-        # user_codeカラムが存在しない場合は追加
-        try:
-            cur.execute('''
-                SELECT column_name
-                FROM information_schema.columns
-                WHERE table_name = 'reports' AND column_name = 'user_code'
-            ''')
-            if not cur.fetchone():
-                cur.execute('''
-                    ALTER TABLE reports
-                    ADD COLUMN user_code TEXT
-                ''')
-                logging.info("reportsテーブルにuser_codeカラムを追加しました")
-        except Exception as e:
-            logging.error(f"user_codeカラム確認エラー: {e}")
-        
-        # お知らせテーブル作成
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS notices (
-                id SERIAL PRIMARY KEY,
-                投稿者 TEXT,
-                タイトル TEXT,
-                内容 TEXT,
-                対象部署 TEXT,
-                投稿日時 TIMESTAMP,
-                既読者 JSONB DEFAULT '[]'
-            )
-        ''')
-        
-        # 週間予定テーブル作成
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS weekly_schedules (
-                id SERIAL PRIMARY KEY,
-                投稿者 TEXT,
-                開始日 DATE,
-                終了日 DATE,
-                月曜日 TEXT,
-                火曜日 TEXT,
-                水曜日 TEXT,
-                木曜日 TEXT,
-                金曜日 TEXT,
-                土曜日 TEXT,
-                日曜日 TEXT,
-                投稿日時 TIMESTAMP,
-                コメント JSONB DEFAULT '[]',
-                月曜日_visited_stores JSONB DEFAULT '[]',
-                火曜日_visited_stores JSONB DEFAULT '[]',
-                水曜日_visited_stores JSONB DEFAULT '[]',
-                木曜日_visited_stores JSONB DEFAULT '[]',
-                金曜日_visited_stores JSONB DEFAULT '[]',
-                土曜日_visited_stores JSONB DEFAULT '[]',
-                日曜日_visited_stores JSONB DEFAULT '[]'
-            )
-        ''')
-        
-        # 通知テーブル作成
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS notifications (
-                id SERIAL PRIMARY KEY,
-                user_name TEXT,
-                content TEXT,
-                link_type TEXT,
-                link_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_read BOOLEAN DEFAULT FALSE
-            )
-        ''')
-        
-        # 店舗訪問履歴テーブル作成
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS store_visits (
-                id SERIAL PRIMARY KEY,
-                user_code TEXT,
-                store_code TEXT,
-                store_name TEXT,
-                visit_date DATE,
-                report_id INTEGER,
-                visit_type TEXT
-            )
-        ''')
-        
-        # 画像テーブル作成
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS report_images (
-                id SERIAL PRIMARY KEY,
-                report_id INTEGER,
-                file_name TEXT,
-                file_type TEXT,
-                image_data TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        current_version = get_schema_version(cur)
+        for version, description, statements in SCHEMA_MIGRATIONS:
+            if version <= current_version:
+                continue
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (version, description)
             )
-        ''')
+            current_version = version
+            logging.info(f"スキーママイグレーションを適用しました（version {version}: {description}）")
         
         conn.commit()
-        logging.info("データベースを初期化しました")
+        return current_version
+    except Exception as e:
+        logging.error(f"スキーママイグレーションエラー: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def ensure_schema():
+    """プロセス起動時に1回だけマイグレーションを実行する
+    
+    Streamlitの再実行ごとに呼ばれても、2回目以降はDDLもカタログ参照も行わない。
+    失敗した場合は次回の呼び出しで再試行する。
+    """
+    global schema_ready
+    if schema_ready:
+        return True
+    with schema_lock:
+        if not schema_ready:
+            schema_ready = run_migrations() is not None
+    return schema_ready
+
+def rebuild_rollups():
+    """集計テーブル（report_counts_monthly, store_visit_rollup）を元データから作り直す
+    
+    Returns:
+        {テーブル名: 作成した行数} の辞書。失敗した場合は None
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        # 作り直しの間に元データが変更されないようにロック
+        cur.execute("LOCK TABLE reports, store_visits IN SHARE MODE")
+        
+        row_counts = {}
+        for table, fill_sql in (("report_counts_monthly", REPORT_COUNTS_MONTHLY_FILL_SQL),
+                                ("store_visit_rollup", STORE_VISIT_ROLLUP_FILL_SQL)):
+            cur.execute(sql.SQL("DELETE FROM {}").format(sql.Identifier(table)))
+            cur.execute(fill_sql)
+            row_counts[table] = cur.rowcount
+        
+        commit_changes(conn, [("reports", None, "rebuild"), ("store_visits", None, "rebuild")])
+        logging.info(f"集計テーブルを作り直しました（{row_counts}）")
+        return row_counts
     except Exception as e:
-        logging.error(f"データベース初期化エラー: {e}")
+        logging.error(f"集計テーブル再作成エラー: {e}")
         if conn:
             conn.rollback()
+        return None
     finally:
         if conn:
             conn.close()
 
+def find_seq_scans(plan):
+    """EXPLAIN (FORMAT JSON) の実行計画からシーケンシャルスキャンしているテーブル名を集める"""
+    tables = []
+    if plan.get("Node Type") == "Seq Scan":
+        tables.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        tables.extend(find_seq_scans(child))
+    return tables
+
+# 実行計画を確認する文（先頭の語）。SET や COPY などは EXPLAIN できないため対象外
+PLAN_CHECK_STATEMENTS = (b"SELECT", b"WITH", b"INSERT", b"UPDATE", b"DELETE")
+
+class PlanCheckCursor:
+    """文を実行する前に、同じ文の実行計画を記録するカーソル（check_query_plans 用）
+    
+    (文, 実行計画) を記録する。EXPLAIN でエラーになった場合は実行計画の代わりに例外を記録して送出する。
+    """
+    
+    def __init__(self, conn, cursor, plans):
+        self._conn = conn
+        self._cursor = cursor
+        self._plans = plans
+    
+    def execute(self, query, params=None):
+        statement = self._cursor.mogrify(query, params)
+        if statement.lstrip().split(None, 1)[0].upper() in PLAN_CHECK_STATEMENTS:
+            explain = self._conn.cursor()
+            try:
+                explain.execute(b"EXPLAIN (FORMAT JSON) " + statement)
+                plan = explain.fetchone()[0][0]["Plan"]
+            except Exception as e:
+                plan = e
+                raise
+            finally:
+                self._plans.append((statement.decode(self._conn.encoding), plan))
+        return self._cursor.execute(query, params)
+    
+    def __iter__(self):
+        return iter(self._cursor)
+    
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class PlanCheckConnection:
+    """PlanCheckCursor を返す接続。コミットとクローズは行わない（確認の後にまとめてロールバックする）"""
+    
+    def __init__(self, conn, plans):
+        self._conn = conn
+        self._plans = plans
+    
+    def cursor(self, *args, **kwargs):
+        return PlanCheckCursor(self._conn, self._conn.cursor(*args, **kwargs), self._plans)
+    
+    def commit(self):
+        pass
+    
+    def close(self):
+        pass
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def check_query_plans(queries=None):
+    """主要クエリの実行計画を確認し、シーケンシャルスキャンに落ちるものを返す
+    
+    HOT_QUERIES の関数を呼び出し、発行された文をすべて EXPLAIN する。
+    関数は1つの接続とロールバックされるトランザクションの中で実行するため、書き込みを行う関数も何も変更しない。
+    テーブルの件数に左右されないよう enable_seqscan を無効にして計画を立てる。
+    それでも Seq Scan が残るクエリは、使えるインデックスが存在しないことを意味する。
+    
+    接続の差し替え（connection_override）はこの関数を呼んだスレッドの中だけで有効なため、
+    通知アウトボックスや変更通知のスレッドが動いていても影響しない。確認中はキャッシュも使わない。
+    
+    Returns:
+        [(クエリ名, 問題の説明), ...] のリスト（問題がなければ空）
+    """
+    conn = get_db_connection()
+    try:
+        # セッション単位で設定する（関数内のロールバックで元に戻らないように）
+        conn.cursor().execute("SET enable_seqscan = off")
+        conn.commit()
+        
+        failures = []
+        for name, run in (queries or HOT_QUERIES):
+            plans = []
+            token = connection_override.set(lambda: PlanCheckConnection(conn, plans))
+            try:
+                run()
+            except Exception as e:
+                failures.append((name, f"実行エラー: {e}"))
+                continue
+            finally:
+                connection_override.reset(token)
+                conn.rollback()
+            
+            # 読み取り関数はエラーをログに出して空の結果を返すため、文が発行されたかで確認する
+            if not plans:
+                failures.append((name, "文が発行されませんでした（ログを確認してください）"))
+            for statement, plan in plans:
+                if isinstance(plan, Exception):
+                    failures.append((name, f"実行エラー: {str(plan).strip()}"))
+                    continue
+                tables = find_seq_scans(plan)
+                if tables:
+                    failures.append((name, f"Seq Scan on {', '.join(tables)}: {' '.join(statement.split())}"))
+        return failures
+    finally:
+        conn.rollback()
+        conn.close()
+
+def init_db(keep_existing=True):
+    """初期データベースセットアップ（未適用のマイグレーションを適用）"""
+    if run_migrations() is not None:
+        logging.info("データベースを初期化しました")
+
 def authenticate_user(employee_code, password):
     """ユーザー認証（users_data.jsonを使用）"""
     USER_FILE = "data/users_data.json"
@@ -194,6 +1155,18 @@ def authenticate_user(employee_code, password):
 
 def save_report(report):
     """日報をデータベースに保存"""
+    return submit_report(report)
+
+def submit_report(report, images=None):
+    """日報・訪問店舗・添付画像・通知イベントを1つのトランザクションで保存する
+    
+    Args:
+        report: 日報データ
+        images: 添付画像のリスト [{"file_name": ..., "file_type": ..., "image_data": base64文字列}, ...]
+        
+    Returns:
+        すべてコミットされた場合は日報ID、失敗した場合は None（何も保存されない）
+    """
     conn = None
     try:
         conn = get_db_connection()
@@ -224,63 +1197,37 @@ def save_report(report):
             return None
         report_id = result[0]
         
-        # 訪問店舗の記録を保存
-        user_code = report.get("user_code", "")
-        for store in visited_stores:
-            cur.execute("""
-                INSERT INTO store_visits (user_code, store_code, store_name, visit_date, report_id, visit_type)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                user_code, 
-                store.get("code", ""), 
-                store.get("name", ""), 
-                report["日付"],
-                report_id,
-                "daily_report"
-            ))
-        
-        conn.commit()
-        logging.info(f"日報を保存しました（ID: {report_id}）")
+        # 訪問店舗の記録をまとめて保存
+        insert_store_visits(cur, [
+            (user_code, store.get("code", ""), store.get("name", ""), report["日付"], report_id, "daily_report")
+            for store in visited_stores
+        ])
+        
+        # 添付画像をまとめて保存
+        if images:
+            execute_values(cur, """
+                INSERT INTO report_images (report_id, file_name, file_type, image_data)
+                VALUES %s
+            """, [
+                (report_id, image["file_name"], image["file_type"], image["image_data"])
+                for image in images
+            ], page_size=len(images))
+        
+        # お気に入りメンバーの投稿通知はアウトボックス経由で非同期に作成
+        if user_code:
+            enqueue_notification_event(cur, "report_posted", {
+                "report_id": report_id,
+                "poster_code": user_code,
+                "poster_name": report.get("投稿者", ""),
+                "report_date": str(report["日付"])
+            })
         
-        # お気に入りメンバーに登録されているユーザーが投稿した場合、管理者に通知
-        poster_code = report.get("user_code", "")
-        poster_name = report.get("投稿者", "")
-        if poster_code:
-            try:
-                # お気に入り登録している管理者を取得
-                cur.execute("""
-                    SELECT admin_code FROM favorite_members
-                    WHERE member_code = %s
-                """, (poster_code,))
-                admin_results = cur.fetchall()
-                
-                # 管理者に通知
-                for admin_row in admin_results:
-                    admin_code = admin_row[0]
-                    
-                    # 管理者のユーザー名を取得
-                    admin_name = None
-                    try:
-                        with open("data/users_data.json", "r", encoding="utf-8") as f:
-                            users_data = json.load(f)
-                            for user in users_data:
-                                if user.get("code") == admin_code:
-                                    admin_name = user.get("name")
-                                    break
-                    except Exception as e:
-                        logging.error(f"管理者ユーザー名取得エラー: {e}")
-                    
-                    if admin_name:
-                        notification_content = f"お気に入りメンバー {poster_name} さんが新しい日報を投稿しました。日付: {report['日付']}"
-                        create_notification(
-                            admin_name,
-                            notification_content,
-                            "report",
-                            report_id
-                        )
-                        logging.info(f"お気に入りメンバーの投稿通知を作成: 管理者 {admin_name}, メンバー {poster_name}")
-            except Exception as e:
-                logging.error(f"お気に入りメンバー通知作成エラー: {e}")
+        commit_changes(conn, [
+            ("reports", report_id, "insert"),
+            ("store_visits", report_id, "insert"),
+            ("report_images", report_id, "insert")
+        ])
+        logging.info(f"日報を保存しました（ID: {report_id}, 画像: {len(images or [])}件）")
         
         return report_id
     except Exception as e:
@@ -292,6 +1239,58 @@ def save_report(report):
         if conn:
             conn.close()
 
+def insert_store_visits(cur, visits):
+    """店舗訪問記録をまとめて保存する（1回のラウンドトリップ）
+    
+    Args:
+        cur: 呼び出し元のカーソル
+        visits: (user_code, store_code, store_name, visit_date, report_id, visit_type) のタプルのリスト
+    """
+    if not visits:
+        return
+    execute_values(cur, """
+        INSERT INTO store_visits (user_code, store_code, store_name, visit_date, report_id, visit_type)
+        VALUES %s
+    """, visits, page_size=len(visits))
+
+def sync_store_visits(cur, report_id, visit_type, visits):
+    """店舗訪問記録を差分で更新する（追加・削除のあった行のみ変更）
+    
+    Args:
+        cur: 呼び出し元のカーソル
+        report_id: 日報IDまたは週間予定ID
+        visit_type: 訪問種別（daily_report / weekly_schedule）
+        visits: 更新後の (user_code, store_code, store_name, visit_date) のタプルのリスト
+    """
+    cur.execute("""
+        SELECT id, user_code, store_code, store_name, visit_date
+        FROM store_visits
+        WHERE report_id = %s AND visit_type = %s
+    """, (report_id, visit_type))
+    
+    # 既存の訪問記録を (ユーザー, 店舗, 訪問日) ごとにまとめる
+    existing = {}
+    for visit_id, user_code, store_code, store_name, visit_date in cur.fetchall():
+        key = (user_code or "", store_code or "", store_name or "", visit_date)
+        existing.setdefault(key, []).append(visit_id)
+    
+    # 既存の行と一致するものは残し、一致しないものだけを追加
+    new_visits = []
+    for user_code, store_code, store_name, visit_date in visits:
+        key = (user_code or "", store_code or "", store_name or "", visit_date)
+        if existing.get(key):
+            existing[key].pop()
+        else:
+            new_visits.append((user_code, store_code, store_name, visit_date, report_id, visit_type))
+    
+    # 更新後に含まれない行を削除
+    removed_ids = [visit_id for visit_ids in existing.values() for visit_id in visit_ids]
+    if removed_ids:
+        cur.execute("DELETE FROM store_visits WHERE id = ANY(%s)", (removed_ids,))
+    
+    insert_store_visits(cur, new_visits)
+
+@cached_query("reports", default=[])
 def load_reports(depart=None, limit=None, time_range=None):
     """日報データを取得（最新の投稿順にソート）
     
@@ -360,11 +1359,88 @@ def load_reports(depart=None, limit=None, time_range=None):
         return result
     except Exception as e:
         logging.error(f"日報取得エラー: {e}")
-        return []
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+def get_database_time():
+    """データベースの現在時刻を取得（差分取得の基準時刻に使う）"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT now()")
+        return cur.fetchone()[0]
+    except Exception as e:
+        logging.error(f"データベース時刻取得エラー: {e}")
+        return None
     finally:
         if conn:
             conn.close()
 
+def load_report_changes(cursor, since):
+    """前回の取得以降の新着・更新・削除された日報を取得
+    
+    新着は (投稿日時, id) の位置より後、更新（編集・リアクション・コメント）と削除は since 以降の分を返す。
+    コミットが遅れたトランザクションを取りこぼさないよう REPORT_CHANGES_OVERLAP 秒遡って取得するため、
+    既に取得済みの日報が含まれることがある（呼び出し元では ID で上書きすること）。
+    
+    Args:
+        cursor: 取得済みの最新の日報の (投稿日時, id)。None の場合は更新日時だけで判定
+        since: 前回この関数または get_database_time() が返したデータベース時刻
+    
+    Returns:
+        {"reports": 日報のリスト, "deleted_ids": 削除された日報IDのリスト, "synced_at": 次回の since}。
+        since が削除記録の保持期間より前の場合やエラーの場合は None（全件を読み直すこと）
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cur.execute("SELECT now() AS synced_at")
+        synced_at = cur.fetchone()["synced_at"]
+        if since is None or since < synced_at - timedelta(days=REPORT_DELETIONS_RETENTION_DAYS):
+            return None
+        
+        changed_since = since - timedelta(seconds=REPORT_CHANGES_OVERLAP)
+        if cursor:
+            cur.execute("""
+                SELECT * FROM reports
+                WHERE (投稿日時, id) > (%s, %s) OR updated_at > %s
+                ORDER BY 投稿日時 DESC, id DESC
+            """, (cursor[0], cursor[1], changed_since))
+        else:
+            cur.execute("""
+                SELECT * FROM reports WHERE updated_at > %s ORDER BY 投稿日時 DESC, id DESC
+            """, (changed_since,))
+        reports = cur.fetchall()
+        
+        # 辞書形式に変換
+        result = []
+        for report in reports:
+            # 文字列から辞書へ変換
+            if isinstance(report["reactions"], str):
+                report["reactions"] = json.loads(report["reactions"])
+            if isinstance(report["comments"], str):
+                report["comments"] = json.loads(report["comments"])
+            if isinstance(report["visited_stores"], str):
+                report["visited_stores"] = json.loads(report["visited_stores"])
+            result.append(dict(report))
+        
+        cur.execute("SELECT report_id FROM report_deletions WHERE deleted_at > %s", (changed_since,))
+        deleted_ids = [row["report_id"] for row in cur.fetchall()]
+        
+        return {"reports": result, "deleted_ids": deleted_ids, "synced_at": synced_at}
+    except Exception as e:
+        logging.error(f"日報差分取得エラー: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+@cached_query("reports")
 def load_report_by_id(report_id):
     """指定されたIDの日報を取得"""
     conn = None
@@ -387,7 +1463,7 @@ def load_report_by_id(report_id):
         return None
     except Exception as e:
         logging.error(f"日報取得エラー (ID: {report_id}): {e}")
-        return None
+        raise
     finally:
         if conn:
             conn.close()
@@ -405,40 +1481,32 @@ def edit_report(report_id, updated_report):
         # ユーザーコードを取得
         user_code = updated_report.get("user_code", "")
         
+        # 日報を更新し、訪問日として使う日付を同じトランザクション内で取得
         cur.execute("""
             UPDATE reports
             SET 実施内容 = %s, 所感 = %s, 今後のアクション = %s, visited_stores = %s, user_code = %s
             WHERE id = %s
+            RETURNING 日付
         """, (
             updated_report["実施内容"], 
             updated_report["所感"], updated_report["今後のアクション"], 
             Json(visited_stores), user_code, report_id
         ))
         
-        # 以前の訪問記録を削除
-        cur.execute("DELETE FROM store_visits WHERE report_id = %s", (report_id,))
-        
-        # 更新された訪問記録を保存
-        original_report = load_report_by_id(report_id)
-        if original_report is None:
+        result = cur.fetchone()
+        if result is None:
             logging.error(f"元の日報データが見つかりませんでした（ID: {report_id}）")
+            conn.rollback()
             return False
-            
-        user_code = updated_report.get("user_code", "")
-        for store in visited_stores:
-            cur.execute("""
-                INSERT INTO store_visits (user_code, store_code, store_name, visit_date, report_id, visit_type)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                user_code, 
-                store.get("code", ""), 
-                store.get("name", ""), 
-                original_report["日付"],
-                report_id,
-                "daily_report"
-            ))
+        report_date = result[0]
         
-        conn.commit()
+        # 訪問記録は変更のあった店舗のみ更新
+        sync_store_visits(cur, report_id, "daily_report", [
+            (user_code, store.get("code", ""), store.get("name", ""), report_date)
+            for store in visited_stores
+        ])
+        
+        commit_changes(conn, [("reports", report_id, "update"), ("store_visits", report_id, "update")])
         logging.info(f"日報を編集しました（ID: {report_id}）")
         return True
     except Exception as e:
@@ -462,7 +1530,7 @@ def delete_report(report_id):
         
         # 日報を削除
         cur.execute("DELETE FROM reports WHERE id = %s", (report_id,))
-        conn.commit()
+        commit_changes(conn, [("reports", report_id, "delete"), ("store_visits", report_id, "delete")])
         logging.info(f"日報を削除しました（ID: {report_id}）")
         return True
     except Exception as e:
@@ -511,7 +1579,7 @@ def update_reaction(report_id, user_name, reaction_type):
             (Json(reactions), report_id)
         )
         
-        conn.commit()
+        commit_changes(conn, [("reports", report_id, "reaction")])
         logging.info(f"リアクションを更新しました（ID: {report_id}, ユーザー: {user_name}, タイプ: {reaction_type}）")
         return True
     except Exception as e:
@@ -554,19 +1622,17 @@ def save_comment(report_id, comment):
             (Json(comments), report_id)
         )
         
-        conn.commit()
-        logging.info(f"コメントを追加しました（ID: {report_id}, ユーザー: {comment['投稿者']}）")
-        
-        # 投稿主に通知を送信（自分自身へのコメント以外）
+        # 投稿主への通知（自分自身へのコメント以外）はアウトボックス経由で非同期に作成
         if comment["投稿者"] != report_author:
-            notification_content = f"{comment['投稿者']}さんがあなたの投稿にコメントしました。投稿: {report_date}"
-            create_notification(
-                report_author, 
-                notification_content,
-                "report", 
-                report_id
-            )
-            logging.info(f"{report_author}さんに通知を送信しました")
+            enqueue_notification_event(cur, "comment_posted", {
+                "report_id": report_id,
+                "report_author": report_author,
+                "commenter": comment["投稿者"],
+                "report_date": str(report_date)
+            })
+        
+        commit_changes(conn, [("reports", report_id, "comment")])
+        logging.info(f"コメントを追加しました（ID: {report_id}, ユーザー: {comment['投稿者']}）")
         
         return True
     except Exception as e:
@@ -578,6 +1644,7 @@ def save_comment(report_id, comment):
         if conn:
             conn.close()
 
+@cached_query("reports", default=[])
 def load_commented_reports(user_name):
     """自分がコメントした日報を取得"""
     conn = None
@@ -609,7 +1676,7 @@ def load_commented_reports(user_name):
         return result
     except Exception as e:
         logging.error(f"コメント付き日報取得エラー: {e}")
-        return []
+        raise
     finally:
         if conn:
             conn.close()
@@ -691,6 +1758,7 @@ def search_reports(search_query):
         if conn:
             conn.close()
 
+@cached_query("notices", default=[])
 def load_notices(department=None):
     """お知らせを取得（最新の投稿順にソート）"""
     conn = None
@@ -723,7 +1791,7 @@ def load_notices(department=None):
         return result
     except Exception as e:
         logging.error(f"お知らせ取得エラー: {e}")
-        return []
+        raise
     finally:
         if conn:
             conn.close()
@@ -749,7 +1817,7 @@ def save_notice(notice):
             logging.error("お知らせ保存失敗: レコードの挿入に失敗しました")
             return None
         notice_id = result[0]
-        conn.commit()
+        commit_changes(conn, [("notices", notice_id, "insert")])
         logging.info(f"お知らせを保存しました（ID: {notice_id}）")
         return notice_id
     except Exception as e:
@@ -761,6 +1829,7 @@ def save_notice(notice):
         if conn:
             conn.close()
 
+@cached_query("reports", default=[])
 def load_reports_by_date(start_date, end_date, depart=None):
     """指定された期間の日報を取得"""
     conn = None
@@ -795,7 +1864,96 @@ def load_reports_by_date(start_date, end_date, depart=None):
         return result
     except Exception as e:
         logging.error(f"日報取得エラー (期間: {start_date} 〜 {end_date}): {e}")
-        return []
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+def iter_reports_by_date(start_date, end_date, depart=None):
+    """指定された期間の日報をエクスポート用に少しずつ取得するジェネレーター
+    
+    名前付き（サーバーサイド）カーソルで EXPORT_FETCH_SIZE 行ずつ取得するため、
+    期間内の日報が多くてもメモリ上には一度に全件を持たない。
+    エクスポートで使う列だけを取得する（リアクション・コメントは含まない）。
+    途中でエラーが発生した場合は不完全なファイルを作らないよう例外をそのまま送出する。
+    
+    Yields:
+        日報の辞書（日付の新しい順）
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(name="export_reports", cursor_factory=RealDictCursor)
+        cur.itersize = EXPORT_FETCH_SIZE
+        
+        query = """
+            SELECT 投稿者, 所属部署, 日付, visited_stores, 投稿日時, 実施内容, 所感, 今後のアクション
+            FROM reports
+            WHERE 日付 BETWEEN %s AND %s
+        """
+        params = [start_date, end_date]
+        
+        if depart:
+            query += " AND 所属部署 = %s"
+            params.append(depart)
+        
+        query += " ORDER BY 日付 DESC, 投稿日時 DESC"
+        
+        cur.execute(query, params)
+        for report in cur:
+            if isinstance(report["visited_stores"], str):
+                report["visited_stores"] = json.loads(report["visited_stores"])
+            yield dict(report)
+    except Exception as e:
+        logging.error(f"日報エクスポート取得エラー (期間: {start_date} 〜 {end_date}): {e}")
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+def count_reports_by_date(start_date, end_date, depart=None):
+    """指定された期間の日報の件数を取得（エクスポートの進捗表示用）"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        query = "SELECT COUNT(*) FROM reports WHERE 日付 BETWEEN %s AND %s"
+        params = [start_date, end_date]
+        
+        if depart:
+            query += " AND 所属部署 = %s"
+            params.append(depart)
+        
+        cur.execute(query, params)
+        return cur.fetchone()[0]
+    except Exception as e:
+        logging.error(f"日報件数取得エラー (期間: {start_date} 〜 {end_date}): {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def get_data_versions(tables):
+    """テーブルごとのデータバージョンを取得（エクスポートファイルのキャッシュ判定用）
+    
+    バージョンは DATA_VERSION_TABLES のテーブルへの書き込みをコミットするたびに commit_changes で1ずつ上がり、
+    プロセスの再起動後も変わらない。
+    
+    Returns:
+        {テーブル名: バージョン} の辞書（一度も変更されていないテーブルは0）。エラーの場合は None
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT table_name, version FROM data_versions WHERE table_name = ANY(%s)", (list(tables),))
+        versions = dict.fromkeys(tables, 0)
+        versions.update(cur.fetchall())
+        return versions
+    except Exception as e:
+        logging.error(f"データバージョン取得エラー: {e}")
+        return None
     finally:
         if conn:
             conn.close()
@@ -828,7 +1986,7 @@ def mark_notice_as_read(notice_id, user_name):
                 (Json(read_users), notice_id)
             )
             
-            conn.commit()
+            commit_changes(conn, [("notices", notice_id, "update")])
             logging.info(f"お知らせを既読にしました（ID: {notice_id}, ユーザー: {user_name}）")
         
         return True
@@ -853,7 +2011,7 @@ def create_notification(user_name, content, link_type, link_id):
             VALUES (%s, %s, %s, %s)
         """, (user_name, content, link_type, link_id))
         
-        conn.commit()
+        commit_changes(conn, [("notifications", user_name, "insert")])
         logging.info(f"通知を作成しました（ユーザー: {user_name}）")
         return True
     except Exception as e:
@@ -865,6 +2023,7 @@ def create_notification(user_name, content, link_type, link_id):
         if conn:
             conn.close()
 
+@cached_query("notifications", default=[])
 def get_user_notifications(user_name, unread_only=False):
     """ユーザーの通知を取得"""
     conn = None
@@ -891,7 +2050,7 @@ def get_user_notifications(user_name, unread_only=False):
         return result
     except Exception as e:
         logging.error(f"通知取得エラー: {e}")
-        return []
+        raise
     finally:
         if conn:
             conn.close()
@@ -905,7 +2064,7 @@ def mark_notification_as_read(notification_id):
         
         cur.execute("UPDATE notifications SET is_read = TRUE WHERE id = %s", (notification_id,))
         
-        conn.commit()
+        commit_changes(conn, [("notifications", notification_id, "update")])
         logging.info(f"通知を既読にしました（ID: {notification_id}）")
         return True
     except Exception as e:
@@ -917,6 +2076,215 @@ def mark_notification_as_read(notification_id):
         if conn:
             conn.close()
 
+def enqueue_notification_event(cur, event_type, payload):
+    """通知イベントをアウトボックスに登録する
+    
+    呼び出し元のトランザクション内で実行し、元データと同時にコミットされる。
+    通知の作成はバックグラウンドのワーカーが行う。
+    
+    Args:
+        cur: 呼び出し元のカーソル
+        event_type: イベント種別（comment_posted / report_posted / weekly_schedule_posted）
+        payload: 通知作成に必要な情報の辞書
+    """
+    cur.execute("""
+        INSERT INTO notification_outbox (event_type, payload)
+        VALUES (%s, %s)
+    """, (event_type, Json(payload)))
+
+def load_user_name_map():
+    """users_data.jsonから社員コードとユーザー名の対応表を取得"""
+    try:
+        with open("data/users_data.json", "r", encoding="utf-8") as f:
+            users_data = json.load(f)
+        return {user.get("code"): user.get("name") for user in users_data}
+    except Exception as e:
+        logging.error(f"ユーザー名対応表取得エラー: {e}")
+        return {}
+
+def build_outbox_notifications(cur, event_type, payload, user_names):
+    """アウトボックスのイベントから作成する通知のリストを生成
+    
+    Returns:
+        (user_name, content, link_type, link_id) のタプルのリスト
+    """
+    if event_type == "comment_posted":
+        content = f"{payload['commenter']}さんがあなたの投稿にコメントしました。投稿: {payload['report_date']}"
+        return [(payload["report_author"], content, "report", payload["report_id"])]
+    
+    if event_type in ("report_posted", "weekly_schedule_posted"):
+        # お気に入り登録している管理者を取得
+        cur.execute("""
+            SELECT admin_code FROM favorite_members
+            WHERE member_code = %s
+        """, (payload["poster_code"],))
+        admin_codes = [row[0] for row in cur.fetchall()]
+        
+        if event_type == "report_posted":
+            content = f"お気に入りメンバー {payload['poster_name']} さんが新しい日報を投稿しました。日付: {payload['report_date']}"
+            link_type, link_id = "report", payload["report_id"]
+        else:
+            content = f"お気に入りメンバー {payload['poster_name']} さんが新しい週間予定を投稿しました。開始日: {payload['start_date']}"
+            link_type, link_id = "weekly_schedule", payload["schedule_id"]
+        
+        return [
+            (user_names[admin_code], content, link_type, link_id)
+            for admin_code in admin_codes if user_names.get(admin_code)
+        ]
+    
+    raise ValueError(f"不明な通知イベント種別です: {event_type}")
+
+def record_outbox_failures(cur, event_ids, error):
+    """通知イベントの失敗を記録し、指数バックオフで再試行を予約する"""
+    cur.execute("""
+        UPDATE notification_outbox
+        SET attempts = attempts + 1, last_error = %s,
+            next_attempt_at = CURRENT_TIMESTAMP + %s * power(2, attempts) * INTERVAL '1 second'
+        WHERE id = ANY(%s)
+    """, (str(error), OUTBOX_POLL_INTERVAL, list(event_ids)))
+
+def process_notification_outbox(batch_size=OUTBOX_BATCH_SIZE):
+    """通知アウトボックスのイベントをまとめて通知に変換する
+    
+    失敗したイベントは指数バックオフで再試行し、OUTBOX_MAX_ATTEMPTS回失敗した
+    イベントはアウトボックスに残したまま処理対象から外す。
+    
+    Returns:
+        処理したイベント数
+    """
+    conn = None
+    events = []
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        # 他のワーカーが処理中のイベントは飛ばして取得
+        cur.execute("""
+            SELECT id, event_type, payload, attempts,
+                   EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - created_at))
+            FROM notification_outbox
+            WHERE attempts < %s AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (OUTBOX_MAX_ATTEMPTS, batch_size))
+        events = cur.fetchall()
+        
+        if not events:
+            conn.commit()
+            OUTBOX_METRICS["last_run"] = datetime.now()
+            return 0
+        
+        user_names = load_user_name_map()
+        notifications = []
+        delivered_ids = []
+        failed = 0
+        max_lag = 0.0
+        
+        for event_id, event_type, payload, attempts, lag_seconds in events:
+            if isinstance(payload, str):
+                payload = json.loads(payload)
+            
+            cur.execute("SAVEPOINT outbox_event")
+            try:
+                notifications.extend(build_outbox_notifications(cur, event_type, payload, user_names))
+                cur.execute("RELEASE SAVEPOINT outbox_event")
+                delivered_ids.append(event_id)
+                max_lag = max(max_lag, float(lag_seconds or 0))
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT outbox_event")
+                record_outbox_failures(cur, [event_id], e)
+                failed += 1
+                logging.error(f"通知イベント処理エラー（ID: {event_id}, 試行回数: {attempts + 1}）: {e}")
+        
+        # 通知をまとめて作成し、処理済みのイベントを削除
+        if notifications:
+            execute_values(cur, """
+                INSERT INTO notifications (user_name, content, link_type, link_id)
+                VALUES %s
+            """, notifications)
+        if delivered_ids:
+            cur.execute("DELETE FROM notification_outbox WHERE id = ANY(%s)", (delivered_ids,))
+        
+        commit_changes(conn, [("notifications", None, "insert")] if notifications else [])
+        
+        OUTBOX_METRICS["batches"] += 1
+        OUTBOX_METRICS["delivered"] += len(delivered_ids)
+        OUTBOX_METRICS["notifications"] += len(notifications)
+        OUTBOX_METRICS["failed"] += failed
+        OUTBOX_METRICS["last_run"] = datetime.now()
+        if delivered_ids:
+            OUTBOX_METRICS["last_lag_seconds"] = max_lag
+        
+        logging.info(f"通知アウトボックスを処理しました（成功: {len(delivered_ids)}, 失敗: {failed}, 通知: {len(notifications)}）")
+        return len(events)
+    except Exception as e:
+        logging.error(f"通知アウトボックス処理エラー: {e}")
+        if conn:
+            conn.rollback()
+            # 通知の作成やコミットで失敗した場合も、取り出したイベントの試行回数を進める
+            # （同じバッチを上限なく再試行し続けないように）
+            if events:
+                try:
+                    record_outbox_failures(conn.cursor(), [event[0] for event in events], e)
+                    conn.commit()
+                    OUTBOX_METRICS["failed"] += len(events)
+                except Exception as retry_error:
+                    logging.error(f"通知イベントの失敗記録エラー: {retry_error}")
+                    conn.rollback()
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+def get_outbox_metrics():
+    """通知アウトボックスの処理状況（未処理件数・遅延秒数など）を取得"""
+    metrics = dict(OUTBOX_METRICS)
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        cur.execute("""
+            SELECT
+                COUNT(*) FILTER (WHERE attempts < %s),
+                COUNT(*) FILTER (WHERE attempts >= %s),
+                EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - MIN(created_at) FILTER (WHERE attempts < %s)))
+            FROM notification_outbox
+        """, (OUTBOX_MAX_ATTEMPTS, OUTBOX_MAX_ATTEMPTS, OUTBOX_MAX_ATTEMPTS))
+        pending, dead, lag_seconds = cur.fetchone()
+        
+        metrics["pending"] = pending
+        metrics["dead"] = dead
+        metrics["lag_seconds"] = float(lag_seconds) if lag_seconds is not None else 0.0
+        return metrics
+    except Exception as e:
+        logging.error(f"通知アウトボックス統計取得エラー: {e}")
+        return metrics
+    finally:
+        if conn:
+            conn.close()
+
+def start_outbox_worker(interval=OUTBOX_POLL_INTERVAL):
+    """通知アウトボックスを処理するバックグラウンドスレッドを起動（プロセスごとに1つ）"""
+    global outbox_worker_thread
+    
+    with outbox_worker_lock:
+        if outbox_worker_thread is not None and outbox_worker_thread.is_alive():
+            return outbox_worker_thread
+        
+        def run():
+            while True:
+                processed = process_notification_outbox()
+                # バッチが満杯だった場合は待たずに続きを処理
+                if processed < OUTBOX_BATCH_SIZE:
+                    time.sleep(interval)
+        
+        outbox_worker_thread = threading.Thread(target=run, name="notification-outbox-worker", daemon=True)
+        outbox_worker_thread.start()
+        logging.info("通知アウトボックスワーカーを起動しました")
+        return outbox_worker_thread
+
 def save_weekly_schedule(schedule):
     """週間予定を保存（新規または更新）"""
     conn = None
@@ -934,67 +2302,34 @@ def save_weekly_schedule(schedule):
         
         # 各曜日の訪問店舗データを取得
         visited_stores = {
-            "月曜日_visited_stores": schedule.get("月曜日_visited_stores", []),
-            "火曜日_visited_stores": schedule.get("火曜日_visited_stores", []),
-            "水曜日_visited_stores": schedule.get("水曜日_visited_stores", []),
-            "木曜日_visited_stores": schedule.get("木曜日_visited_stores", []),
-            "金曜日_visited_stores": schedule.get("金曜日_visited_stores", []),
-            "土曜日_visited_stores": schedule.get("土曜日_visited_stores", []),
-            "日曜日_visited_stores": schedule.get("日曜日_visited_stores", [])
+            f"{weekday}_visited_stores": schedule.get(f"{weekday}_visited_stores", [])
+            for weekday in WEEKDAYS
         }
         
+        # 期間フィールドを生成（開始日から終了日まで）
+        period = f"{schedule['開始日']} 〜 {schedule['終了日']}"
+        
         if is_update:
-            # 期間フィールドを生成（開始日から終了日まで）
-            period = f"{schedule['開始日']} 〜 {schedule['終了日']}"
-            
             # 既存のレコードを更新
             cur.execute("""
                 UPDATE weekly_schedules SET
-                開始日 = %s, 終了日 = %s, 期間 = %s,
-                月曜日 = %s, 火曜日 = %s, 水曜日 = %s, 木曜日 = %s,
-                金曜日 = %s, 土曜日 = %s, 日曜日 = %s,
-                月曜日_visited_stores = %s, 火曜日_visited_stores = %s, 水曜日_visited_stores = %s, 
-                木曜日_visited_stores = %s, 金曜日_visited_stores = %s, 土曜日_visited_stores = %s, 
-                日曜日_visited_stores = %s
+                開始日 = %s, 終了日 = %s, 期間 = %s
                 WHERE id = %s
                 RETURNING id
-            """, (
-                schedule["開始日"], schedule["終了日"], period,
-                schedule["月曜日"], schedule["火曜日"], schedule["水曜日"], schedule["木曜日"],
-                schedule["金曜日"], schedule["土曜日"], schedule["日曜日"],
-                Json(visited_stores["月曜日_visited_stores"]), Json(visited_stores["火曜日_visited_stores"]), 
-                Json(visited_stores["水曜日_visited_stores"]), Json(visited_stores["木曜日_visited_stores"]), 
-                Json(visited_stores["金曜日_visited_stores"]), Json(visited_stores["土曜日_visited_stores"]), 
-                Json(visited_stores["日曜日_visited_stores"]),
-                schedule["id"]
-            ))
+            """, (schedule["開始日"], schedule["終了日"], period, schedule["id"]))
             
             # IDを取得
             schedule_id = schedule["id"]
             
-            # 既存の訪問記録を削除
-            cur.execute("DELETE FROM store_visits WHERE report_id = %s AND visit_type = 'weekly_schedule'", (schedule_id,))
-            
         else:
-            # 期間フィールドを生成（開始日から終了日まで）
-            period = f"{schedule['開始日']} 〜 {schedule['終了日']}"
-            
             # 新規レコードを挿入
             cur.execute("""
-                INSERT INTO weekly_schedules 
-                (投稿者, 開始日, 終了日, 期間, 月曜日, 火曜日, 水曜日, 木曜日, 金曜日, 土曜日, 日曜日, 投稿日時,
-                月曜日_visited_stores, 火曜日_visited_stores, 水曜日_visited_stores, 木曜日_visited_stores, 
-                金曜日_visited_stores, 土曜日_visited_stores, 日曜日_visited_stores)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                INSERT INTO weekly_schedules (投稿者, user_code, 開始日, 終了日, 期間, 投稿日時)
+                VALUES (%s, %s, %s, %s, %s, %s)
                 RETURNING id
             """, (
-                schedule["投稿者"], schedule["開始日"], schedule["終了日"], period,
-                schedule["月曜日"], schedule["火曜日"], schedule["水曜日"], schedule["木曜日"],
-                schedule["金曜日"], schedule["土曜日"], schedule["日曜日"], schedule["投稿日時"],
-                Json(visited_stores["月曜日_visited_stores"]), Json(visited_stores["火曜日_visited_stores"]), 
-                Json(visited_stores["水曜日_visited_stores"]), Json(visited_stores["木曜日_visited_stores"]), 
-                Json(visited_stores["金曜日_visited_stores"]), Json(visited_stores["土曜日_visited_stores"]), 
-                Json(visited_stores["日曜日_visited_stores"])
+                schedule["投稿者"], schedule.get("user_code", ""), schedule["開始日"],
+                schedule["終了日"], period, schedule["投稿日時"]
             ))
             
             # 新規IDを取得
@@ -1004,71 +2339,49 @@ def save_weekly_schedule(schedule):
                 return None
             schedule_id = result[0]
         
-        # 店舗訪問記録を保存
-        user_code = schedule.get("user_code", "")
+        # 曜日ごとの予定を日単位の行として保存（更新時は既存行を上書き）
         start_date = datetime.strptime(schedule["開始日"], "%Y-%m-%d").date()
+        execute_values(cur, """
+            INSERT INTO schedule_days (schedule_id, user_code, 投稿者, day_date, weekday, plan, visited_stores)
+            VALUES %s
+            ON CONFLICT (schedule_id, weekday) DO UPDATE SET
+            day_date = EXCLUDED.day_date, plan = EXCLUDED.plan, visited_stores = EXCLUDED.visited_stores
+        """, [
+            (schedule_id, schedule.get("user_code", ""), schedule["投稿者"], start_date + timedelta(days=i),
+             weekday, schedule[weekday], Json(visited_stores[f"{weekday}_visited_stores"]))
+            for i, weekday in enumerate(WEEKDAYS)
+        ], page_size=len(WEEKDAYS))
         
-        # 曜日ごとに店舗訪問を記録
-        weekdays = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
-        for i, weekday in enumerate(weekdays):
-            visit_date = start_date + timedelta(days=i)
-            stores_key = f"{weekday}_visited_stores"
-            
-            for store in visited_stores[stores_key]:
-                cur.execute("""
-                    INSERT INTO store_visits (user_code, store_code, store_name, visit_date, report_id, visit_type)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    user_code, 
-                    store.get("code", ""), 
-                    store.get("name", ""), 
-                    visit_date,
-                    schedule_id,
-                    "weekly_schedule"
-                ))
+        # 店舗訪問記録を保存
+        user_code = schedule.get("user_code", "")
         
-        conn.commit()
-        logging.info(f"週間予定を保存しました（ID: {schedule_id}）")
+        # 曜日ごとの店舗訪問を記録（更新時は変更のあった行のみ）
+        visits = [
+            (user_code, store.get("code", ""), store.get("name", ""), start_date + timedelta(days=i))
+            for i, weekday in enumerate(WEEKDAYS)
+            for store in visited_stores[f"{weekday}_visited_stores"]
+        ]
+        if is_update:
+            sync_store_visits(cur, schedule_id, "weekly_schedule", visits)
+        else:
+            insert_store_visits(cur, [visit + (schedule_id, "weekly_schedule") for visit in visits])
         
-        # お気に入りメンバーに登録されているユーザーが週間予定を投稿した場合、管理者に通知
+        # お気に入りメンバーの週間予定投稿通知（新規投稿の場合のみ）はアウトボックス経由で非同期に作成
         poster_code = schedule.get("user_code", "")
-        poster_name = schedule.get("投稿者", "")
-        if poster_code and not is_update:  # 新規投稿の場合のみ通知
-            try:
-                # お気に入り登録している管理者を取得
-                cur.execute("""
-                    SELECT admin_code FROM favorite_members
-                    WHERE member_code = %s
-                """, (poster_code,))
-                admin_results = cur.fetchall()
-                
-                # 管理者に通知
-                for admin_row in admin_results:
-                    admin_code = admin_row[0]
-                    
-                    # 管理者のユーザー名を取得
-                    admin_name = None
-                    try:
-                        with open("data/users_data.json", "r", encoding="utf-8") as f:
-                            users_data = json.load(f)
-                            for user in users_data:
-                                if user.get("code") == admin_code:
-                                    admin_name = user.get("name")
-                                    break
-                    except Exception as e:
-                        logging.error(f"管理者ユーザー名取得エラー: {e}")
-                    
-                    if admin_name:
-                        notification_content = f"お気に入りメンバー {poster_name} さんが新しい週間予定を投稿しました。開始日: {schedule['開始日']}"
-                        create_notification(
-                            admin_name,
-                            notification_content,
-                            "weekly_schedule",
-                            schedule_id
-                        )
-                        logging.info(f"お気に入りメンバーの週間予定投稿通知を作成: 管理者 {admin_name}, メンバー {poster_name}")
-            except Exception as e:
-                logging.error(f"お気に入りメンバー通知作成エラー: {e}")
+        if poster_code and not is_update:
+            enqueue_notification_event(cur, "weekly_schedule_posted", {
+                "schedule_id": schedule_id,
+                "poster_code": poster_code,
+                "poster_name": schedule.get("投稿者", ""),
+                "start_date": str(schedule["開始日"])
+            })
+        
+        commit_changes(conn, [
+            ("weekly_schedules", schedule_id, "update" if is_update else "insert"),
+            ("schedule_days", schedule_id, "update" if is_update else "insert"),
+            ("store_visits", schedule_id, "update" if is_update else "insert")
+        ])
+        logging.info(f"週間予定を保存しました（ID: {schedule_id}）")
         
         return schedule_id
     except Exception as e:
@@ -1080,98 +2393,233 @@ def save_weekly_schedule(schedule):
         if conn:
             conn.close()
 
-def load_weekly_schedules():
-    """週間予定を取得（最新の投稿順にソート）"""
+@cached_query("weekly_schedules", "schedule_days", default=[])
+def load_weekly_schedules(user_name=None, user_code=None, start_date=None, end_date=None,
+                          posted_since=None, limit=None):
+    """週間予定を取得（最新の投稿順にソート）
+    
+    Args:
+        user_name: 投稿者名で絞り込み
+        user_code: 投稿者のユーザーコードで絞り込み
+        start_date: 開始日がこの日以降の予定に絞り込み
+        end_date: 開始日がこの日以前の予定に絞り込み
+        posted_since: 投稿日時がこの日時以降の予定に絞り込み
+        limit: 取得件数の上限
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        query = "SELECT * FROM weekly_schedules_compat WHERE 1=1"
+        params = []
+        if user_code:
+            query += " AND user_code = %s"
+            params.append(user_code)
+        if user_name:
+            query += " AND 投稿者 = %s"
+            params.append(user_name)
+        if start_date:
+            query += " AND 開始日 >= %s"
+            params.append(start_date)
+        if end_date:
+            query += " AND 開始日 <= %s"
+            params.append(end_date)
+        if posted_since:
+            query += " AND 投稿日時 >= %s"
+            params.append(posted_since)
+        query += " ORDER BY 投稿日時 DESC"
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
+        
+        cur.execute(query, params)
+        
+        schedules = cur.fetchall()
+        
+        # 辞書形式に変換
+        result = []
+        for schedule in schedules:
+            if isinstance(schedule["コメント"], str):
+                schedule["コメント"] = json.loads(schedule["コメント"])
+                
+            # 各曜日の訪問店舗データを変換
+            for day in WEEKDAYS:
+                key = f"{day}_visited_stores"
+                if isinstance(schedule[key], str):
+                    schedule[key] = json.loads(schedule[key])
+                    
+            result.append(dict(schedule))
+        
+        return result
+    except Exception as e:
+        logging.error(f"週間予定取得エラー: {e}")
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+def get_daily_schedule(target_date, user_code=None, user_name=None):
+    """指定日の予定を取得（同じ日を含む週間予定が複数ある場合は最新の投稿を優先）
+    
+    Returns:
+        {"schedule_id", "day_date", "weekday", "plan", "visited_stores"} の辞書、予定がない場合は None
+    """
+    if not user_code and not user_name:
+        return None
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        column = "d.user_code" if user_code else "d.投稿者"
+        cur.execute(f"""
+            SELECT d.schedule_id, d.day_date, d.weekday, d.plan, d.visited_stores
+            FROM schedule_days d
+            JOIN weekly_schedules w ON w.id = d.schedule_id
+            WHERE {column} = %s AND d.day_date = %s
+            ORDER BY w.投稿日時 DESC
+            LIMIT 1
+        """, (user_code or user_name, target_date))
+        
+        day = cur.fetchone()
+        return dict(day) if day else None
+    except Exception as e:
+        logging.error(f"日別予定取得エラー: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def get_schedule_days(start_date, end_date, user_code=None, user_name=None):
+    """期間内の日別予定を日付順に取得（ユーザー指定がなければ全員分）"""
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        cur.execute("""
-            SELECT * FROM weekly_schedules 
-            ORDER BY 投稿日時 DESC
-        """)
-        
-        schedules = cur.fetchall()
-        
-        # 辞書形式に変換
-        result = []
-        for schedule in schedules:
-            if isinstance(schedule["コメント"], str):
-                schedule["コメント"] = json.loads(schedule["コメント"])
-                
-            # 各曜日の訪問店舗データを変換
-            for day in ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]:
-                key = f"{day}_visited_stores"
-                if isinstance(schedule[key], str):
-                    schedule[key] = json.loads(schedule[key])
-                    
-            result.append(dict(schedule))
+        query = """
+            SELECT schedule_id, user_code, 投稿者, day_date, weekday, plan, visited_stores
+            FROM schedule_days
+            WHERE day_date BETWEEN %s AND %s
+        """
+        params = [start_date, end_date]
+        if user_code:
+            query += " AND user_code = %s"
+            params.append(user_code)
+        elif user_name:
+            query += " AND 投稿者 = %s"
+            params.append(user_name)
+        query += " ORDER BY day_date, 投稿者"
         
-        return result
+        cur.execute(query, params)
+        return [dict(day) for day in cur.fetchall()]
     except Exception as e:
-        logging.error(f"週間予定取得エラー: {e}")
+        logging.error(f"日別予定取得エラー: {e}")
         return []
     finally:
         if conn:
             conn.close()
 
-def add_weekly_schedule_columns():
-    """週間予定テーブルに必要なカラムを追加"""
+@cached_query("weekly_schedules", "schedule_days", default=[])
+def get_weekly_schedule_grid(start_date, user_name=None):
+    """指定週の全メンバーの予定を「メンバー × 曜日」の表として取得
+    
+    Args:
+        start_date: 週の開始日（月曜日）
+        user_name: 指定した場合はその投稿者のみ
+        
+    Returns:
+        投稿者順のリスト [{"id", "投稿者", "開始日", "終了日", "投稿日時", "コメント",
+        "days": {"月曜日": {"plan": 予定, "stores": "店舗A, 店舗B"}, ...}}, ...]
+    """
     conn = None
     try:
         conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # weekly_schedules テーブルにコメントカラムが存在するか確認
-        cur.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = 'weekly_schedules' AND column_name = 'コメント'
-        """)
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        if not cur.fetchone():
-            # コメントカラムを追加
-            cur.execute("""
-                ALTER TABLE weekly_schedules
-                ADD COLUMN コメント JSONB DEFAULT '[]'
-            """)
-            conn.commit()
-            logging.info("weekly_schedules テーブルにコメントカラムを追加しました")
+        query = """
+            SELECT w.id, w.投稿者, w.開始日, w.終了日, w.投稿日時, w.コメント,
+                   jsonb_object_agg(d.weekday, jsonb_build_object(
+                       'plan', d.plan,
+                       'stores', (
+                           SELECT string_agg(store->>'name', ', ')
+                           FROM jsonb_array_elements(d.visited_stores) AS store
+                       )
+                   )) AS days
+            FROM weekly_schedules w
+            JOIN schedule_days d ON d.schedule_id = w.id
+            WHERE w.開始日 = %s
+        """
+        params = [start_date]
+        if user_name:
+            query += " AND w.投稿者 = %s"
+            params.append(user_name)
+        query += " GROUP BY w.id ORDER BY w.投稿者, w.投稿日時 DESC"
         
-        # 期間カラムが存在するか確認
-        cur.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = 'weekly_schedules' AND column_name = '期間'
-        """)
+        cur.execute(query, params)
+        return [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        logging.error(f"週間予定一覧取得エラー: {e}")
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+@cached_query("schedule_days", default=[])
+def get_planned_stores(start_date, end_date=None, user_code=None, user_name=None):
+    """指定日（または期間）に予定している訪問店舗を重複なしで取得
+    
+    Args:
+        start_date: 対象日（end_date を指定した場合は期間の開始日）
+        end_date: 期間の終了日（省略時は start_date の1日のみ）
+        user_code: ユーザーコード
+        user_name: ユーザー名（user_code がない場合に使用）
         
-        if not cur.fetchone():
-            # 期間カラムを追加
-            cur.execute("""
-                ALTER TABLE weekly_schedules
-                ADD COLUMN 期間 TEXT
-            """)
-            
-            # 既存のレコードの期間を更新
-            cur.execute("""
-                UPDATE weekly_schedules
-                SET 期間 = 開始日 || ' 〜 ' || 終了日
-                WHERE 期間 IS NULL
-            """)
-            
-            conn.commit()
-            logging.info("weekly_schedules テーブルに期間カラムを追加しました")
+    Returns:
+        日付順の店舗リスト [{"key": "コード: 店舗名", "label": "月曜日の予定: 店舗名",
+        "code", "name", "day_date", "weekday"}, ...]。key はそのまま選択肢に使える。
+    """
+    if not user_code and not user_name:
+        return []
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        conn.commit()
+        column = "d.user_code" if user_code else "d.投稿者"
+        cur.execute(f"""
+            SELECT * FROM (
+                SELECT DISTINCT ON (code, name) code, name, d.day_date, d.weekday
+                FROM schedule_days d
+                CROSS JOIN LATERAL jsonb_array_elements(d.visited_stores) AS store
+                CROSS JOIN LATERAL (
+                    SELECT COALESCE(store->>'code', '') AS code, COALESCE(store->>'name', '') AS name
+                ) s
+                WHERE {column} = %s AND d.day_date BETWEEN %s AND %s
+                ORDER BY code, name, d.day_date
+            ) planned
+            ORDER BY day_date, name
+        """, (user_code or user_name, start_date, end_date or start_date))
+        
+        stores = []
+        for row in cur.fetchall():
+            store = dict(row)
+            store["key"] = f"{store['code']}: {store['name']}"
+            store["label"] = f"{store['weekday']}の予定: {store['name']}"
+            stores.append(store)
+        return stores
     except Exception as e:
-        logging.error(f"週間予定テーブルカラム追加エラー: {e}")
-        if conn:
-            conn.rollback()
+        logging.error(f"予定店舗取得エラー: {e}")
+        raise
     finally:
         if conn:
             conn.close()
 
+def add_weekly_schedule_columns():
+    """週間予定テーブルに必要なカラムを追加（マイグレーション version 3 で管理）"""
+    ensure_schema()
+
 def save_weekly_schedule_comment(schedule_id, comment):
     """週間予定にコメントを追加"""
     conn = None
@@ -1200,7 +2648,7 @@ def save_weekly_schedule_comment(schedule_id, comment):
             (Json(comments), schedule_id)
         )
         
-        conn.commit()
+        commit_changes(conn, [("weekly_schedules", schedule_id, "comment")])
         logging.info(f"週間予定にコメントを追加しました（ID: {schedule_id}, ユーザー: {comment['投稿者']}）")
         return True
     except Exception as e:
@@ -1335,8 +2783,74 @@ def search_stores(search_term):
         logging.error(f"店舗検索エラー: {e}")
         return []
 
+def load_visit_reports(cur, rollup_rows):
+    """store_visit_rollup の行が参照する日報（daily_report）を1回のクエリでまとめて取得
+    
+    Returns:
+        日報IDをキー、{"id", "日付", "実施内容", "今後のアクション"} を値とする辞書
+    """
+    report_ids = sorted({
+        report_id
+        for row in rollup_rows if row["visit_type"] == "daily_report"
+        for report_id in row["report_ids"]
+    })
+    if not report_ids:
+        return {}
+    cur.execute("""
+        SELECT id, 日付, 実施内容, 今後のアクション
+        FROM reports
+        WHERE id = ANY(%s)
+    """, (report_ids,))
+    return {row["id"]: row for row in cur.fetchall()}
+
+def build_store_visit_stats(rollup_rows, reports):
+    """store_visit_rollup の行を店舗ごとの訪問統計にまとめる
+    
+    Args:
+        rollup_rows: store_visit_rollup の行
+        reports: load_visit_reports() で取得した日報（日付ごとの訪問内容に使用）
+        
+    Returns:
+        訪問回数の多い順の店舗リスト [{"code", "name", "count", "dates", "details"}, ...]
+    """
+    stats = {}
+    for row in rollup_rows:
+        key = (row["store_code"], row["store_name"])
+        if key not in stats:
+            stats[key] = {"code": row["store_code"], "name": row["store_name"], "dates": set(), "contents": {}}
+        stats[key]["dates"].update(row["visit_dates"])
+        if row["visit_type"] == "daily_report":
+            for report_id in row["report_ids"]:
+                report = reports.get(report_id)
+                if report and report["日付"]:
+                    content = stats[key]["contents"].setdefault(report["日付"], {"content": "", "action": ""})
+                    content["content"] = report["実施内容"] or content["content"]
+                    content["action"] = report["今後のアクション"] or content["action"]
+    
+    result = []
+    for store in stats.values():
+        # 訪問日の新しい順
+        visit_dates = sorted(store["dates"], reverse=True)
+        details = []
+        for visit_date in visit_dates:
+            content = store["contents"].get(visit_date, {"content": "", "action": ""})
+            details.append({
+                "date": visit_date.strftime("%Y-%m-%d"),
+                "content": content["content"],
+                "action": content["action"]
+            })
+        result.append({
+            "code": store["code"],
+            "name": store["name"],
+            "count": len(visit_dates),
+            "dates": [detail["date"] for detail in details],
+            "details": details  # 日付ごとの訪問内容
+        })
+    return sorted(result, key=lambda x: x["count"], reverse=True)
+
+@cached_query("store_visits", "reports", default=[])
 def get_store_visit_stats(user_code=None, year=None, month=None, user_name=None):
-    """月ごとの店舗訪問統計を取得
+    """月ごとの店舗訪問統計を取得（集計テーブル store_visit_rollup から）
     
     Args:
         user_code: ユーザーコード（社員コード）
@@ -1344,69 +2858,44 @@ def get_store_visit_stats(user_code=None, year=None, month=None, user_name=None)
         month: 月
         user_name: ユーザー名
     """
-    visits = get_user_store_visits(user_code=user_code, user_name=user_name, year=year, month=month)
-    
-    # 店舗ごとの訪問回数を集計
-    stats = {}
-    for visit in visits:
-        store_code = visit["store_code"]
-        store_name = visit["store_name"]
-        key = f"{store_code}:{store_name}"
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        if key not in stats:
-            stats[key] = {
-                "code": store_code,
-                "name": store_name,
-                "count": 0,
-                "dates": [],
-                "details": []  # 日付ごとの訪問内容
-            }
-        
-        # visit_dateがdatetimeかdate型の場合は文字列に変換する
-        if isinstance(visit["visit_date"], (datetime, date)):
-            visit_date = visit["visit_date"].strftime("%Y-%m-%d")
+        # ユーザー名のみ指定されている場合は日報からユーザーコードを求める
+        if user_code:
+            user_codes = [user_code]
+        elif user_name:
+            cur.execute(
+                "SELECT DISTINCT COALESCE(user_code, '') AS user_code FROM reports WHERE 投稿者 = %s",
+                (user_name,)
+            )
+            user_codes = [row["user_code"] for row in cur.fetchall()]
         else:
-            # 既に文字列として保存されている場合はそのまま使用
-            visit_date = str(visit["visit_date"])
-        
-        # 訪問内容を取得
-        visit_content = ""
-        if visit.get("実施内容"):
-            visit_content = visit["実施内容"]
-        
-        # 今後のアクションを取得
-        visit_action = ""
-        if visit.get("今後のアクション"):
-            visit_action = visit["今後のアクション"]
-        
-        # 日付と内容をセットで保存
-        visit_detail = {
-            "date": visit_date,
-            "content": visit_content,
-            "action": visit_action
-        }
+            # どちらも指定されていない場合は空のリストを返す
+            return []
         
-        # 同じ日付の既存エントリがあるか確認
-        date_exists = False
-        for i, detail in enumerate(stats[key]["details"]):
-            if detail["date"] == visit_date:
-                date_exists = True
-                # 内容が異なる場合は更新
-                if visit_content and visit_content != detail["content"]:
-                    stats[key]["details"][i]["content"] = visit_content
-                # 今後のアクションが異なる場合は更新
-                if visit_action and visit_action != detail.get("action", ""):
-                    stats[key]["details"][i]["action"] = visit_action
-                break
-                
-        if not date_exists and visit_date not in [d["date"] for d in stats[key]["details"]]:
-            stats[key]["details"].append(visit_detail)
-            stats[key]["dates"].append(visit_date)
-            stats[key]["count"] += 1
-    
-    # 結果をリスト形式で返す
-    result = [stats[key] for key in stats]
-    return sorted(result, key=lambda x: x["count"], reverse=True)
+        if not user_codes:
+            return []
+        
+        query = "SELECT * FROM store_visit_rollup WHERE user_code = ANY(%s)"
+        params = [user_codes]
+        
+        # 年月フィルタ
+        if year and month:
+            query += " AND month = %s"
+            params.append(date(int(year), int(month), 1))
+        
+        cur.execute(query, params)
+        rollup_rows = cur.fetchall()
+        return build_store_visit_stats(rollup_rows, load_visit_reports(cur, rollup_rows))
+    except Exception as e:
+        logging.error(f"店舗訪問統計取得エラー: {e}")
+        raise
+    finally:
+        if conn:
+            conn.close()
 
 def save_stores_data(stores_data):
     """店舗データをJSONファイルに保存"""
@@ -1424,6 +2913,7 @@ def save_stores_data(stores_data):
         logging.error(f"店舗データ保存エラー: {e}")
         return False
 
+@cached_query("reports", default=[])
 def get_monthly_report_count(user_code=None, user_name=None, year=None, month=None):
     """月ごとの日報投稿数を取得
     
@@ -1442,12 +2932,13 @@ def get_monthly_report_count(user_code=None, user_name=None, year=None, month=No
         conn = get_db_connection()
         cur = conn.cursor()
         
+        # 集計テーブル（report_counts_monthly）から取得
         query = """
             SELECT 
                 投稿者, 
-                TO_CHAR(日付, 'YYYY-MM') AS 年月, 
-                COUNT(*) AS 投稿数
-            FROM reports
+                TO_CHAR(month, 'YYYY-MM') AS 年月, 
+                SUM(report_count) AS 投稿数
+            FROM report_counts_monthly
             WHERE 1=1
         """
         params = []
@@ -1461,14 +2952,16 @@ def get_monthly_report_count(user_code=None, user_name=None, year=None, month=No
             query += " AND 投稿者 = %s"
             params.append(user_name)
         
-        # 年月フィルタ
+        # 年月フィルタ（月初日の範囲で絞り込み）
         if year:
-            query += " AND EXTRACT(YEAR FROM 日付) = %s"
-            params.append(year)
-            
             if month:
-                query += " AND EXTRACT(MONTH FROM 日付) = %s"
-                params.append(month)
+                start_month = date(int(year), int(month), 1)
+                end_month = date(int(year) + int(month) // 12, int(month) % 12 + 1, 1)
+            else:
+                start_month = date(int(year), 1, 1)
+                end_month = date(int(year) + 1, 1, 1)
+            query += " AND month >= %s AND month < %s"
+            params.extend([start_month, end_month])
         
         query += " GROUP BY 投稿者, 年月 ORDER BY 年月 DESC, 投稿数 DESC"
         
@@ -1487,11 +2980,12 @@ def get_monthly_report_count(user_code=None, user_name=None, year=None, month=No
         return data
     except Exception as e:
         logging.error(f"日報投稿数統計取得エラー: {e}")
-        return []
+        raise
     finally:
         if conn:
             conn.close()
 
+@cached_query("reports", default={})
 def get_user_monthly_report_summary(user_code=None, user_name=None):
     """特定ユーザーの年月ごとの日報投稿数サマリーを取得
     
@@ -1512,11 +3006,12 @@ def get_user_monthly_report_summary(user_code=None, user_name=None):
         conn = get_db_connection()
         cur = conn.cursor()
         
+        # 集計テーブル（report_counts_monthly）から取得
         query = """
             SELECT 
-                TO_CHAR(日付, 'YYYY-MM') AS 年月, 
-                COUNT(*) AS 投稿数
-            FROM reports
+                TO_CHAR(month, 'YYYY-MM') AS 年月, 
+                SUM(report_count) AS 投稿数
+            FROM report_counts_monthly
             WHERE 1=1
         """
         params = []
@@ -1542,11 +3037,12 @@ def get_user_monthly_report_summary(user_code=None, user_name=None):
         return data
     except Exception as e:
         logging.error(f"ユーザー日報サマリー取得エラー: {e}")
-        return {}
+        raise
     finally:
         if conn:
             conn.close()
             
+@cached_query("reports", default=[])
 def get_all_users():
     """システム内の全ユーザーの名前一覧を取得"""
     conn = None
@@ -1566,13 +3062,13 @@ def get_all_users():
         return users
     except Exception as e:
         logging.error(f"ユーザー一覧取得エラー: {e}")
-        return []
+        raise
     finally:
         if conn:
             conn.close()
 
 def get_all_users_store_visits(year=None, month=None):
-    """全ユーザーの店舗訪問データを取得する
+    """全ユーザーの店舗訪問データを取得する（集計テーブル store_visit_rollup から）
     
     Args:
         year: 年（指定しない場合は全期間）
@@ -1581,14 +3077,36 @@ def get_all_users_store_visits(year=None, month=None):
     Returns:
         ユーザー名をキー、店舗訪問統計リストを値とする辞書
     """
+    conn = None
     try:
-        # すべてのユーザー名を取得
-        user_names = get_all_users()
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # ユーザーコードごとのユーザー名（users_data.json の対応表。日報テーブルは走査しない）
+        user_names = load_user_name_map()
+        
+        query = "SELECT * FROM store_visit_rollup"
+        params = []
+        if year and month:
+            query += " WHERE month = %s"
+            params.append(date(int(year), int(month), 1))
+        elif year:
+            query += " WHERE month >= %s AND month < %s"
+            params.extend([date(int(year), 1, 1), date(int(year) + 1, 1, 1)])
+        cur.execute(query, params)
+        rollup_rows = cur.fetchall()
+        reports = load_visit_reports(cur, rollup_rows)
+        
+        rows_by_user = {}
+        for row in rollup_rows:
+            # 対応表にないユーザーは社員コードで表示する
+            user_name = user_names.get(row["user_code"]) or row["user_code"]
+            if user_name:
+                rows_by_user.setdefault(user_name, []).append(row)
         
-        # 各ユーザーの店舗訪問データを取得
         result = {}
-        for user_name in user_names:
-            visits = get_store_visit_stats(user_name=user_name, year=year, month=month)
+        for user_name in sorted(rows_by_user):
+            visits = build_store_visit_stats(rows_by_user[user_name], reports)
             if visits:  # 訪問データがある場合のみ追加
                 result[user_name] = visits
         
@@ -1596,6 +3114,336 @@ def get_all_users_store_visits(year=None, month=None):
     except Exception as e:
         logging.error(f"全ユーザー店舗訪問データ取得エラー: {e}")
         return {}
+    finally:
+        if conn:
+            conn.close()
+
+def copy_query_to_csv(file, query, params=()):
+    """SELECT の結果を COPY ... TO STDOUT でCSV（ヘッダー付き）としてファイルに書き出す
+    
+    PostgreSQL が作ったCSVをそのままファイルに書き込むため、行をPythonのオブジェクトに変換しない。
+    
+    Args:
+        file: 書き込み先のバイナリファイル
+        query: SELECT 文
+        params: SELECT 文のパラメータ
+    
+    Returns:
+        書き出した行数。エラーの場合は None
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        # COPY にはパラメータを渡せないため、値を埋め込んだ SELECT 文にする
+        select_sql = cur.mogrify(query, params).decode("utf-8")
+        cur.copy_expert(f"COPY ({select_sql}) TO STDOUT WITH (FORMAT csv, HEADER, ENCODING 'UTF8')", file)
+        return cur.rowcount
+    except Exception as e:
+        logging.error(f"CSV出力エラー: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def store_names_sql(column, as_array=False):
+    """訪問店舗（JSONBの配列）を「店舗名, 店舗名」の文字列（as_array の場合は店舗名の配列）にするSQL式"""
+    stores = f"jsonb_array_elements(CASE WHEN jsonb_typeof({column}) = 'array' THEN {column} ELSE '[]' END) store"
+    if as_array:
+        return f"ARRAY(SELECT store->>'name' FROM {stores})"
+    return f"(SELECT string_agg(store->>'name', ', ') FROM {stores})"
+
+def copy_reports_csv(file, start_date=None, end_date=None, depart=None):
+    """日報をCSVでファイルに書き出す（期間を指定しない場合は全期間）
+    
+    Returns:
+        書き出した行数。エラーの場合は None
+    """
+    query = f"""
+        SELECT 投稿者, 所属部署, 日付, {store_names_sql("visited_stores")} AS 訪問店舗,
+               実施内容, 所感, 今後のアクション, 投稿日時
+        FROM reports
+        WHERE TRUE
+    """
+    params = []
+    if start_date:
+        query += " AND 日付 >= %s"
+        params.append(start_date)
+    if end_date:
+        query += " AND 日付 <= %s"
+        params.append(end_date)
+    if depart:
+        query += " AND 所属部署 = %s"
+        params.append(depart)
+    query += " ORDER BY 日付 DESC, 投稿日時 DESC"
+    return copy_query_to_csv(file, query, params)
+
+def copy_weekly_schedules_csv(file, start_date=None, end_date=None):
+    """週間予定をCSVでファイルに書き出す（開始日で絞り込み。指定しない場合は全期間）
+    
+    Returns:
+        書き出した行数。エラーの場合は None
+    """
+    day_columns = ", ".join(
+        f"{day}, {store_names_sql(f'{day}_visited_stores')} AS {day}_訪問店舗" for day in WEEKDAYS
+    )
+    query = f"""
+        SELECT 投稿者, 開始日, 終了日, {day_columns}, 投稿日時
+        FROM weekly_schedules_compat
+        WHERE TRUE
+    """
+    params = []
+    if start_date:
+        query += " AND 開始日 >= %s"
+        params.append(start_date)
+    if end_date:
+        query += " AND 開始日 <= %s"
+        params.append(end_date)
+    query += " ORDER BY 開始日 DESC, 投稿日時 DESC"
+    return copy_query_to_csv(file, query, params)
+
+def copy_store_visits_csv(file, year=None, month=None):
+    """ユーザー・店舗ごとの訪問回数と訪問日をCSVでファイルに書き出す（集計テーブル store_visit_rollup から）
+    
+    ユーザー名は get_all_users_store_visits() と同じく users_data.json の対応表を使う（対応表にないユーザーは社員コード）。
+    
+    Returns:
+        書き出した行数。エラーの場合は None
+    """
+    user_names = load_user_name_map()
+    query = """
+        SELECT COALESCE(u.user_name, r.user_code) AS ユーザー名, r.store_code AS 店舗コード, r.store_name AS 店舗名,
+               COUNT(DISTINCT v.visit_date) AS 訪問回数,
+               string_agg(DISTINCT to_char(v.visit_date, 'YYYY-MM-DD'), ', '
+                          ORDER BY to_char(v.visit_date, 'YYYY-MM-DD') DESC) AS 訪問日
+        FROM store_visit_rollup r
+        CROSS JOIN LATERAL unnest(r.visit_dates) AS v (visit_date)
+        LEFT JOIN unnest(%s::text[], %s::text[]) AS u (user_code, user_name) ON u.user_code = r.user_code
+        WHERE COALESCE(u.user_name, r.user_code) <> ''
+    """
+    params = [list(user_names), list(user_names.values())]
+    if year and month:
+        query += " AND r.month = %s"
+        params.append(date(int(year), int(month), 1))
+    elif year:
+        query += " AND r.month >= %s AND r.month < %s"
+        params.extend([date(int(year), 1, 1), date(int(year) + 1, 1, 1)])
+    query += " GROUP BY 1, 2, 3 ORDER BY 1, 4 DESC"
+    return copy_query_to_csv(file, query, params)
+
+# 分析用データ（Parquet）として出力するデータ
+#   query: SELECT 文（列名は excel_utils.parquet_schema() と合わせること）
+#   date_column: 期間で絞り込む日付の列（並び順にも使う）
+ANALYTICS_EXPORT_QUERIES = {
+    "reports": {
+        "query": f"""
+            SELECT id, 投稿者, user_code, 所属部署, 日付, {store_names_sql("visited_stores", as_array=True)} AS 訪問店舗,
+                   実施内容, 所感, 今後のアクション, 投稿日時, updated_at
+            FROM reports
+        """,
+        "date_column": "日付"
+    },
+    "store_visits": {
+        "query": """
+            SELECT id, user_code, store_code, store_name, visit_date, visit_type, report_id
+            FROM store_visits
+        """,
+        "date_column": "visit_date"
+    },
+    "weekly_schedules": {
+        "query": f"""
+            SELECT d.schedule_id, d.user_code, d.投稿者, w.開始日, d.day_date, d.weekday, d.plan,
+                   {store_names_sql("d.visited_stores", as_array=True)} AS 訪問店舗, w.投稿日時
+            FROM schedule_days d
+            JOIN weekly_schedules w ON w.id = d.schedule_id
+        """,
+        "date_column": "d.day_date"
+    },
+    "monthly_stats": {
+        "query": """
+            SELECT 投稿者, user_code, month, report_count
+            FROM report_counts_monthly
+        """,
+        "date_column": "month"
+    }
+}
+
+def iter_analytics_rows(dataset, start_date=None, end_date=None, batch_size=EXPORT_FETCH_SIZE):
+    """分析用データを batch_size 行ずつ取得するジェネレーター
+    
+    名前付き（サーバーサイド）カーソルで取得するため、全期間を出力してもメモリ上には1回分の行しか持たない。
+    途中でエラーが発生した場合は不完全なファイルを作らないよう例外をそのまま送出する。
+    
+    Args:
+        dataset: ANALYTICS_EXPORT_QUERIES のキー
+        start_date: この日以降に絞り込み（省略時は全期間）
+        end_date: この日以前に絞り込み（省略時は全期間）
+        batch_size: 1回に返す行数
+    
+    Yields:
+        行（辞書）のリスト（日付の古い順）
+    """
+    export_query = ANALYTICS_EXPORT_QUERIES[dataset]
+    date_column = export_query["date_column"]
+    query = export_query["query"] + " WHERE TRUE"
+    params = []
+    if start_date:
+        query += f" AND {date_column} >= %s"
+        params.append(start_date)
+    if end_date:
+        query += f" AND {date_column} <= %s"
+        params.append(end_date)
+    query += f" ORDER BY {date_column}"
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(name=f"export_{dataset}", cursor_factory=RealDictCursor)
+        cur.itersize = batch_size
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    except Exception as e:
+        logging.error(f"分析用データ取得エラー ({dataset}): {e}")
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+def load_assigned_stores():
+    """stores_data.jsonから担当者社員コードごとの担当店舗を取得
+    
+    Returns:
+        {担当者社員コード: {店舗コード: 店舗データ}} の辞書
+    """
+    try:
+        with open("data/stores_data.json", "r", encoding="utf-8-sig") as file:
+            stores = json.load(file)
+    except Exception as e:
+        logging.error(f"担当店舗データ取得エラー: {e}")
+        return {}
+    
+    assigned = {}
+    for store in stores:
+        staff_code = store.get("担当者社員コード")
+        if staff_code and store.get("code"):
+            assigned.setdefault(str(staff_code), {})[str(store["code"])] = store
+    return assigned
+
+def get_store_coverage(year, month, user_code=None, as_of=None):
+    """担当店舗のカバー率（担当店舗のうち実際に訪問した店舗）を担当者ごとに集計
+    
+    当月の訪問日は店舗ごとに「日 → ビット」の整数ビットマップで持ち、
+    訪問済み・未訪問は店舗コードの集合演算で求める。訪問は日報（daily_report）のみを対象とする。
+    
+    Args:
+        year: 年
+        month: 月
+        user_code: 指定した場合はその担当者のみ
+        as_of: 最終訪問からの日数の基準日（省略時は月末日と今日の早い方）
+        
+    Returns:
+        担当者ごとのリスト [{"user_code", "user_name", "assigned_count", "visited_count",
+        "unvisited_count", "never_visited_count", "coverage_rate", "active_days",
+        "off_assignment_count", "stores": [{"code", "name", "visit_days", "visit_bitmap",
+        "visit_dates", "last_visit", "days_since_last_visit"}, ...]}, ...]
+    """
+    month_start = date(int(year), int(month), 1)
+    next_month = date(int(year) + int(month) // 12, int(month) % 12 + 1, 1)
+    if as_of is None:
+        as_of = min(next_month - timedelta(days=1), (datetime.now() + timedelta(hours=9)).date())
+    
+    assigned = load_assigned_stores()
+    if user_code:
+        assigned = {user_code: assigned.get(user_code, {})}
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        user_filter = " AND user_code = %s" if user_code else ""
+        user_params = [user_code] if user_code else []
+        
+        # 当月の訪問日ビットマップ {担当者: {店舗コード: ビットマップ}}（基準日より後の訪問は含めない）
+        cur.execute(f"""
+            SELECT user_code, store_code, visit_dates
+            FROM store_visit_rollup
+            WHERE month = %s AND visit_type = 'daily_report'{user_filter}
+        """, [month_start] + user_params)
+        bitmaps = {}
+        for visit_user, store_code, visit_dates in cur.fetchall():
+            user_bitmaps = bitmaps.setdefault(visit_user, {})
+            bitmap = user_bitmaps.get(store_code, 0)
+            for visit_date in visit_dates:
+                if visit_date <= as_of:
+                    bitmap |= 1 << (visit_date.day - 1)
+            user_bitmaps[store_code] = bitmap
+        
+        # 基準日までの最終訪問日 {担当者: {店舗コード: 最終訪問日}}
+        # 基準日を含む月は last_visit が基準日より後のことがあるため、訪問日の配列から基準日以前の最大値を取る
+        cur.execute(f"""
+            SELECT user_code, store_code,
+                   MAX(CASE WHEN last_visit <= %s THEN last_visit
+                            ELSE (SELECT MAX(d) FROM unnest(visit_dates) AS d WHERE d <= %s) END)
+            FROM store_visit_rollup
+            WHERE month <= %s AND month <= %s AND visit_type = 'daily_report'{user_filter}
+            GROUP BY user_code, store_code
+        """, [as_of, as_of, month_start, as_of] + user_params)
+        last_visits = {}
+        for visit_user, store_code, last_visit in cur.fetchall():
+            last_visits.setdefault(visit_user, {})[store_code] = last_visit
+    except Exception as e:
+        logging.error(f"担当店舗カバー率集計エラー: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+    
+    user_names = load_user_name_map()
+    result = []
+    for staff_code in sorted(assigned):
+        stores = assigned[staff_code]
+        user_bitmaps = bitmaps.get(staff_code, {})
+        user_last_visits = last_visits.get(staff_code, {})
+        
+        assigned_codes = set(stores)
+        visited_codes = {code for code, bitmap in user_bitmaps.items() if bitmap}
+        ever_visited_codes = {code for code, last_visit in user_last_visits.items() if last_visit}
+        
+        active_days = 0
+        store_rows = []
+        for code in sorted(assigned_codes):
+            bitmap = user_bitmaps.get(code, 0)
+            active_days |= bitmap
+            last_visit = user_last_visits.get(code)
+            store_rows.append({
+                "code": code,
+                "name": stores[code].get("name", ""),
+                "visit_days": bin(bitmap).count("1"),
+                "visit_bitmap": bitmap,
+                "visit_dates": [month_start + timedelta(days=day) for day in range(31) if bitmap >> day & 1],
+                "last_visit": last_visit,
+                "days_since_last_visit": (as_of - last_visit).days if last_visit else None
+            })
+        
+        visited_assigned = assigned_codes & visited_codes
+        result.append({
+            "user_code": staff_code,
+            "user_name": user_names.get(staff_code) or next(iter(stores.values()), {}).get("staff_name", ""),
+            "assigned_count": len(assigned_codes),
+            "visited_count": len(visited_assigned),
+            "unvisited_count": len(assigned_codes - visited_codes),
+            "never_visited_count": len(assigned_codes - ever_visited_codes),
+            "coverage_rate": len(visited_assigned) / len(assigned_codes) if assigned_codes else 0.0,
+            "active_days": bin(active_days).count("1"),
+            "off_assignment_count": len(visited_codes - assigned_codes),
+            "stores": store_rows
+        })
+    return result
 
 def save_report_image(report_id, file_name, file_type, image_data):
     """日報に添付された画像をデータベースに保存する
@@ -1625,7 +3473,7 @@ def save_report_image(report_id, file_name, file_type, image_data):
             logging.error("画像保存失敗: レコードの挿入に失敗しました")
             return None
         image_id = result[0]
-        conn.commit()
+        commit_changes(conn, [("report_images", report_id, "insert")])
         logging.info(f"画像を保存しました（ID: {image_id}, 日報ID: {report_id}）")
         return image_id
     except Exception as e:
@@ -1637,6 +3485,7 @@ def save_report_image(report_id, file_name, file_type, image_data):
         if conn:
             conn.close()
 
+@cached_query("report_images", default=[])
 def get_report_images(report_id):
     """特定の日報に関連付けられた画像を取得する
     
@@ -1662,7 +3511,7 @@ def get_report_images(report_id):
         return [dict(img) for img in images]
     except Exception as e:
         logging.error(f"画像取得エラー（日報ID: {report_id}）: {e}")
-        return []
+        raise
     finally:
         if conn:
             conn.close()
@@ -1682,7 +3531,7 @@ def delete_report_image(image_id):
         cur = conn.cursor()
         
         cur.execute("DELETE FROM report_images WHERE id = %s", (image_id,))
-        conn.commit()
+        commit_changes(conn, [("report_images", image_id, "delete")])
         logging.info(f"画像を削除しました（ID: {image_id}）")
         return True
     except Exception as e:
@@ -1711,17 +3560,6 @@ def save_favorite_member(admin_code, member_code):
         conn = get_db_connection()
         cur = conn.cursor()
         
-        # テーブルが存在しない場合は作成
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS favorite_members (
-                id SERIAL PRIMARY KEY,
-                admin_code TEXT NOT NULL,
-                member_code TEXT NOT NULL,
-                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (admin_code, member_code)
-            )
-        """)
-        
         # 既存のレコードがあるか確認（UNIQUEキー制約用）
         cur.execute(
             "SELECT id FROM favorite_members WHERE admin_code = %s AND member_code = %s",
@@ -1739,7 +3577,7 @@ def save_favorite_member(admin_code, member_code):
             (admin_code, member_code)
         )
         
-        conn.commit()
+        commit_changes(conn, [("favorite_members", admin_code, "insert")])
         logging.info(f"お気に入りメンバーを追加しました: 管理者 {admin_code}, メンバー {member_code}")
         return True
     
@@ -1775,7 +3613,7 @@ def delete_favorite_member(admin_code, member_code):
             (admin_code, member_code)
         )
         
-        conn.commit()
+        commit_changes(conn, [("favorite_members", admin_code, "delete")])
         logging.info(f"お気に入りメンバーを削除しました: 管理者 {admin_code}, メンバー {member_code}")
         return True
     
@@ -1789,6 +3627,7 @@ def delete_favorite_member(admin_code, member_code):
         if conn:
             conn.close()
 
+@cached_query("favorite_members", default=[])
 def get_favorite_members(admin_code):
     """
     管理者のお気に入りメンバー一覧を取得する
@@ -1804,24 +3643,6 @@ def get_favorite_members(admin_code):
         conn = get_db_connection()
         cur = conn.cursor()
         
-        # テーブルが存在しない場合は空リストを返す
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'favorite_members'
-            )
-        """)
-        
-        result = cur.fetchone()
-        # Noneや空の結果、またはFalseの場合は空リストを返す
-        if not result:
-            return []
-        try:
-            if not result[0]:
-                return []
-        except (IndexError, TypeError):
-            return []
-        
         # お気に入りメンバーのリストを取得
         cur.execute(
             "SELECT member_code FROM favorite_members WHERE admin_code = %s ORDER BY created_at",
@@ -1832,7 +3653,7 @@ def get_favorite_members(admin_code):
     
     except Exception as e:
         logging.error(f"お気に入りメンバー取得エラー: {e}")
-        return []
+        raise
     
     finally:
         if conn:
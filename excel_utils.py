@@ -1,343 +1,283 @@
 import pandas as pd
-import io
-import base64
-from datetime import datetime
+import os
+import tempfile
+import time
+from datetime import datetime, date
 import logging
 import json
 import csv
+import codecs
+import xlsxwriter
+import pyarrow as pa
+import pyarrow.parquet as pq
+from db_utils import copy_reports_csv, copy_weekly_schedules_csv, copy_store_visits_csv, iter_analytics_rows
 
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def create_download_link(b64, filename):
-    """ダウンロードリンクを生成する共通関数"""
-    # 目立つスタイルのダウンロードボタン
-    download_button = f'''
-    <div style="margin: 10px 0; text-align: center;">
-        <a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" 
-           download="{filename}" 
-           style="background-color: #4CAF50; color: white; padding: 12px 24px; 
-                  text-decoration: none; border-radius: 4px; display: inline-block; 
-                  font-weight: bold; margin: 10px 0; font-size: 16px; cursor: pointer;
-                  box-shadow: 0 2px 5px rgba(0,0,0,0.2);">
-            Excelファイルをダウンロード
-        </a>
-    </div>
-    '''
-    return download_button
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
-def export_to_excel(reports, filename="日報データ.xlsx", include_content=False):
+# エクスポートファイルの一時保存先（ダウンロードされるまでディスクに置く）
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "ok-nippou-exports")
+EXPORT_FILE_TTL = 60 * 60  # 秒（これより古いファイルは次のエクスポート時に削除）
+EXPORT_PROGRESS_ROWS = 500  # 進捗を通知する間隔（行数）
+
+def cleanup_export_files(max_age=EXPORT_FILE_TTL, directory=EXPORT_DIR):
+    """古いエクスポートファイルを削除"""
+    threshold = time.time() - max_age
+    try:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and os.path.getmtime(path) < threshold:
+                os.remove(path)
+    except OSError as e:
+        logging.warning(f"エクスポートファイルの削除エラー: {e}")
+
+def new_export_path(suffix=".xlsx"):
+    """エクスポートファイルを書き出す一時ファイルのパスを作成"""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    cleanup_export_files()
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=EXPORT_DIR)
+    os.close(fd)
+    return path
+
+def write_workbook(sheets, progress=None):
+    """シートのリストをExcelファイルに書き出す
+    
+    xlsxwriter の constant_memory モードで1行ずつ一時ファイルに書き出すため、
+    行数が多くてもメモリ上にはワークブック全体を持たない。
+    
+    Args:
+        sheets: {"name": シート名, "columns": [(見出し, 列幅), ...], "rows": 行（値のリスト）のイテラブル} のリスト
+        progress: 書き出した行数（全シートの合計）を EXPORT_PROGRESS_ROWS 行ごとに受け取る関数
+    
+    Returns:
+        書き出したファイルのパス
+    """
+    path = new_export_path()
+    workbook = xlsxwriter.Workbook(path, {
+        "constant_memory": True,
+        "remove_timezone": True,
+        # 投稿内容が数式やURLとして解釈されないようにする
+        "strings_to_formulas": False,
+        "strings_to_urls": False
+    })
+    try:
+        header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+        datetime_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+        
+        rows_written = 0
+        for sheet in sheets:
+            worksheet = workbook.add_worksheet(sheet["name"])
+            for col, (header, width) in enumerate(sheet["columns"]):
+                worksheet.set_column(col, col, width)
+                worksheet.write_string(0, col, header, header_format)
+            
+            # constant_memory モードでは行の順に書き込む必要がある
+            for row_index, row in enumerate(sheet["rows"], start=1):
+                for col, value in enumerate(row):
+                    if value is None or value == "":
+                        continue
+                    if isinstance(value, datetime):
+                        worksheet.write_datetime(row_index, col, value, datetime_format)
+                    elif isinstance(value, date):
+                        worksheet.write_datetime(row_index, col, value, date_format)
+                    else:
+                        worksheet.write(row_index, col, value)
+                rows_written += 1
+                if progress and rows_written % EXPORT_PROGRESS_ROWS == 0:
+                    progress(rows_written)
+        
+        workbook.close()
+        if progress:
+            progress(rows_written)
+    except Exception:
+        workbook.close()
+        os.remove(path)
+        raise
+    return path
+
+def export_to_excel(reports, include_content=False, progress=None):
     """日報データをExcelファイルとしてエクスポート
     
     Args:
-        reports: 日報データのリスト
-        filename: 出力ファイル名
+        reports: 日報データのリスト（ジェネレーターなどのイテラブルも可。1件ずつ書き出す）
         include_content: 内容と今後のアクションを含めるかどうか
+        progress: 書き出した行数を受け取る関数（write_workbook を参照）
+    
+    Returns:
+        書き出したExcelファイルのパス。失敗した場合は None
     """
-    try:
-        # データフレーム変換用にデータを整形
-        data = []
+    def report_rows():
         for report in reports:
             # 訪問店舗情報を整形
             visited_stores = report.get("visited_stores", [])
             store_names = [store["name"] for store in visited_stores] if visited_stores else []
-            store_names_str = ", ".join(store_names)
-            
-            # 内容（新旧フィールド名に対応）
-            content = ""
-            if "実施内容" in report and report["実施内容"]:
-                content = report["実施内容"]
-            elif "業務内容" in report and report["業務内容"]:
-                content = report["業務内容"]
-                
-            # 所感データがあれば追加
-            if "所感" in report and report["所感"]:
-                if content:
-                    content += "\n\n" + report["所感"]
-                else:
-                    content = report["所感"]
-            elif "メンバー状況" in report and report["メンバー状況"]:
-                if content:
-                    content += "\n\n" + report["メンバー状況"]
-                else:
-                    content = report["メンバー状況"]
-                    
-            # 今後のアクション（新旧フィールド名に対応）
-            action = ""
-            if "今後のアクション" in report and report["今後のアクション"]:
-                action = report["今後のアクション"]
-            elif "翌日予定" in report and report["翌日予定"]:
-                action = report["翌日予定"]
             
             # 基本情報（すべての場合で含める）
-            row = {
-                "投稿者": report["投稿者"],
-                "所属部署": report["所属部署"],
-                "日付": report["日付"],
-                "訪問店舗": store_names_str,
-                "投稿日時": report["投稿日時"]
-            }
+            row = [report["投稿者"], report["所属部署"], report["日付"], ", ".join(store_names), report["投稿日時"]]
             
             # マイページからの出力の場合は内容と今後のアクションを追加
             if include_content:
-                row["内容"] = content
-                row["今後のアクション"] = action
+                # 内容（新旧フィールド名に対応）
+                content = report.get("実施内容") or report.get("業務内容") or ""
+                # 所感データがあれば追加
+                impression = report.get("所感") or report.get("メンバー状況") or ""
+                if impression:
+                    content = f"{content}\n\n{impression}" if content else impression
+                # 今後のアクション（新旧フィールド名に対応）
+                action = report.get("今後のアクション") or report.get("翌日予定") or ""
+                row += [content, action]
             else:
                 # 従来の項目も保持（管理者向け）
-                row["業務内容"] = report.get("業務内容", "")
-                row["メンバー状況"] = report.get("メンバー状況", "")
-                row["作業時間"] = report.get("作業時間", "")
-                row["翌日予定"] = report.get("翌日予定", "")
-                row["相談事項"] = report.get("相談事項", "")
-            
-            data.append(row)
-        
-        # データフレーム作成
-        df = pd.DataFrame(data)
-        
-        # Excelファイルを作成（メモリ上）
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='日報データ', index=False)
-            
-            # ワークシートとワークブックの取得
-            workbook = writer.book
-            worksheet = writer.sheets['日報データ']
-            
-            # 列幅の調整
-            worksheet.set_column('A:A', 12)  # 投稿者
-            worksheet.set_column('B:B', 12)  # 所属部署
-            worksheet.set_column('C:C', 12)  # 日付
-            worksheet.set_column('D:D', 25)  # 訪問店舗
-            
-            # 内容と今後のアクションが含まれる場合、列幅を調整
-            if include_content:
-                worksheet.set_column('E:E', 15)  # 投稿日時
-                worksheet.set_column('F:F', 40)  # 内容
-                worksheet.set_column('G:G', 30)  # 今後のアクション
-            else:
-                worksheet.set_column('E:J', 15)  # その他の列
-        
-        # Streamlitでダウンロードリンクを作成するためのデータを返す
-        excel_data = output.getvalue()
-        b64 = base64.b64encode(excel_data).decode('utf-8')
-        # 共通関数を使って目立つダウンロードリンクを生成
-        href = create_download_link(b64, filename)
-        return href
+                row += [report.get(key, "") for key in ("業務内容", "メンバー状況", "作業時間", "翌日予定", "相談事項")]
+            yield row
+    
+    columns = [("投稿者", 12), ("所属部署", 12), ("日付", 12), ("訪問店舗", 25)]
+    if include_content:
+        columns += [("投稿日時", 15), ("内容", 40), ("今後のアクション", 30)]
+    else:
+        columns += [("投稿日時", 15), ("業務内容", 15), ("メンバー状況", 15), ("作業時間", 15), ("翌日予定", 15), ("相談事項", 15)]
+    
+    try:
+        return write_workbook([{"name": "日報データ", "columns": columns, "rows": report_rows()}], progress=progress)
     except Exception as e:
         logging.error(f"Excelエクスポートエラー: {e}")
         return None
 
-def export_weekly_schedules_to_excel(schedules, filename="週間予定データ.xlsx"):
-    """週間予定データをExcelファイルとしてエクスポート"""
-    try:
-        # データフレーム変換用にデータを整形
-        data = []
+def export_weekly_schedules_to_excel(schedules, progress=None):
+    """週間予定データをExcelファイルとしてエクスポート
+    
+    Returns:
+        書き出したExcelファイルのパス。失敗した場合は None
+    """
+    weekdays = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
+    
+    def schedule_rows():
         for schedule in schedules:
-            # 各曜日の訪問店舗情報を整形
-            weekdays = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
-            store_info = {}
-            
+            row = [schedule["投稿者"], schedule["開始日"], schedule["終了日"]]
+            # 各曜日の予定と訪問店舗情報
             for day in weekdays:
-                day_stores_key = f"{day}_visited_stores"
-                day_stores = schedule.get(day_stores_key, [])
+                day_stores = schedule.get(f"{day}_visited_stores", [])
                 store_names = [store["name"] for store in day_stores] if day_stores else []
-                store_info[f"{day}_訪問店舗"] = ", ".join(store_names)
-            
-            row = {
-                "投稿者": schedule["投稿者"],
-                "開始日": schedule["開始日"],
-                "終了日": schedule["終了日"],
-                "月曜日": schedule["月曜日"],
-                "月曜日_訪問店舗": store_info["月曜日_訪問店舗"],
-                "火曜日": schedule["火曜日"],
-                "火曜日_訪問店舗": store_info["火曜日_訪問店舗"],
-                "水曜日": schedule["水曜日"],
-                "水曜日_訪問店舗": store_info["水曜日_訪問店舗"],
-                "木曜日": schedule["木曜日"],
-                "木曜日_訪問店舗": store_info["木曜日_訪問店舗"],
-                "金曜日": schedule["金曜日"],
-                "金曜日_訪問店舗": store_info["金曜日_訪問店舗"],
-                "土曜日": schedule["土曜日"],
-                "土曜日_訪問店舗": store_info["土曜日_訪問店舗"],
-                "日曜日": schedule["日曜日"],
-                "日曜日_訪問店舗": store_info["日曜日_訪問店舗"],
-                "投稿日時": schedule["投稿日時"]
-            }
-            data.append(row)
-        
-        # データフレーム作成
-        df = pd.DataFrame(data)
-        
-        # Excelファイルを作成（メモリ上）
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='週間予定データ', index=False)
-            
-            # ワークシートとワークブックの取得
-            workbook = writer.book
-            worksheet = writer.sheets['週間予定データ']
-            
-            # 列幅の調整
-            worksheet.set_column('A:A', 12)  # 投稿者
-            worksheet.set_column('B:C', 12)  # 開始日、終了日
-            
-            # 各曜日とその訪問店舗に適切な幅を設定
-            col_index = 3  # 'D'から始まる（0ベースのインデックス）
-            for _ in range(7):  # 7日分の繰り返し
-                # 予定列（15文字分）
-                worksheet.set_column(col_index, col_index, 15)
-                col_index += 1
-                
-                # 訪問店舗列（30文字分）
-                worksheet.set_column(col_index, col_index, 30)
-                col_index += 1
-            
-            # 投稿日時
-            worksheet.set_column('R:R', 18)  # 'R'列 = 投稿日時
-        
-        # Streamlitでダウンロードリンクを作成するためのデータを返す
-        excel_data = output.getvalue()
-        b64 = base64.b64encode(excel_data).decode('utf-8')
-        # 共通関数を使って目立つダウンロードリンクを生成
-        href = create_download_link(b64, filename)
-        return href
+                row += [schedule[day], ", ".join(store_names)]
+            row.append(schedule["投稿日時"])
+            yield row
+    
+    columns = [("投稿者", 12), ("開始日", 12), ("終了日", 12)]
+    for day in weekdays:
+        # 予定列（15文字分）と訪問店舗列（30文字分）
+        columns += [(day, 15), (f"{day}_訪問店舗", 30)]
+    columns.append(("投稿日時", 18))
+    
+    try:
+        return write_workbook([{"name": "週間予定データ", "columns": columns, "rows": schedule_rows()}], progress=progress)
     except Exception as e:
         logging.error(f"週間予定Excelエクスポートエラー: {e}")
         return None
 
-def export_store_visits_to_excel(store_visits, filename="店舗訪問データ.xlsx"):
+def export_store_visits_to_excel(store_visits, progress=None):
     """店舗訪問データをExcelファイルとしてエクスポート
     
     1シート目: 訪問店舗データサマリ
     2シート目以降: 各ユーザーごとの訪問詳細データ（各ユーザーに1シート）
+    
+    Returns:
+        書き出したExcelファイルのパス。データがない場合や失敗した場合は None
     """
+    if not isinstance(store_visits, dict):
+        logging.error(f"店舗訪問データの形式が不正: {type(store_visits)}")
+        return None
+    
+    # データがない場合のチェック
+    if not any(store_visits.values()):
+        logging.error("店舗訪問データが空です。")
+        return None
+    
+    def summary_rows():
+        # ユーザー名順、訪問回数の多い順
+        for user_name in sorted(store_visits):
+            for store in sorted(store_visits[user_name], key=lambda s: -s["count"]):
+                yield [user_name, store["code"], store["name"], store["count"], ", ".join(store["dates"])]
+    
+    def user_rows(visits):
+        # 訪問回数の多い順
+        for store in sorted(visits, key=lambda s: -s["count"]):
+            # 最新の詳細から内容と今後のアクションを取得
+            latest_detail = store["details"][0] if store.get("details") else {}
+            yield [store["code"], store["name"], store["count"], ", ".join(store["dates"]),
+                   latest_detail.get("content", ""), latest_detail.get("action", "")]
+    
+    sheets = [{
+        "name": "訪問店舗データサマリ",
+        "columns": [("ユーザー名", 15), ("店舗コード", 12), ("店舗名", 25), ("訪問回数", 10), ("訪問日", 40)],
+        "rows": summary_rows()
+    }]
+    for user_name, visits in store_visits.items():
+        # ユーザー名をシート名として使用（Excelのシート名は31文字までの制限あり）
+        sheet_name = user_name if len(user_name) <= 31 else user_name[:28] + "..."
+        sheets.append({
+            "name": sheet_name,
+            "columns": [("店舗コード", 12), ("店舗名", 25), ("訪問回数", 10), ("訪問日", 40),
+                        ("内容", 50), ("今後のアクション", 50)],
+            "rows": user_rows(visits)
+        })
+    
     try:
-        # データフレーム作成用のリスト
-        data = []
-        
-        # エラーがあれば詳細にログ出力
-        logging.info(f"店舗訪問データ: {type(store_visits)}")
-        
-        # ユーザーごとのデータを格納する辞書
-        user_data = {}
-        
-        if isinstance(store_visits, dict):
-            for user_name, visits in store_visits.items():
-                # 各ユーザーのシート用データを初期化
-                if user_name not in user_data:
-                    user_data[user_name] = []
-                
-                for store in visits:
-                    # サマリー用データ
-                    row = {
-                        "ユーザー名": user_name,
-                        "店舗コード": store["code"],
-                        "店舗名": store["name"],
-                        "訪問回数": store["count"],
-                        "訪問日": ", ".join(store["dates"])
-                    }
-                    data.append(row)
-                    
-                    # ユーザー詳細シート用データ (内容と今後のアクションを追加)
-                    user_row = {
-                        "店舗コード": store["code"],
-                        "店舗名": store["name"],
-                        "訪問回数": store["count"],
-                        "訪問日": ", ".join(store["dates"]),
-                        "内容": "",  # 詳細情報から内容を後で取得
-                        "今後のアクション": ""  # 詳細情報から今後のアクションを後で取得
-                    }
-                    
-                    # 詳細があれば、最新の詳細から内容と今後のアクションを取得
-                    if "details" in store and store["details"]:
-                        # 最新の詳細から内容を取得して追加
-                        latest_detail = store["details"][0]
-                        content = latest_detail.get("content", "")
-                        if content:
-                            user_row["内容"] = content
-                        
-                        # 最新の詳細から今後のアクションを取得して追加
-                        action = latest_detail.get("action", "")
-                        if action:
-                            user_row["今後のアクション"] = action
-                        
-                    user_data[user_name].append(user_row)
-        else:
-            logging.error(f"店舗訪問データの形式が不正: {type(store_visits)}")
-            # エラーだった場合はシンプルなメッセージを表示
-            return '<div style="color:red;">データのエクスポートに失敗しました。管理者に連絡してください。</div>'
-        
-        # データがない場合のチェック
-        if not data:
-            logging.error("店舗訪問データが空です。")
-            return '<div style="color:orange;">エクスポートするデータがありません。</div>'
-        
-        # サマリーデータフレーム作成
-        df_summary = pd.DataFrame(data)
-        
-        # 訪問回数でソート（降順）
-        if not df_summary.empty:
-            df_summary = df_summary.sort_values(by=["ユーザー名", "訪問回数"], ascending=[True, False])
-        
-        # Excelファイルを作成（メモリ上）
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            # サマリーシートの作成
-            df_summary.to_excel(writer, sheet_name='訪問店舗データサマリ', index=False)
-            
-            # ワークシートとワークブックの取得
-            workbook = writer.book
-            summary_worksheet = writer.sheets['訪問店舗データサマリ']
-            
-            # サマリーシートの列幅調整
-            summary_worksheet.set_column('A:A', 15)  # ユーザー名
-            summary_worksheet.set_column('B:B', 12)  # 店舗コード
-            summary_worksheet.set_column('C:C', 25)  # 店舗名
-            summary_worksheet.set_column('D:D', 10)  # 訪問回数
-            summary_worksheet.set_column('E:E', 40)  # 訪問日
-            
-            # 各ユーザーのシートを作成
-            for user_name, user_visits in user_data.items():
-                # ユーザー名をシート名として使用（シート名の制限に対応）
-                sheet_name = user_name
-                if len(sheet_name) > 31:  # Excelのシート名は31文字までの制限あり
-                    sheet_name = sheet_name[:28] + "..."
-                
-                # ユーザーのデータがない場合は空のデータフレームを作成
-                if not user_visits:
-                    df_user = pd.DataFrame(columns=["店舗コード", "店舗名", "訪問回数", "訪問日"])
-                else:
-                    df_user = pd.DataFrame(user_visits)
-                    # 訪問回数でソート（降順）
-                    df_user = df_user.sort_values(by="訪問回数", ascending=False)
-                
-                # ユーザーシートの作成
-                df_user.to_excel(writer, sheet_name=sheet_name, index=False)
-                
-                # ワークシートの取得
-                user_worksheet = writer.sheets[sheet_name]
-                
-                # 列幅調整
-                user_worksheet.set_column('A:A', 12)  # 店舗コード
-                user_worksheet.set_column('B:B', 25)  # 店舗名
-                user_worksheet.set_column('C:C', 10)  # 訪問回数
-                user_worksheet.set_column('D:D', 40)  # 訪問日
-                user_worksheet.set_column('E:E', 50)  # 内容
-                user_worksheet.set_column('F:F', 50)  # 今後のアクション
-        
-        # Streamlitでダウンロードリンクを作成するためのデータを返す
-        excel_data = output.getvalue()
-        b64 = base64.b64encode(excel_data).decode('utf-8')
-        # 共通関数を使って目立つダウンロードリンクを生成
-        href = create_download_link(b64, filename)
-        return href
+        return write_workbook(sheets, progress=progress)
     except Exception as e:
         logging.error(f"店舗訪問Excelエクスポートエラー: {e}")
-        logging.error(f"エラー詳細: {str(e)}")
         import traceback
         logging.error(traceback.format_exc())
-        return '<div style="color:red;">エクスポート中にエラーが発生しました。</div>'
+        return None
+
+def export_store_coverage_to_excel(coverage, progress=None):
+    """担当店舗のカバー率をExcelファイルとしてエクスポート
+    
+    1シート目: 担当者ごとのサマリ
+    2シート目: 担当店舗ごとの訪問状況（未訪問・最終訪問からの日数）
+    
+    Returns:
+        書き出したExcelファイルのパス。データがない場合や失敗した場合は None
+    """
+    if not coverage:
+        return None
+    
+    def summary_rows():
+        # カバー率の低い順
+        for rep in sorted(coverage, key=lambda r: r["coverage_rate"]):
+            yield [rep["user_code"], rep["user_name"], rep["assigned_count"], rep["visited_count"],
+                   round(rep["coverage_rate"] * 100, 1), rep["unvisited_count"], rep["never_visited_count"],
+                   rep["active_days"], rep["off_assignment_count"]]
+    
+    def store_rows():
+        for rep in coverage:
+            for store in rep["stores"]:
+                yield [rep["user_code"], rep["user_name"], store["code"], store["name"], store["visit_days"],
+                       ", ".join(d.strftime("%m/%d") for d in store["visit_dates"]),
+                       store["last_visit"].strftime("%Y-%m-%d") if store["last_visit"] else "訪問実績なし",
+                       store["days_since_last_visit"]]
+    
+    try:
+        return write_workbook([
+            {
+                "name": "担当者別サマリ",
+                "columns": [("社員コード", 12), ("担当者名", 15), ("担当店舗数", 14), ("訪問店舗数", 14),
+                            ("カバー率(%)", 14), ("未訪問店舗数", 14), ("訪問実績なし店舗数", 14),
+                            ("訪問日数", 14), ("担当外の訪問店舗数", 14)],
+                "rows": summary_rows()
+            },
+            {
+                "name": "店舗別訪問状況",
+                "columns": [("社員コード", 12), ("担当者名", 15), ("店舗コード", 12), ("店舗名", 30),
+                            ("当月訪問日数", 12), ("当月訪問日", 30), ("最終訪問日", 16), ("最終訪問からの日数", 16)],
+                "rows": store_rows()
+            }
+        ], progress=progress)
+    except Exception as e:
+        logging.error(f"担当店舗カバー率Excelエクスポートエラー: {e}")
+        return None
 
 def convert_excel_to_json(uploaded_file, format_type="stores"):
     """アップロードされたExcelファイルをJSON形式に変換"""
@@ -413,246 +353,197 @@ def convert_excel_to_json(uploaded_file, format_type="stores"):
         logging.error(f"Excel変換エラー: {e}")
         return None, f"Excelファイルの変換中にエラーが発生しました: {str(e)}"
 
-# 以下の関数はCSVエクスポート用関数でしたが、要件変更によりExcelエクスポートに統一
-# カスタマーリクエストにより、以下のCSV関連関数は残しておきます（互換性のため）
-# ただし、アプリのUIからは呼び出されなくなります
+# CSVエクスポート
+# 要件変更によりアプリのUIからはExcelエクスポートに統一しているため、CSVはUIからは呼び出さない。
+# 全期間のデータを出力する場合などに db_admin.py の export-csv から使う。
+# 日報・週間予定・店舗訪問は PostgreSQL の COPY で作ったCSVをそのままファイルに書き込む（行をPythonで変換しない）。
 
-def export_to_csv(data, filename="data.csv"):
-    """データをCSVファイルとしてエクスポート（互換性のために残す）"""
+def write_csv(copy_rows, path=None):
+    """CSVをファイルに書き出す
+    
+    Args:
+        copy_rows: 書き込み先のファイルを受け取り、CSVを書き込んで行数を返す関数（db_utils の copy_*_csv）
+        path: 出力先のパス（省略時はエクスポート用の一時ファイル）
+    
+    Returns:
+        書き出したCSVファイルのパス。失敗した場合は None
+    """
+    path = path or new_export_path(".csv")
     try:
-        # データフレームを作成
-        df = pd.DataFrame(data)
-        
-        # CSVをメモリ上に出力
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')  # BOMを含めてUTF-8で出力（Excel対応）
-        
-        # Base64エンコード
-        csv_str = csv_buffer.getvalue()
-        csv_bytes = csv_str.encode('utf-8')
-        b64 = base64.b64encode(csv_bytes).decode()
-        
-        # ダウンロードリンク生成
-        href = f'<a href="data:text/csv;charset=utf-8,{b64}" download="{filename}">CSVファイルをダウンロード</a>'
-        return href
+        with open(path, "wb") as file:
+            file.write(codecs.BOM_UTF8)  # BOMを付ける（Excelで開いたときに文字化けしないように）
+            row_count = copy_rows(file)
+        if row_count is None:
+            raise RuntimeError("データベースからCSVを出力できませんでした。")
+        return path
     except Exception as e:
         logging.error(f"CSVエクスポートエラー: {e}")
+        if os.path.exists(path):
+            os.remove(path)
         return None
 
-def export_reports_to_csv(reports, filename="日報データ.csv"):
-    """日報データをCSVファイルとしてエクスポート（互換性のために残す）"""
-    try:
-        # データフレーム変換用にデータを整形
-        data = []
-        for report in reports:
-            # 訪問店舗情報を整形
-            visited_stores = report.get("visited_stores", [])
-            store_names = [store["name"] for store in visited_stores] if visited_stores else []
-            store_names_str = ", ".join(store_names)
-            
-            row = {
-                "投稿者": report["投稿者"],
-                "所属部署": report["所属部署"],
-                "日付": report["日付"],
-                "訪問店舗": store_names_str,
-                "業務内容": report["業務内容"],
-                "メンバー状況": report["メンバー状況"],
-                "作業時間": report["作業時間"],
-                "翌日予定": report["翌日予定"],
-                "相談事項": report["相談事項"],
-                "投稿日時": report["投稿日時"]
-            }
-            data.append(row)
-        
-        return export_to_csv(data, filename)
-    except Exception as e:
-        logging.error(f"日報CSVエクスポートエラー: {e}")
-        return None
+def export_reports_to_csv(start_date=None, end_date=None, depart=None, path=None):
+    """日報データをCSVファイルとしてエクスポート（期間を指定しない場合は全期間）
+    
+    Returns:
+        書き出したCSVファイルのパス。失敗した場合は None
+    """
+    return write_csv(lambda file: copy_reports_csv(file, start_date, end_date, depart), path)
+
+def export_weekly_schedules_to_csv(start_date=None, end_date=None, path=None):
+    """週間予定データをCSVファイルとしてエクスポート（開始日で絞り込み。指定しない場合は全期間）
+    
+    Returns:
+        書き出したCSVファイルのパス。失敗した場合は None
+    """
+    return write_csv(lambda file: copy_weekly_schedules_csv(file, start_date, end_date), path)
+
+def export_store_visits_to_csv(year=None, month=None, path=None):
+    """店舗訪問データをCSVファイルとしてエクスポート（年・月を指定しない場合は全期間）
+    
+    Returns:
+        書き出したCSVファイルのパス。失敗した場合は None
+    """
+    return write_csv(lambda file: copy_store_visits_csv(file, year, month), path)
 
-def export_weekly_schedules_to_csv(schedules, filename="週間予定データ.csv"):
-    """週間予定データをCSVファイルとしてエクスポート（互換性のために残す）"""
+def export_monthly_stats_to_excel(stats, year, progress=None):
+    """月次投稿統計データをExcelファイルとしてエクスポート
+    
+    Returns:
+        書き出したExcelファイルのパス。データがない場合や失敗した場合は None
+    """
+    # 年でフィルタリング
+    year_prefix = f"{year}-"
+    filtered_stats = [s for s in stats if s["年月"].startswith(year_prefix)]
+    
+    if not filtered_stats:
+        return None
+    
+    # ピボット形式のデータも作成（名前ごとの月別投稿数）
+    pivot_data = {}
+    for stat in filtered_stats:
+        month = int(stat["年月"].split('-')[1])
+        pivot_data.setdefault(stat["投稿者"], {})[month] = stat["投稿数"]
+    
+    # 月の列を正しい順序に並べ、合計の多い順に出力
+    months = sorted({month for counts in pivot_data.values() for month in counts})
+    pivot_rows = sorted(
+        ([user] + [counts.get(month) for month in months] + [sum(counts.values())]
+         for user, counts in pivot_data.items()),
+        key=lambda row: -row[-1]
+    )
+    
+    detail_columns = list(filtered_stats[0].keys())
+    detail_widths = {"投稿者": 15, "年月": 12, "投稿数": 10}
+    
     try:
-        # データフレーム変換用にデータを整形
-        data = []
-        for schedule in schedules:
-            # 各曜日の訪問店舗情報を整形
-            weekdays = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
-            store_info = {}
-            
-            for day in weekdays:
-                day_stores_key = f"{day}_visited_stores"
-                day_stores = schedule.get(day_stores_key, [])
-                store_names = [store["name"] for store in day_stores] if day_stores else []
-                store_info[f"{day}_訪問店舗"] = ", ".join(store_names)
-            
-            row = {
-                "投稿者": schedule["投稿者"],
-                "開始日": schedule["開始日"],
-                "終了日": schedule["終了日"],
-                "月曜日": schedule["月曜日"],
-                "月曜日_訪問店舗": store_info["月曜日_訪問店舗"],
-                "火曜日": schedule["火曜日"],
-                "火曜日_訪問店舗": store_info["火曜日_訪問店舗"],
-                "水曜日": schedule["水曜日"],
-                "水曜日_訪問店舗": store_info["水曜日_訪問店舗"],
-                "木曜日": schedule["木曜日"],
-                "木曜日_訪問店舗": store_info["木曜日_訪問店舗"],
-                "金曜日": schedule["金曜日"],
-                "金曜日_訪問店舗": store_info["金曜日_訪問店舗"],
-                "土曜日": schedule["土曜日"],
-                "土曜日_訪問店舗": store_info["土曜日_訪問店舗"],
-                "日曜日": schedule["日曜日"],
-                "日曜日_訪問店舗": store_info["日曜日_訪問店舗"],
-                "投稿日時": schedule["投稿日時"]
+        return write_workbook([
+            {
+                # 詳細データをシート1に出力
+                "name": "詳細データ",
+                "columns": [(column, detail_widths.get(column, 12)) for column in detail_columns],
+                "rows": ([stat.get(column) for column in detail_columns] for stat in filtered_stats)
+            },
+            {
+                # サマリーデータをシート2に出力
+                "name": "サマリーデータ",
+                "columns": [("名前", 15)] + [(f"{month}月", 8) for month in months] + [("合計", 10)],
+                "rows": pivot_rows
             }
-            data.append(row)
-        
-        return export_to_csv(data, filename)
+        ], progress=progress)
     except Exception as e:
-        logging.error(f"週間予定CSVエクスポートエラー: {e}")
+        logging.error(f"月次統計Excelエクスポートエラー: {e}")
         return None
 
-def export_store_visits_to_csv(store_visits, filename="店舗訪問データ.csv"):
-    """店舗訪問データをCSVファイルとしてエクスポート（互換性のために残す）"""
+# Parquetエクスポート（分析用データ）
+# 日付・日時・カテゴリ（社員名や店舗名など繰り返しの多い文字列）の型を付けて出力し、
+# pandas や DuckDB などの分析ツールで型変換なしに読み込めるようにする。
+# データはサーバーサイドカーソルから PARQUET_ROW_GROUP_ROWS 行ずつ取得し、そのまま1つの行グループとして書き込む。
+
+PARQUET_ROW_GROUP_ROWS = 20000  # 1つの行グループ（1回の取得）の行数
+PARQUET_MIME = "application/vnd.apache.parquet"
+
+# 出力するデータの種類 → 表示名と列の型（列名は db_utils.ANALYTICS_EXPORT_QUERIES と合わせること）
+PARQUET_DATASETS = {
+    "reports": "日報",
+    "store_visits": "店舗訪問記録",
+    "weekly_schedules": "週間予定（日別）",
+    "monthly_stats": "月次投稿数"
+}
+
+def parquet_schema(dataset):
+    """Parquetファイルの列の型（pyarrow のスキーマ）を取得"""
+    category = pa.dictionary(pa.int32(), pa.string())
+    fields = {
+        "reports": [
+            ("id", pa.int32()), ("投稿者", category), ("user_code", category), ("所属部署", category),
+            ("日付", pa.date32()), ("訪問店舗", pa.list_(pa.string())), ("実施内容", pa.string()),
+            ("所感", pa.string()), ("今後のアクション", pa.string()), ("投稿日時", pa.timestamp("us")),
+            ("updated_at", pa.timestamp("us", tz="UTC"))
+        ],
+        "store_visits": [
+            ("id", pa.int32()), ("user_code", category), ("store_code", category), ("store_name", category),
+            ("visit_date", pa.date32()), ("visit_type", category), ("report_id", pa.int32())
+        ],
+        "weekly_schedules": [
+            ("schedule_id", pa.int32()), ("user_code", category), ("投稿者", category), ("開始日", pa.date32()),
+            ("day_date", pa.date32()), ("weekday", category), ("plan", pa.string()),
+            ("訪問店舗", pa.list_(pa.string())), ("投稿日時", pa.timestamp("us"))
+        ],
+        "monthly_stats": [
+            ("投稿者", category), ("user_code", category), ("month", pa.date32()), ("report_count", pa.int32())
+        ]
+    }[dataset]
+    return pa.schema(fields)
+
+def write_parquet(dataset, start_date=None, end_date=None, path=None, progress=None):
+    """分析用データをParquetファイルに書き出す
+    
+    取得した行は行グループごとに書き込んで捨てるため、全期間を出力してもメモリ上には1つの行グループしか持たない。
+    
+    Args:
+        dataset: PARQUET_DATASETS のキー
+        start_date: この日以降に絞り込み（省略時は全期間）
+        end_date: この日以前に絞り込み（省略時は全期間）
+        path: 出力先のパス（省略時はエクスポート用の一時ファイル）
+        progress: 書き出した行数を行グループごとに受け取る関数
+    
+    Returns:
+        書き出したファイルのパス。該当するデータがない場合は None
+    """
+    schema = parquet_schema(dataset)
+    path = path or new_export_path(".parquet")
+    rows_written = 0
     try:
-        # データフレーム作成用のリスト
-        data = []
-        
-        for user_name, visits in store_visits.items():
-            for store in visits:
-                row = {
-                    "ユーザー名": user_name,
-                    "店舗コード": store["code"],
-                    "店舗名": store["name"],
-                    "訪問回数": store["count"],
-                    "訪問日": ", ".join(store["dates"])
-                }
-                data.append(row)
-        
-        # データフレーム作成
-        df = pd.DataFrame(data)
-        
-        # 訪問回数でソート（降順）
-        if not df.empty:
-            df = df.sort_values(by=["ユーザー名", "訪問回数"], ascending=[True, False])
-        
-        # CSVをメモリ上に出力
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')  # BOMを含めてUTF-8で出力（Excel対応）
-        
-        # Base64エンコード
-        csv_str = csv_buffer.getvalue()
-        csv_bytes = csv_str.encode('utf-8')
-        b64 = base64.b64encode(csv_bytes).decode()
-        
-        # ダウンロードリンク生成
-        href = f'<a href="data:text/csv;charset=utf-8,{b64}" download="{filename}">CSVファイルをダウンロード</a>'
-        return href
-    except Exception as e:
-        logging.error(f"店舗訪問CSVエクスポートエラー: {e}")
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            for rows in iter_analytics_rows(dataset, start_date, end_date, batch_size=PARQUET_ROW_GROUP_ROWS):
+                columns = [pa.array([row[field.name] for row in rows], type=field.type) for field in schema]
+                writer.write_batch(pa.record_batch(columns, schema=schema))
+                rows_written += len(rows)
+                if progress:
+                    progress(rows_written)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    
+    if rows_written == 0:
+        os.remove(path)
         return None
+    return path
 
-def export_monthly_stats_to_excel(stats, year, filename=None):
-    """月次投稿統計データをExcelファイルとしてエクスポート"""
+def export_to_parquet(dataset, start_date=None, end_date=None, path=None, progress=None):
+    """分析用データをParquetファイルとしてエクスポート（期間を指定しない場合は全期間）
+    
+    Returns:
+        書き出したParquetファイルのパス。データがない場合や失敗した場合は None
+    """
     try:
-        if not filename:
-            filename = f"投稿統計_{year}年.xlsx"
-            
-        # 年でフィルタリング
-        year_prefix = f"{year}-"
-        filtered_stats = [s for s in stats if s["年月"].startswith(year_prefix)]
-        
-        if not filtered_stats:
-            return None
-            
-        # 通常形式（全データ）
-        df = pd.DataFrame(filtered_stats)
-        
-        # ピボット形式のデータも作成
-        pivot_data = {}
-        for stat in filtered_stats:
-            user = stat["投稿者"]
-            year_month = stat["年月"]
-            count = stat["投稿数"]
-            
-            if user not in pivot_data:
-                pivot_data[user] = {"名前": user}
-            
-            # 月だけを取り出して列名にする
-            month_str = f"{int(year_month.split('-')[1])}月"
-            pivot_data[user][month_str] = count
-        
-        # データフレームに変換
-        pivot_df = pd.DataFrame(list(pivot_data.values()))
-        
-        # 月の列を正しい順序に並べ替え
-        month_cols = [f"{m}月" for m in range(1, 13)]
-        existing_cols = [col for col in month_cols if col in pivot_df.columns]
-        
-        if existing_cols:
-            # 合計を計算して追加
-            pivot_df["合計"] = pivot_df[existing_cols].sum(axis=1)
-            pivot_df = pivot_df.sort_values("合計", ascending=False)
-        
-        # Excelファイルを作成（メモリ上）
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            # 詳細データをシート1に出力
-            df.to_excel(writer, sheet_name='詳細データ', index=False)
-            
-            # サマリーデータをシート2に出力
-            pivot_df.to_excel(writer, sheet_name='サマリーデータ', index=False)
-            
-            # ワークシートとワークブックの取得
-            workbook = writer.book
-            detailed_worksheet = writer.sheets['詳細データ']
-            summary_worksheet = writer.sheets['サマリーデータ']
-            
-            # 詳細データの列幅を調整
-            detailed_worksheet.set_column('A:A', 15)  # 投稿者
-            detailed_worksheet.set_column('B:B', 12)  # 年月
-            detailed_worksheet.set_column('C:C', 10)  # 投稿数
-            
-            # サマリーデータの列幅を調整
-            summary_worksheet.set_column('A:A', 15)  # 名前
-            
-            # 月の列（B～M）の幅を設定
-            for i, _ in enumerate(existing_cols):
-                col_letter = chr(ord('B') + i)
-                summary_worksheet.set_column(f'{col_letter}:{col_letter}', 8)
-            
-            # 合計列の幅を設定
-            summary_worksheet.set_column('N:N', 10)  # 合計列
-            
-            # 数値セルのフォーマット設定
-            number_format = workbook.add_format({'num_format': '0'})
-            
-            # サマリーデータにフォーマット適用
-            for i, _ in enumerate(existing_cols):
-                col_index = i + 1  # B列から始まるため（0ベース + 1）
-                for row in range(1, len(pivot_data) + 1):  # ヘッダー行を除く
-                    summary_worksheet.set_column(col_index, col_index, 8, number_format)
-            
-            # 合計列にもフォーマット適用
-            if existing_cols:
-                total_col_index = len(existing_cols) + 1
-                summary_worksheet.set_column(total_col_index, total_col_index, 10, number_format)
-        
-        # Streamlitでダウンロードリンクを作成するためのデータを返す
-        excel_data = output.getvalue()
-        b64 = base64.b64encode(excel_data).decode('utf-8')
-        # 共通関数を使って目立つダウンロードリンクを生成
-        href = create_download_link(b64, filename)
-        return href
+        return write_parquet(dataset, start_date, end_date, path, progress)
     except Exception as e:
-        logging.error(f"月次統計Excelエクスポートエラー: {e}")
+        logging.error(f"Parquetエクスポートエラー ({dataset}): {e}")
         return None
 
-def export_monthly_stats_to_csv(stats, year, filename=None):
-    """月次投稿統計データをCSVファイルとしてエクスポート（互換性のために残す）"""
-    # 推奨されないため、Excelエクスポートを使用するように変更
-    return export_monthly_stats_to_excel(stats, year, filename.replace('.csv', '.xlsx') if filename else None)
-
 def parse_excel_to_stores_json(file_path):
     """ファイルパスを指定してExcelファイルを店舗JSONに変換する"""
     try:
@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import excel_utils
+from db_utils import (
+    iter_reports_by_date, count_reports_by_date, load_weekly_schedules, get_monthly_report_count,
+    get_all_users_store_visits, get_store_coverage, get_data_versions
+)
+
+# データエクスポートのバックグラウンド実行
+#
+# エクスポートはプロセスプールの子プロセスでデータ取得からExcelの書き出しまでを行い、
+# Streamlit のスクリプト（セッション）はジョブを登録して状態を表示するだけにする。
+# 作成したファイルは「種類・条件・関係するテーブルのデータバージョン」をキーにディスクへ残し、
+# 同じ条件でデータが変わっていなければ次回は作り直さずにそのまま返す。
+
+EXPORT_MAX_WORKERS = 2  # 同時に実行するエクスポートの数
+EXPORT_CACHE_DIR = os.path.join(excel_utils.EXPORT_DIR, "cache")
+EXPORT_CACHE_TTL = 24 * 60 * 60  # 秒（この期間使われなかったエクスポートファイルは削除）
+EXPORT_JOB_DIR = os.path.join(excel_utils.EXPORT_DIR, "jobs")  # 子プロセスが進捗を書き込むファイルの置き場所
+EXPORT_JOB_RETENTION = 60 * 60  # 秒（終了したジョブの状態を保持する期間）
+EXPORT_FORMAT_VERSION = 1  # 出力形式を変えたときに上げる（古いキャッシュを使わないようにする）
+
+STORES_FILE = "data/stores_data.json"
+USERS_FILE = "data/users_data.json"
+
+executor = None
+executor_lock = threading.Lock()
+
+# ジョブの状態（プロセス内で共有。ジョブID → ジョブ）
+export_jobs = {}
+running_job_ids = {}  # キャッシュキー → 実行中のジョブID（同じ条件のエクスポートを重複して実行しない）
+export_jobs_lock = threading.Lock()
+
+def write_progress(progress_path, **progress):
+    """ジョブの進捗をファイルに書き込む（子プロセスから呼ばれる）"""
+    temp_path = f"{progress_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(progress, file, ensure_ascii=False)
+    os.replace(temp_path, progress_path)
+
+def read_progress(progress_path):
+    """ジョブの進捗を読み込む（まだ書き込まれていない場合は空の辞書）"""
+    try:
+        with open(progress_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def require_file(path):
+    """エクスポート関数の結果を確認する（データがあるのにファイルを作成できなかった場合はエラー）"""
+    if path is None:
+        raise RuntimeError("Excelファイルの作成に失敗しました。ログを確認してください。")
+    return path
+
+def run_reports_export(params, report_progress):
+    total = count_reports_by_date(params["start_date"], params["end_date"], depart=params["depart"])
+    if total is None:
+        raise RuntimeError("日報データの件数を取得できませんでした。")
+    if total == 0:
+        return None
+    report_progress(0, total)
+    reports = iter_reports_by_date(params["start_date"], params["end_date"], depart=params["depart"])
+    try:
+        return require_file(excel_utils.export_to_excel(
+            reports, include_content=True, progress=lambda rows: report_progress(rows, total)))
+    finally:
+        reports.close()
+
+def run_weekly_schedules_export(params, report_progress):
+    schedules = load_weekly_schedules(start_date=params["start_date"], end_date=params["end_date"])
+    if not schedules:
+        return None
+    report_progress(0, len(schedules))
+    return require_file(excel_utils.export_weekly_schedules_to_excel(
+        schedules, progress=lambda rows: report_progress(rows, len(schedules))))
+
+def run_monthly_stats_export(params, report_progress):
+    stats = get_monthly_report_count(year=params["year"], month=params["month"])
+    if not any(stat["年月"].startswith(f"{params['year']}-") for stat in stats):
+        return None
+    return require_file(excel_utils.export_monthly_stats_to_excel(stats, params["year"]))
+
+def run_store_visits_export(params, report_progress):
+    all_visits = get_all_users_store_visits(year=params["year"], month=params["month"])
+    if not any(all_visits.values()):
+        return None
+    # サマリシートとユーザー別シートに1店舗ずつ書き出す
+    total = 2 * sum(len(visits) for visits in all_visits.values())
+    report_progress(0, total)
+    return require_file(excel_utils.export_store_visits_to_excel(
+        all_visits, progress=lambda rows: report_progress(rows, total)))
+
+def run_store_coverage_export(params, report_progress):
+    coverage = get_store_coverage(params["year"], params["month"])
+    if not coverage:
+        return None
+    total = len(coverage) + sum(len(rep["stores"]) for rep in coverage)
+    report_progress(0, total)
+    return require_file(excel_utils.export_store_coverage_to_excel(
+        coverage, progress=lambda rows: report_progress(rows, total)))
+
+def run_parquet_export(params, report_progress):
+    report_progress(0)
+    return excel_utils.write_parquet(params["dataset"], params["start_date"], params["end_date"],
+                                     progress=report_progress)
+
+# エクスポートの種類
+#   tables: 出力内容が依存するテーブル（データバージョンをキャッシュキーに含める。db_utils.DATA_VERSION_TABLES のいずれか。
+#           集計テーブルは元のテーブルで判定する）
+#   files: 出力内容が依存するファイル（更新日時をキャッシュキーに含める）
+#   daily: 今日の日付によって内容が変わる（最終訪問からの日数など）
+#   format: 出力形式（"excel" または "parquet"。省略時は "excel"）
+EXPORT_JOB_TYPES = {
+    "reports": {"run": run_reports_export, "tables": ["reports"]},
+    "weekly_schedules": {"run": run_weekly_schedules_export, "tables": ["weekly_schedules", "schedule_days"]},
+    "monthly_stats": {"run": run_monthly_stats_export, "tables": ["reports"]},
+    "store_visits": {"run": run_store_visits_export, "tables": ["store_visits", "reports"]},
+    "store_coverage": {"run": run_store_coverage_export, "tables": ["store_visits"],
+                       "files": [STORES_FILE, USERS_FILE], "daily": True},
+    # 分析用データ（params の dataset は種類と同じ excel_utils.PARQUET_DATASETS のキー）
+    "parquet_reports": {"run": run_parquet_export, "tables": ["reports"], "format": "parquet"},
+    "parquet_store_visits": {"run": run_parquet_export, "tables": ["store_visits"], "format": "parquet"},
+    "parquet_weekly_schedules": {"run": run_parquet_export, "tables": ["weekly_schedules", "schedule_days"],
+                                 "format": "parquet"},
+    "parquet_monthly_stats": {"run": run_parquet_export, "tables": ["reports"], "format": "parquet"}
+}
+
+# 出力形式ごとの拡張子と作成中の表示
+EXPORT_FORMATS = {
+    "excel": {"suffix": ".xlsx", "stage": "Excelファイルを作成中"},
+    "parquet": {"suffix": ".parquet", "stage": "Parquetファイルを作成中"}
+}
+
+def get_export_format(kind):
+    """エクスポートの種類の出力形式を取得"""
+    return EXPORT_FORMATS[EXPORT_JOB_TYPES[kind].get("format", "excel")]
+
+def run_export_job(kind, params, cache_path, progress_path):
+    """エクスポートを実行し、作成したファイルをキャッシュの場所に置く（子プロセスで実行される）
+    
+    Returns:
+        作成したファイルのパス。該当するデータがない場合は None
+    """
+    def report_progress(rows, total=None):
+        write_progress(progress_path, stage=get_export_format(kind)["stage"], rows=rows, total=total)
+    
+    write_progress(progress_path, stage="データを取得中")
+    path = EXPORT_JOB_TYPES[kind]["run"](params, report_progress)
+    if path is None:
+        return None
+    os.replace(path, cache_path)
+    return cache_path
+
+def get_executor(reset=False):
+    """エクスポート用のプロセスプールを取得（プロセスごとに1つ）
+    
+    子プロセスは fork ではなく spawn で起動する（Streamlit のスレッドやDB接続を引き継がない）。
+    """
+    global executor
+    with executor_lock:
+        if reset and executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = None
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=EXPORT_MAX_WORKERS,
+                                           mp_context=multiprocessing.get_context("spawn"))
+        return executor
+
+def get_cache_key(kind, params):
+    """エクスポートファイルのキャッシュキーを作成
+    
+    データバージョンを取得できない場合は None（キャッシュを使わずに毎回作成する）
+    """
+    job_type = EXPORT_JOB_TYPES[kind]
+    versions = get_data_versions(job_type["tables"])
+    if versions is None:
+        return None
+    key = {"kind": kind, "params": params, "versions": versions, "format": EXPORT_FORMAT_VERSION}
+    if job_type.get("files"):
+        key["files"] = {path: os.path.getmtime(path) if os.path.exists(path) else None
+                        for path in job_type["files"]}
+    if job_type.get("daily"):
+        key["today"] = (datetime.now() + timedelta(hours=9)).date()  # JST
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    return f"{kind}-{digest.hexdigest()[:32]}"
+
+def prune_export_jobs():
+    """終了してから時間の経ったジョブと古いファイルを片付ける"""
+    threshold = time.time() - EXPORT_JOB_RETENTION
+    with export_jobs_lock:
+        for job_id, job in list(export_jobs.items()):
+            if job["finished_at"] and job["finished_at"] < threshold:
+                del export_jobs[job_id]
+    excel_utils.cleanup_export_files(EXPORT_CACHE_TTL, EXPORT_CACHE_DIR)
+    excel_utils.cleanup_export_files(EXPORT_JOB_RETENTION, EXPORT_JOB_DIR)
+
+def submit_export_job(kind, params, filename):
+    """エクスポートのジョブを登録する
+    
+    同じ条件のファイルがキャッシュにあればすぐに完了したジョブとして返し、
+    同じ条件のジョブが実行中であればそのジョブを返す。
+    
+    Args:
+        kind: エクスポートの種類（EXPORT_JOB_TYPES のキー）
+        params: エクスポートの条件（JSONに変換できる値の辞書）
+        filename: ダウンロード時のファイル名
+    
+    Returns:
+        ジョブID。登録できなかった場合は None
+    """
+    try:
+        os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+        os.makedirs(EXPORT_JOB_DIR, exist_ok=True)
+        prune_export_jobs()
+        
+        cache_key = get_cache_key(kind, params) or f"{kind}-{uuid.uuid4().hex}"
+        cache_path = os.path.join(EXPORT_CACHE_DIR, f"{cache_key}{get_export_format(kind)['suffix']}")
+        
+        with export_jobs_lock:
+            running_job_id = running_job_ids.get(cache_key)
+            if running_job_id in export_jobs:
+                return running_job_id
+            
+            job_id = uuid.uuid4().hex[:12]
+            job = {
+                "id": job_id,
+                "kind": kind,
+                "filename": filename,
+                "cache_key": cache_key,
+                "path": None,
+                "future": None,
+                "progress_path": os.path.join(EXPORT_JOB_DIR, f"{job_id}.json"),
+                "submitted_at": time.time(),
+                "finished_at": None
+            }
+            
+            if os.path.exists(cache_path):
+                # 作成済みのファイルを使う（使われたファイルは削除を先延ばしにする）
+                os.utime(cache_path)
+                job["path"] = cache_path
+                job["finished_at"] = time.time()
+            else:
+                args = (run_export_job, kind, params, cache_path, job["progress_path"])
+                try:
+                    job["future"] = get_executor().submit(*args)
+                except BrokenProcessPool:
+                    # 子プロセスが異常終了していた場合はプールを作り直す
+                    job["future"] = get_executor(reset=True).submit(*args)
+                running_job_ids[cache_key] = job_id
+            
+            export_jobs[job_id] = job
+        
+        # 既に終了している場合はこの場で呼ばれるため、ロックの外で登録する
+        if job["future"] is not None:
+            job["future"].add_done_callback(lambda future: finish_export_job(job))
+        return job_id
+    except Exception as e:
+        logging.error(f"エクスポートジョブ登録エラー ({kind}): {e}")
+        return None
+
+def finish_export_job(job):
+    """ジョブの終了時に呼ばれる（プロセスプールの管理スレッドから）"""
+    with export_jobs_lock:
+        job["finished_at"] = time.time()
+        if running_job_ids.get(job["cache_key"]) == job["id"]:
+            del running_job_ids[job["cache_key"]]
+    error = job["future"].exception()
+    if error:
+        logging.error(f"エクスポートジョブエラー ({job['kind']}): {error}")
+
+def get_export_job(job_id):
+    """ジョブの状態を取得
+    
+    Returns:
+        {"id", "filename", "status", "stage", "rows", "total", "path", "error"} の辞書。
+        status は "running"（実行中）, "done"（完了）, "empty"（該当データなし）, "failed"（失敗）。
+        ジョブが見つからない場合は None
+    """
+    with export_jobs_lock:
+        job = export_jobs.get(job_id)
+    if job is None:
+        return None
+    
+    status = {"id": job_id, "filename": job["filename"], "status": "done", "stage": None,
+              "rows": None, "total": None, "path": job["path"], "error": None}
+    future = job["future"]
+    if future is None:
+        return status
+    if not future.done():
+        progress = read_progress(job["progress_path"])
+        status.update(status="running", stage=progress.get("stage", "開始待ち"),
+                      rows=progress.get("rows"), total=progress.get("total"))
+        return status
+    
+    error = future.exception()
+    if error:
+        status.update(status="failed", error=str(error))
+    elif future.result() is None:
+        status["status"] = "empty"
+    else:
+        status["path"] = future.result()
+    return status
@@ -1,14 +1,14 @@
 import os
 import time
 import streamlit as st
-import pandas as pd
 import base64
 from io import BytesIO
 from datetime import datetime, timedelta, date
 import json
+import html
+import functools
 import logging  # ログ記録用
 from collections import defaultdict
-import calendar
 
 # ライトモードを強制設定（.streamlit/config.tomlで設定）
 st.set_page_config(page_title="OK-NIPPOU", initial_sidebar_state="expanded", layout="wide", page_icon="📝")
@@ -24,36 +24,54 @@ def get_current_time():
 
 # データベース操作ユーティリティをインポート
 from db_utils import (
-    init_db, authenticate_user, save_report, load_reports,
+    ensure_schema, authenticate_user, save_report, submit_report, load_reports,
     load_notices, mark_notice_as_read, edit_report, delete_report,
     update_reaction, save_comment, load_commented_reports,
     save_weekly_schedule, save_weekly_schedule_comment, 
-    add_weekly_schedule_columns, load_weekly_schedules, get_user_stores,
+    load_weekly_schedules, get_user_stores,
     get_user_store_visits, get_store_visit_stats, save_stores_data,
     search_stores, load_report_by_id, save_notice, load_reports_by_date,
-    save_report_image, get_report_images, delete_report_image
+    save_report_image, get_report_images, delete_report_image,
+    get_planned_stores, get_weekly_schedule_grid, start_outbox_worker,
+    start_change_listener, is_change_listener_alive, get_table_version,
+    get_database_time, load_report_changes
 )
 
-# excel_utils.py をインポート
-import excel_utils
+# pandas と excel_utils（pandas, xlsxwriter）は読み込みに時間がかかるため、
+# 使うページ（週間予定・マイページ・データエクスポート・お気に入りメンバー管理）の関数内でインポートする
 
-# CSSファイルを読み込む関数
-def load_css(file_name):
+# CSSファイルの内容を読み込む（プロセスごとに1回のみ）
+@st.cache_resource(show_spinner=False)
+def read_css(file_name):
     try:
         with open(file_name) as f:
-            st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+            return f.read()
     except Exception as e:
         logging.warning(f"スタイルファイル読み込みエラー: {e}")
+        return ""
 
-# カスタムCSSファイルの読み込み (スタイルファイルは static ディレクトリに配置)
-css_file_path = "static/style.css"
-load_css(css_file_path)
+# CSSファイルを読み込む関数
+def load_css(file_name):
+    css = read_css(file_name)
+    if css:
+        st.markdown(f'<style>{css}</style>', unsafe_allow_html=True)
 
-# ✅ PostgreSQL 初期化（データを消さない）
-init_db(keep_existing=True)
+# プロセス起動時の初期化（再実行のたびではなく、プロセスごとに1回だけ実行）
+@st.cache_resource(show_spinner=False)
+def bootstrap():
+    # ✅ PostgreSQL 初期化（未適用のマイグレーションを適用、データは消さない）
+    schema_ready = ensure_schema()
+    
+    # 通知アウトボックスのワーカーを起動
+    start_outbox_worker()
+    
+    # 他プロセスの書き込みでキャッシュを無効にするための変更通知の受信を開始
+    start_change_listener()
+    return schema_ready
 
-# 週間予定テーブルの必要なカラムの確認・追加
-add_weekly_schedule_columns()
+if not bootstrap():
+    # マイグレーションに失敗した場合は結果をキャッシュせず、次回の再実行で再試行する
+    bootstrap.clear()
 
 # ✅ ログイン状態を管理
 if "user" not in st.session_state:
@@ -536,6 +554,8 @@ def post_weekly_schedule():
         st.rerun()
 
 def show_weekly_schedules():
+    # 重いモジュールはこのページを開いたときに読み込む
+    import pandas as pd
     if "user" not in st.session_state or st.session_state["user"] is None:
         st.error("ログインしてください。")
         return
@@ -645,43 +665,51 @@ def show_weekly_schedules():
         # 「すべての週間予定を見る」以外の場合は、すべてのユーザーを表示
         selected_user = "すべて表示"
     
-    # 週間予定データ取得
-    schedules = load_weekly_schedules()
-
-    if not schedules:
-        st.info("週間予定はまだありません。")
+    # 週を選択している場合は、メンバー × 曜日の一覧表を1回のクエリで取得して表示
+    if selected_period is not None:
+        grid = get_weekly_schedule_grid(selected_start_date)
+        if not grid:
+            st.info("選択された週の週間予定はありません。")
+            return
+        
+        weekdays = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
+        japanese_weekdays = ["月", "火", "水", "木", "金", "土", "日"]
+        day_labels = []
+        for i in range(7):
+            day_date = selected_start_date + timedelta(days=i)
+            day_labels.append(f"{day_date.month}/{day_date.day} ({japanese_weekdays[i]})")
+        
+        rows = []
+        for schedule in grid:
+            row = {"メンバー": schedule["投稿者"]}
+            for day, label in zip(weekdays, day_labels):
+                day_data = schedule["days"].get(day, {})
+                cell = day_data.get("plan") or ""
+                if day_data.get("stores"):
+                    cell = f"{cell} 🏢 {day_data['stores']}".strip()
+                row[label] = cell
+            rows.append(row)
+        
+        st.markdown(f"## {selected_period}の予定（{len(grid)}件）")
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+        
+        # 選択したメンバーの予定の詳細とコメント
+        st.markdown("### 予定の詳細・コメント")
+        selected_index = st.selectbox(
+            "メンバーを選択",
+            options=range(len(grid)),
+            format_func=lambda i: f"{grid[i]['投稿者']}（投稿日時: {grid[i]['投稿日時']}）",
+            key="weekly_grid_member_selector"
+        )
+        schedule = grid[selected_index]
+        st.caption(f"投稿者: {schedule['投稿者']} / 投稿日時: {schedule['投稿日時']}")
+        show_schedule_comments(schedule, f"weekly_schedule_{schedule['id']}")
         return
-        
-    # 選択した期間で絞り込み
-    if selected_period is None:
-        # すべての週間予定を表示
-        filtered_schedules = schedules
-    else:
-        # 選択した期間で絞り込み（開始日と終了日で検索）
-        selected_start_str = selected_start_date.strftime("%Y-%m-%d")
-        selected_end_str = selected_end_date.strftime("%Y-%m-%d")
-        
-        # 期間が一致、または開始日・終了日が一致する週間予定を表示
-        filtered_schedules = []
-        for s in schedules:
-            # 期間が完全に一致する場合
-            if s.get("期間") == selected_period:
-                filtered_schedules.append(s)
-                continue
-                
-            # 開始日と終了日が一致する場合
-            if s.get("開始日") == selected_start_str and s.get("終了日") == selected_end_str:
-                filtered_schedules.append(s)
-                continue
-                
-            # 開始日のみで比較する場合
-            if s.get("開始日") == selected_start_str:
-                filtered_schedules.append(s)
-                continue
     
-    # ユーザーで絞り込み（すべて表示以外の場合）
-    if selected_user != "すべて表示":
-        filtered_schedules = [s for s in filtered_schedules if s.get("投稿者") == selected_user]
+    # 週間予定データ取得（選択したユーザーの分だけ取得）
+    filtered_schedules = load_weekly_schedules(
+        user_name=None if selected_user == "すべて表示" else selected_user
+    )
     
     if not filtered_schedules:
         st.info(f"選択された期間とユーザーに一致する週間予定はありません。")
@@ -763,34 +791,229 @@ def show_weekly_schedules():
 
                     st.caption(f"投稿者: {schedule['投稿者']} / 投稿日時: {schedule['投稿日時']}")
 
-                    # コメント表示
-                    if schedule["コメント"]:
-                        st.markdown("#### コメント")
-                        for comment in schedule["コメント"]:
-                            st.markdown(f"""
-                            <div class="comment-text">
-                            <strong>{comment['投稿者']}</strong> - {comment['投稿日時']}<br/>
-                            {comment['内容']}
-                            </div>
-                            ---
-                            """, unsafe_allow_html=True)
+                    show_schedule_comments(schedule, schedule_key)
+
+def show_schedule_comments(schedule, schedule_key):
+    """週間予定のコメント一覧とコメント入力フォームを表示"""
+    # コメント表示
+    if schedule["コメント"]:
+        st.markdown("#### コメント")
+        for comment in schedule["コメント"]:
+            st.markdown(f"""
+            <div class="comment-text">
+            <strong>{html.escape(comment['投稿者'])}</strong> - {comment['投稿日時']}<br/>
+            {text_to_html(comment['内容'])}
+            </div>
+            ---
+            """, unsafe_allow_html=True)
+
+    # コメント入力フォーム
+    with st.form(key=f"{schedule_key}_schedule_comment_{schedule['id']}"):
+        comment_text = st.text_area("コメントを入力", key=f"{schedule_key}_comment_text_{schedule['id']}")
+        submit_button = st.form_submit_button("コメントする")
+
+        if submit_button and comment_text.strip():
+            comment = {
+                "投稿者": st.session_state["user"]["name"],
+                "内容": comment_text,
+            }
+            if save_weekly_schedule_comment(schedule["id"], comment):
+                st.success("コメントを投稿しました！")
+                time.sleep(1)
+                st.rerun()
+            else:
+                st.error("コメントの投稿に失敗しました。")
 
-                    # コメント入力フォーム
-                    with st.form(key=f"{schedule_key}_schedule_comment_{schedule['id']}"):
-                        comment_text = st.text_area("コメントを入力", key=f"{schedule_key}_comment_text_{schedule['id']}")
-                        submit_button = st.form_submit_button("コメントする")
+# エクスポートファイルの拡張子 → (形式の表示名, MIMEタイプ)
+EXPORT_FILE_TYPES = {
+    ".xlsx": ("Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    ".parquet": ("Parquet", "application/vnd.apache.parquet")
+}
 
-                        if submit_button and comment_text.strip():
-                            comment = {
-                                "投稿者": st.session_state["user"]["name"],
-                                "内容": comment_text,
-                            }
-                            if save_weekly_schedule_comment(schedule["id"], comment):
-                                st.success("コメントを投稿しました！")
-                                time.sleep(1)
-                                st.rerun()
-                            else:
-                                st.error("コメントの投稿に失敗しました。")
+def read_export_file(path):
+    """エクスポートファイルの内容を読み込む（ダウンロードボタンが押されたときに呼ばれる）"""
+    with open(path, "rb") as file:
+        return file.read()
+
+def show_export_download(path, filename, key):
+    """エクスポートしたファイル（Excel・Parquet）のダウンロードボタンを表示
+
+    ファイルの中身はボタンが押されたときに読み込むため、ページの描画時にはメモリに載せない。
+    ボタンを押してもページは再実行しない（エクスポートボタンの表示が消えないようにする）。
+    """
+    if not path:
+        st.warning("エクスポートするデータがないか、エクスポート中にエラーが発生しました。")
+        return
+    format_name, mime = EXPORT_FILE_TYPES[os.path.splitext(path)[1]]
+    st.download_button(
+        f"{format_name}ファイルをダウンロード",
+        data=functools.partial(read_export_file, path),
+        file_name=filename,
+        mime=mime,
+        key=key,
+        on_click="ignore",
+        type="primary"
+    )
+
+def format_report_date(value):
+    """日報の日付を「4月1日（月）」の形式にする（変換できない場合はそのまま返す）"""
+    try:
+        if isinstance(value, str):
+            value = datetime.strptime(value, "%Y-%m-%d")
+        weekday = ["月", "火", "水", "木", "金", "土", "日"][value.weekday()]
+        return f"{value.month}月{value.day}日（{weekday}）"
+    except (ValueError, AttributeError):
+        return value
+
+def text_to_html(text):
+    """投稿されたテキストをエスケープし、改行を <br> にしたHTMLにする"""
+    return html.escape(text).replace('\n', '<br>')
+
+@st.cache_data(max_entries=2000, show_spinner=False)
+def render_report_body(report_id, version, _report):
+    """日報カードの本文を表示用に変換する
+    
+    日報IDと更新日時ごとにキャッシュするため、同じ日報の2回目以降の表示は変換しない。
+    _report はキャッシュのキーに含めない（内容が変われば version が変わる）。
+    
+    Returns:
+        {"date": 表示用の日付, "stores": 訪問店舗名, "content_html": 実施内容・所感, "action_html": 今後のアクション}
+    """
+    # 実施内容（すべて統合表示）
+    content = _report.get("実施内容") or _report.get("業務内容") or ""
+    # 所感データがあれば追加
+    impression = _report.get("所感") or _report.get("メンバー状況") or ""
+    if impression:
+        content = f"{content}\n\n{impression}" if content else impression
+    
+    # 今後のアクション（旧：翌日予定）
+    action = _report.get("今後のアクション") or _report.get("翌日予定") or ""
+    
+    visited_stores = _report.get("visited_stores") or []
+    return {
+        "date": format_report_date(_report["日付"]),
+        "stores": ", ".join(store["name"] for store in visited_stores),
+        "content_html": f"<div class='content-text'>{text_to_html(content)}</div>" if content else "",
+        "action_html": f"<div class='content-text'>{text_to_html(action)}</div>" if action else ""
+    }
+
+def get_report_body(report):
+    """日報カードの本文を取得（更新日時が変わるまではキャッシュを使う）"""
+    version = report.get("updated_at") or report.get("投稿日時")
+    return render_report_body(report["id"], version, report)
+
+# 検索結果で使うリアクションの種類（タイムラインは👍のみ）
+REACTION_TYPES = {
+    "👍": "thumbsup",
+    "👏": "clap",
+    "😊": "smile",
+    "🎉": "tada"
+}
+
+def react_to_report(report_id, reaction_type, reload_key):
+    """リアクションボタンのコールバック（カードの再描画前に実行される）"""
+    if update_reaction(report_id, st.session_state["user"]["name"], reaction_type):
+        st.session_state[reload_key] = True
+
+def comment_on_report(report_id, text_key, reload_key, message_key):
+    """コメントフォームのコールバック（カードの再描画前に実行される）"""
+    comment_text = st.session_state.get(text_key, "")
+    if not comment_text.strip():
+        return
+    
+    comment = {
+        "投稿者": st.session_state["user"]["name"],
+        "内容": comment_text,
+    }
+    if save_comment(report_id, comment):
+        st.session_state[reload_key] = True
+        st.session_state[text_key] = ""
+        st.session_state[message_key] = "success"
+    else:
+        st.session_state[message_key] = "error"
+
+@st.fragment
+def report_interactions(report, unique_prefix, reaction_types=None):
+    """日報カードのリアクション・コメント欄
+    
+    ボタンやフォームを操作してもこのカードだけが再実行され、対象の日報だけを読み直す。
+    
+    Args:
+        report: 表示する日報
+        unique_prefix: ウィジェットのキーの接頭辞
+        reaction_types: {絵文字: リアクション種別}。None の場合は👍のみ
+    """
+    reload_key = f"{unique_prefix}_reload"
+    message_key = f"{unique_prefix}_comment_message"
+    text_key = f"{unique_prefix}_comment_text"
+    
+    # 操作した直後は最新の状態を読み直す（他のカードは読み直さない）
+    if st.session_state.pop(reload_key, False):
+        report = load_report_by_id(report["id"]) or report
+    
+    user_name = st.session_state["user"]["name"]
+    
+    if reaction_types is None:
+        # リアクションボタン - 👍のみに簡素化
+        # リアクションの数を取得
+        reaction_count = len(report['reactions'].get("thumbsup", []))
+        
+        # ユーザーがすでにリアクションしているか確認
+        is_reacted = user_name in report['reactions'].get("thumbsup", [])
+        button_label = f"👍 {reaction_count}" if reaction_count else "👍"
+        
+        # ボタンスタイルの設定
+        button_style = "primary" if is_reacted else "secondary"
+        
+        # リアクションボタン
+        st.button(button_label, key=f"{unique_prefix}_reaction_thumbsup", type=button_style,
+                  on_click=react_to_report, args=(report['id'], "thumbsup", reload_key))
+    else:
+        # リアクションボタンバー - 横並びにするためのHTMLクラスを追加
+        st.markdown('<div class="reaction-buttons">', unsafe_allow_html=True)
+        columns = st.columns(len(reaction_types))
+        
+        # 各リアクションボタンを作成
+        for col, (emoji, key) in zip(columns, reaction_types.items()):
+            with col:
+                # リアクションの数を取得
+                reaction_count = len(report['reactions'].get(key, []))
+                
+                # ユーザーがすでにリアクションしているか確認
+                is_reacted = user_name in report['reactions'].get(key, [])
+                
+                # リアクション済みの場合は色を変える
+                button_text = f"{emoji} {reaction_count}" if reaction_count > 0 else emoji
+                st.button(button_text, key=f"{unique_prefix}_reaction_{key}", use_container_width=True,
+                          help="リアクションを取り消す" if is_reacted else "リアクションする",
+                          type="primary" if is_reacted else "secondary",
+                          on_click=react_to_report, args=(report['id'], key, reload_key))
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # コメント表示
+    if report["comments"]:
+        st.markdown("#### コメント")
+        for comment in report["comments"]:
+            st.markdown(f"""
+            <div class="comment-text">
+            <strong>{html.escape(comment['投稿者'])}</strong> - {comment['投稿日時']}<br/>
+            {text_to_html(comment['内容'])}
+            </div>
+            ---
+            """, unsafe_allow_html=True)
+    
+    # コメント入力フォーム
+    with st.form(key=f"{unique_prefix}_comment_form"):
+        st.text_area("コメントを入力", key=text_key)
+        st.form_submit_button("コメントする", on_click=comment_on_report,
+                              args=(report["id"], text_key, reload_key, message_key))
+    
+    message = st.session_state.pop(message_key, None)
+    if message == "success":
+        st.success("コメントを投稿しました！")
+    elif message == "error":
+        st.error("コメントの投稿に失敗しました。")
 
 def display_search_results(search_results_by_month, tab_suffix="search"):
     """検索結果表示関数"""
@@ -818,58 +1041,27 @@ def display_search_results(search_results_by_month, tab_suffix="search"):
             # タブ区別用サフィックスを追加して、ユニークなインデックスを生成
             unique_prefix = f"{tab_suffix}_{month_key}_{i}_{report['id']}"
             
-            # 日報日付から曜日を取得
-            try:
-                report_date = datetime.strptime(report["日付"], "%Y-%m-%d")
-                weekday = ["月", "火", "水", "木", "金", "土", "日"][report_date.weekday()]
-                formatted_date = f"{report_date.month}月{report_date.day}日（{weekday}）"
-            except:
-                formatted_date = report["日付"]
+            # 本文は日報の更新日時ごとにキャッシュしたものを使う
+            body = get_report_body(report)
             
             # 日報表示カード（コンテナでスタイリング）
             with st.container(border=True):
                 # タイトル部分
-                st.markdown(f"### 【{report['投稿者']}】 {formatted_date} ({report['所属部署']})")
+                st.markdown(f"### 【{report['投稿者']}】 {body['date']} ({report['所属部署']})")
                 
                 # 訪問店舗情報
-                visited_stores = report.get("visited_stores", [])
-                if visited_stores:
-                    store_names = [store["name"] for store in visited_stores]
-                    st.markdown(f"**訪問店舗**: {', '.join(store_names)}")
+                if body["stores"]:
+                    st.markdown(f"**訪問店舗**: {body['stores']}")
                 
                 # 実施内容（すべて統合表示）
-                content = ""
-                if "実施内容" in report and report["実施内容"]:
-                    content = report["実施内容"]
-                elif "業務内容" in report and report["業務内容"]:
-                    content = report["業務内容"]
-                    
-                # 所感データがあれば追加
-                if "所感" in report and report["所感"]:
-                    if content:
-                        content += "\n\n" + report["所感"]
-                    else:
-                        content = report["所感"]
-                elif "メンバー状況" in report and report["メンバー状況"]:
-                    if content:
-                        content += "\n\n" + report["メンバー状況"]
-                    else:
-                        content = report["メンバー状況"]
-                
-                if content:
+                if body["content_html"]:
                     st.markdown("**実施内容、所感など**")
-                    formatted_content = content.replace('\n', '<br>')
-                    st.markdown(f"<div class='content-text'>{formatted_content}</div>", unsafe_allow_html=True)
+                    st.markdown(body["content_html"], unsafe_allow_html=True)
                 
                 # 今後のアクション（旧：翌日予定）
-                if "今後のアクション" in report and report["今後のアクション"]:
+                if body["action_html"]:
                     st.markdown("**今後のアクション**")
-                    formatted_action = report["今後のアクション"].replace('\n', '<br>')
-                    st.markdown(f"<div class='content-text'>{formatted_action}</div>", unsafe_allow_html=True)
-                elif "翌日予定" in report and report["翌日予定"]:
-                    st.markdown("**今後のアクション**")
-                    formatted_action = report["翌日予定"].replace('\n', '<br>')
-                    st.markdown(f"<div class='content-text'>{formatted_action}</div>", unsafe_allow_html=True)
+                    st.markdown(body["action_html"], unsafe_allow_html=True)
                 
                 # 画像の表示
                 report_images = get_report_images(report['id'])
@@ -881,74 +1073,8 @@ def display_search_results(search_results_by_month, tab_suffix="search"):
                 
                 st.caption(f"投稿日時: {report['投稿日時']}")
                 
-                # リアクションボタンバー - 横並びにするためのHTMLクラスを追加
-                st.markdown('<div class="reaction-buttons">', unsafe_allow_html=True)
-                col1, col2, col3, col4 = st.columns(4)
-                
-                reaction_types = {
-                    "👍": "thumbsup",
-                    "👏": "clap",
-                    "😊": "smile",
-                    "🎉": "tada"
-                }
-                
-                # 各リアクションボタンを作成
-                for i, (emoji, key) in enumerate(reaction_types.items()):
-                    col = [col1, col2, col3, col4][i]
-                    with col:
-                        # リアクションの数を取得
-                        reaction_count = len(report['reactions'].get(key, []))
-                        
-                        # ユーザーがすでにリアクションしているか確認
-                        is_reacted = st.session_state["user"]["name"] in report['reactions'].get(key, [])
-                        
-                        # リアクション済みの場合は色を変える
-                        button_text = f"{emoji} {reaction_count}" if reaction_count > 0 else emoji
-                        button_key = f"{unique_prefix}_reaction_{key}"
-                        
-                        if is_reacted:
-                            if st.button(button_text, key=button_key, use_container_width=True, 
-                                        help="リアクションを取り消す", type="primary"):
-                                # リアクションを更新
-                                update_reaction(report['id'], st.session_state["user"]["name"], key)
-                                st.rerun()
-                        else:
-                            if st.button(button_text, key=button_key, use_container_width=True, 
-                                        help="リアクションする"):
-                                # リアクションを更新
-                                update_reaction(report['id'], st.session_state["user"]["name"], key)
-                                st.rerun()
-                
-                st.markdown('</div>', unsafe_allow_html=True)
-
-                # コメント表示
-                if report["comments"]:
-                    st.markdown("#### コメント")
-                    for comment in report["comments"]:
-                        st.markdown(f"""
-                        <div class="comment-text">
-                        <strong>{comment['投稿者']}</strong> - {comment['投稿日時']}<br/>
-                        {comment['内容']}
-                        </div>
-                        ---
-                        """, unsafe_allow_html=True)
-                
-                # コメント入力フォーム
-                with st.form(key=f"{unique_prefix}_comment_{report['id']}"):
-                    comment_text = st.text_area("コメントを入力", key=f"{unique_prefix}_comment_text_{report['id']}")
-                    submit_button = st.form_submit_button("コメントする")
-                    
-                    if submit_button and comment_text.strip():
-                        comment = {
-                            "投稿者": st.session_state["user"]["name"],
-                            "内容": comment_text,
-                        }
-                        if save_comment(report["id"], comment):
-                            st.success("コメントを投稿しました！")
-                            time.sleep(1)
-                            st.rerun()
-                        else:
-                            st.error("コメントの投稿に失敗しました。")
+                # リアクション・コメント（操作したカードだけを再描画）
+                report_interactions(report, unique_prefix, reaction_types=REACTION_TYPES)
                 
                 # マイページからのみ編集・削除可能
                 # 編集・削除ボタンは表示しない
@@ -1034,15 +1160,107 @@ def timeline():
     # 選択した週の開始日と終了日
     selected_start_date, selected_end_date, _ = week_options[selected_week_index]
     
+    # 新着・リアクション・コメントは変更通知を受けて差分だけ反映する
+    timeline_feed(time_range_param, selected_start_date, selected_end_date)
+
+# タイムラインの差分確認の間隔（秒）
+TIMELINE_REFRESH_INTERVAL = 10
+# 変更通知がなくても差分を確認する間隔（秒）。通知を取りこぼした場合の保険
+TIMELINE_RESYNC_INTERVAL = 60
+
+def is_report_in_timeline(report, time_range_param, start_date, end_date):
+    """日報がタイムラインの表示条件（時間範囲または週）に含まれるか判定"""
+    if time_range_param:
+        posted_at = report["投稿日時"]
+        if isinstance(posted_at, str):
+            posted_at = datetime.strptime(posted_at, "%Y-%m-%d %H:%M:%S")
+        hours = 24 if time_range_param == "24h" else 24 * 7
+        return posted_at >= get_current_time() - timedelta(hours=hours)
+    
+    report_date = report["日付"]
+    if isinstance(report_date, str):
+        report_date = datetime.strptime(report_date, "%Y-%m-%d").date()
+    return start_date <= report_date <= end_date
+
+def load_timeline_reports(time_range_param, start_date, end_date):
+    """タイムラインの日報を全件読み込み、差分取得の状態を作り直す"""
+    # 基準時刻とバージョンは読み込む前に取る（読み込み中の変更は次回の差分でもう一度反映される）
+    version = get_table_version("reports")
+    synced_at = get_database_time()
+    
     # 時間範囲が指定されている場合は優先し、それ以外は週で絞り込み
     if time_range_param:
         # レポート読み込み - 時間範囲に基づく
         reports = load_reports(time_range=time_range_param)
     else:
         # 選択した週のレポートを読み込む
-        reports = load_reports_by_date(selected_start_date, selected_end_date)
+        reports = load_reports_by_date(start_date, end_date)
+    
+    return {
+        "mode": (time_range_param, start_date, end_date),
+        "reports": reports,
+        "cursor": max(((r["投稿日時"], r["id"]) for r in reports), default=None),
+        "synced_at": synced_at,
+        "version": version,
+        "checked_at": time.monotonic()
+    }
+
+def apply_timeline_changes(state):
+    """前回以降の新着・更新・削除を取得し、表示中の日報リストにマージする
+    
+    Returns:
+        反映できた場合は True、全件の読み直しが必要な場合は False
+    """
+    time_range_param, start_date, end_date = state["mode"]
+    version = get_table_version("reports")
+    changes = load_report_changes(state["cursor"], state["synced_at"])
+    if changes is None:
+        return False
+    
+    reports = {report["id"]: report for report in state["reports"]}
+    for report in changes["reports"]:
+        if state["cursor"] is None or (report["投稿日時"], report["id"]) > state["cursor"]:
+            state["cursor"] = (report["投稿日時"], report["id"])
+        if is_report_in_timeline(report, time_range_param, start_date, end_date):
+            reports[report["id"]] = report
+        else:
+            reports.pop(report["id"], None)  # 編集で日付が変わった場合など
+    for report_id in changes["deleted_ids"]:
+        reports.pop(report_id, None)
     
-    display_reports(reports, tab_suffix="all")
+    # 時間範囲の表示は時間の経過で外れた日報も取り除く
+    if time_range_param:
+        sort_key = lambda r: (r["投稿日時"], r["id"])
+    else:
+        sort_key = lambda r: (r["日付"], r["投稿日時"])
+    state["reports"] = sorted(
+        (r for r in reports.values() if is_report_in_timeline(r, time_range_param, start_date, end_date)),
+        key=sort_key,
+        reverse=True
+    )
+    state["synced_at"] = changes["synced_at"]
+    state["version"] = version
+    state["checked_at"] = time.monotonic()
+    return True
+
+@st.fragment(run_every=TIMELINE_REFRESH_INTERVAL)
+def timeline_feed(time_range_param, start_date, end_date):
+    """タイムラインの日報一覧（一定間隔で変更の有無を確認し、差分だけ読み込む）"""
+    mode = (time_range_param, start_date, end_date)
+    state = st.session_state.get("timeline_feed")
+    
+    if state is None or state["mode"] != mode or state["synced_at"] is None:
+        state = load_timeline_reports(time_range_param, start_date, end_date)
+    elif (state["version"] != get_table_version("reports")
+          or not is_change_listener_alive()
+          or time.monotonic() - state["checked_at"] >= TIMELINE_RESYNC_INTERVAL):
+        # 変更がなければ何も取得しない
+        if not apply_timeline_changes(state):
+            state = load_timeline_reports(time_range_param, start_date, end_date)
+    
+    st.session_state["timeline_feed"] = state
+    
+    display_reports(state["reports"], tab_suffix="all")
 
 def display_reports(reports, tab_suffix="all"):
     """日報表示関数"""
@@ -1052,57 +1270,27 @@ def display_reports(reports, tab_suffix="all"):
 
     for i, report in enumerate(reports):
         # タブ区別用サフィックスを追加して、ユニークなインデックスを生成
-        unique_prefix = f"{st.session_state['page']}_{tab_suffix}_{i}_{report['id']}"
+        # 新着で並び順が変わっても入力中のコメントが消えないよう、位置ではなく日報IDで区別する
+        unique_prefix = f"{st.session_state['page']}_{tab_suffix}_{report['id']}"
         
-        # 日報日付から曜日を取得
-        try:
-            report_date = datetime.strptime(report["日付"], "%Y-%m-%d")
-            weekday = ["月", "火", "水", "木", "金", "土", "日"][report_date.weekday()]
-            formatted_date = f"{report_date.month}月{report_date.day}日（{weekday}）"
-        except:
-            formatted_date = report["日付"]
+        # 本文は日報の更新日時ごとにキャッシュしたものを使う
+        body = get_report_body(report)
 
         # 日報表示カード
-        with st.expander(f"【{report['投稿者']}】 {formatted_date} ({report['所属部署']})", expanded=True):
+        with st.expander(f"【{report['投稿者']}】 {body['date']} ({report['所属部署']})", expanded=True):
             # 訪問店舗情報
-            visited_stores = report.get("visited_stores", [])
-            if visited_stores:
-                store_names = [store["name"] for store in visited_stores]
-                st.markdown(f"**訪問店舗**: {', '.join(store_names)}")
+            if body["stores"]:
+                st.markdown(f"**訪問店舗**: {body['stores']}")
             
             # 実施内容（すべて統合表示）
-            content = ""
-            if "実施内容" in report and report["実施内容"]:
-                content = report["実施内容"]
-            elif "業務内容" in report and report["業務内容"]:
-                content = report["業務内容"]
-                
-            # 所感データがあれば追加
-            if "所感" in report and report["所感"]:
-                if content:
-                    content += "\n\n" + report["所感"]
-                else:
-                    content = report["所感"]
-            elif "メンバー状況" in report and report["メンバー状況"]:
-                if content:
-                    content += "\n\n" + report["メンバー状況"]
-                else:
-                    content = report["メンバー状況"]
-            
-            if content:
+            if body["content_html"]:
                 st.markdown("**実施内容、所感など**")
-                formatted_content = content.replace('\n', '<br>')
-                st.markdown(f"<div class='content-text'>{formatted_content}</div>", unsafe_allow_html=True)
+                st.markdown(body["content_html"], unsafe_allow_html=True)
             
             # 今後のアクション（旧：翌日予定）
-            if "今後のアクション" in report and report["今後のアクション"]:
-                st.markdown("**今後のアクション**")
-                formatted_action = report["今後のアクション"].replace('\n', '<br>')
-                st.markdown(f"<div class='content-text'>{formatted_action}</div>", unsafe_allow_html=True)
-            elif "翌日予定" in report and report["翌日予定"]:
+            if body["action_html"]:
                 st.markdown("**今後のアクション**")
-                formatted_action = report["翌日予定"].replace('\n', '<br>')
-                st.markdown(f"<div class='content-text'>{formatted_action}</div>", unsafe_allow_html=True)
+                st.markdown(body["action_html"], unsafe_allow_html=True)
             
             # 画像の表示
             report_images = get_report_images(report['id'])
@@ -1114,50 +1302,8 @@ def display_reports(reports, tab_suffix="all"):
             
             st.caption(f"投稿日時: {report['投稿日時']}")
             
-            # リアクションボタン - 👍のみに簡素化
-            # リアクションの数を取得
-            reaction_count = len(report['reactions'].get("thumbsup", []))
-            
-            # ユーザーがすでにリアクションしているか確認
-            is_reacted = st.session_state["user"]["name"] in report['reactions'].get("thumbsup", [])
-            button_label = f"👍 {reaction_count}" if reaction_count else "👍"
-            
-            # ボタンスタイルの設定
-            button_style = "primary" if is_reacted else "secondary"
-            
-            # リアクションボタン
-            if st.button(button_label, key=f"{unique_prefix}_reaction_thumbsup", type=button_style):
-                if update_reaction(report['id'], st.session_state["user"]["name"], "thumbsup"):
-                    st.rerun()
-
-            # コメント表示
-            if report["comments"]:
-                st.markdown("#### コメント")
-                for comment in report["comments"]:
-                    st.markdown(f"""
-                    <div class="comment-text">
-                    <strong>{comment['投稿者']}</strong> - {comment['投稿日時']}<br/>
-                    {comment['内容']}
-                    </div>
-                    ---
-                    """, unsafe_allow_html=True)
-            
-            # コメント入力フォーム
-            with st.form(key=f"{unique_prefix}_comment_form"):
-                comment_text = st.text_area("コメントを入力", key=f"{unique_prefix}_comment_text")
-                submit_button = st.form_submit_button("コメントする")
-                
-                if submit_button and comment_text.strip():
-                    comment = {
-                        "投稿者": st.session_state["user"]["name"],
-                        "内容": comment_text,
-                    }
-                    if save_comment(report["id"], comment):
-                        st.success("コメントを投稿しました！")
-                        time.sleep(1)
-                        st.rerun()
-                    else:
-                        st.error("コメントの投稿に失敗しました。")
+            # リアクション・コメント（操作したカードだけを再描画）
+            report_interactions(report, unique_prefix)
 
             # マイページからのみ編集・削除可能
             # 編集・削除ボタンは表示しない
@@ -1226,10 +1372,8 @@ def post_report():
     if location_tab_index == "予定から選択":
         # 直近の週間予定を取得
         from db_utils import load_weekly_schedules
-        schedules = load_weekly_schedules()
-        
-        # 自分の予定だけをフィルタリング
-        user_schedules = [s for s in schedules if s["投稿者"] == st.session_state["user"]["name"]]
+        # 自分の予定だけを取得
+        user_schedules = load_weekly_schedules(user_name=st.session_state["user"]["name"])
         
         if not user_schedules:
             st.info("週間予定の登録がありません。まずは週間予定を登録してください。")
@@ -1258,28 +1402,17 @@ def post_report():
                 period_schedules = schedule_periods[selected_period]
                 first_schedule = period_schedules[0]  # 同一期間なら最初のものを使用
                 
-                # 曜日ごとの店舗リスト
-                weekdays = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
-                weekday_stores = []
-                
-                for weekday in weekdays:
-                    # 各曜日の訪問店舗データを取得する際、キーに「_visited_stores」が付いていることを考慮
-                    stores_key = f"{weekday}_visited_stores"
-                    store_list = first_schedule.get(stores_key, [])
-                    
-                    if store_list:
-                        for store in store_list:
-                            store_key = f"{store.get('code', '')}: {store.get('name', '')}"
-                            if store_key not in [s[0] for s in weekday_stores]:
-                                weekday_stores.append((store_key, f"{weekday}の予定: {store.get('name', '')}"))
+                # 期間内の予定店舗（重複なし）をまとめて取得
+                planned_stores = get_planned_stores(
+                    first_schedule["開始日"], first_schedule["終了日"],
+                    user_name=st.session_state["user"]["name"]
+                )
                 
-                if weekday_stores:
-                    # 重複を除去して店舗リストとして表示
-                    store_options = [s[0] for s in weekday_stores]
-                    store_labels = [s[1] for s in weekday_stores]
+                if planned_stores:
+                    store_options = [store["key"] for store in planned_stores]
                     
                     # selectboxに表示する選択肢とラベルのマッピング
-                    store_dict = {option: label for option, label in zip(store_options, store_labels)}
+                    store_dict = {store["key"]: store["label"] for store in planned_stores}
                     
                     # デフォルト値設定
                     if st.session_state.selected_stores and st.session_state.selected_stores[0] in store_options:
@@ -1428,24 +1561,20 @@ def post_report():
                 "visited_stores": stores_data
             }
             
-            # データベースに保存
-            report_id = save_report(report)
+            # 添付画像をBase64エンコード
+            images = [
+                {
+                    "file_name": file.name,
+                    "file_type": file.type,
+                    "image_data": base64.b64encode(file.getvalue()).decode('utf-8')
+                }
+                for file in (uploaded_files or [])
+            ]
+            
+            # 日報・訪問店舗・画像をまとめてデータベースに保存
+            report_id = submit_report(report, images)
             
             if report_id:
-                # 画像がアップロードされていれば保存
-                if uploaded_files:
-                    for file in uploaded_files:
-                        # 画像ファイルをBase64エンコード
-                        file_bytes = file.getvalue()
-                        file_type = file.type
-                        file_name = file.name
-                        encoded_image = base64.b64encode(file_bytes).decode('utf-8')
-                        
-                        # 画像を日報に関連付けて保存
-                        image_id = save_report_image(report_id, file_name, file_type, encoded_image)
-                        if not image_id:
-                            st.warning(f"画像の保存に失敗しました：{file_name}")
-                
                 # 選択をクリア
                 st.session_state.selected_stores = []
                 st.session_state.custom_locations = ""
@@ -1506,10 +1635,8 @@ def edit_report_page():
         if location_tab_index == "予定から選択":
             # 直近の週間予定を取得
             from db_utils import load_weekly_schedules
-            schedules = load_weekly_schedules()
-            
-            # 自分の予定だけをフィルタリング
-            user_schedules = [s for s in schedules if s["投稿者"] == st.session_state["user"]["name"]]
+            # 自分の予定だけを取得
+            user_schedules = load_weekly_schedules(user_name=st.session_state["user"]["name"])
             
             if not user_schedules:
                 st.info("週間予定の登録がありません。まずは週間予定を登録してください。")
@@ -1541,28 +1668,17 @@ def edit_report_page():
                     period_schedules = schedule_periods[selected_period]
                     first_schedule = period_schedules[0]  # 同一期間なら最初のものを使用
                     
-                    # 曜日ごとの店舗リスト
-                    weekdays = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
-                    weekday_stores = []
-                    
-                    for weekday in weekdays:
-                        # 各曜日の訪問店舗データを取得する際、キーに「_visited_stores」が付いていることを考慮
-                        stores_key = f"{weekday}_visited_stores"
-                        store_list = first_schedule.get(stores_key, [])
-                        
-                        if store_list:
-                            for store in store_list:
-                                store_key = f"{store.get('code', '')}: {store.get('name', '')}"
-                                if store_key not in [s[0] for s in weekday_stores]:
-                                    weekday_stores.append((store_key, f"{weekday}の予定: {store.get('name', '')}"))
+                    # 期間内の予定店舗（重複なし）をまとめて取得
+                    planned_stores = get_planned_stores(
+                        first_schedule["開始日"], first_schedule["終了日"],
+                        user_name=st.session_state["user"]["name"]
+                    )
                     
-                    if weekday_stores:
-                        # 重複を除去して店舗リストとして表示
-                        store_options = [s[0] for s in weekday_stores]
-                        store_labels = [s[1] for s in weekday_stores]
+                    if planned_stores:
+                        store_options = [store["key"] for store in planned_stores]
                         
                         # selectboxに表示する選択肢とラベルのマッピング
-                        store_dict = {option: label for option, label in zip(store_options, store_labels)}
+                        store_dict = {store["key"]: store["label"] for store in planned_stores}
                         
                         # デフォルト値設定（既存の値があれば優先）
                         if existing_store_ids and existing_store_ids[0] in store_options:
@@ -1963,14 +2079,87 @@ def display_notifications(notifications, mark_as_read_function):
             st.error(f"通知の表示中にエラーが発生しました: {e}")
             continue
 
+def delete_my_report(report_id, deleted_key, message_key):
+    """削除ボタンのコールバック（カードの再描画前に実行される）"""
+    if delete_report(report_id):
+        st.session_state[deleted_key] = True
+    else:
+        st.session_state[message_key] = "error"
+
+@st.fragment
+def my_report_card(report, unique_prefix, expanded=False):
+    """マイページの自分の日報カード（削除などの操作はこのカードだけを再実行する）"""
+    deleted_key = f"{unique_prefix}_deleted"
+    message_key = f"{unique_prefix}_delete_message"
+    
+    # 削除した日報は一覧を読み直すまでメッセージだけ表示
+    if st.session_state.get(deleted_key):
+        st.success("日報を削除しました！")
+        return
+    
+    # 本文は日報の更新日時ごとにキャッシュしたものを使う
+    body = get_report_body(report)
+    
+    # 日報表示カード
+    with st.expander(f"{body['date']} ({report['所属部署']})", expanded=expanded):
+        # 訪問店舗情報
+        if body["stores"]:
+            st.markdown(f"**訪問店舗**: {body['stores']}")
+        
+        # 実施内容（すべて統合表示）
+        if body["content_html"]:
+            st.markdown("**実施内容、所感など**")
+            st.markdown(body["content_html"], unsafe_allow_html=True)
+        
+        # 今後のアクション（旧：翌日予定）
+        if body["action_html"]:
+            st.markdown("#### 今後のアクション")
+            st.markdown(body["action_html"], unsafe_allow_html=True)
+        
+        # 画像の表示
+        report_images = get_report_images(report['id'])
+        if report_images:
+            st.markdown("#### 添付画像")
+            for img_idx, img in enumerate(report_images):
+                st.markdown(f"**{img['file_name']}**")
+                st.markdown(f"<img src='data:{img['file_type']};base64,{img['image_data']}' style='max-width:100%;'>", unsafe_allow_html=True)
+        
+        st.caption(f"投稿日時: {report['投稿日時']}")
+        
+        # コメント表示
+        if report.get("comments", []):
+            st.markdown("#### コメント")
+            for comment in report["comments"]:
+                st.markdown(f"""
+                <div class="comment-text">
+                <strong>{html.escape(comment['投稿者'])}</strong> - {comment['投稿日時']}<br/>
+                {text_to_html(comment['内容'])}
+                </div>
+                ---
+                """, unsafe_allow_html=True)
+        
+        # 編集・削除ボタン
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("編集", key=f"{unique_prefix}_edit"):
+                st.session_state["edit_report_id"] = report["id"]
+                switch_page("日報編集")
+                st.rerun()
+        with col2:
+            st.button("削除", key=f"{unique_prefix}_delete",
+                      on_click=delete_my_report, args=(report["id"], deleted_key, message_key))
+            if st.session_state.pop(message_key, None) == "error":
+                st.error("日報の削除に失敗しました。")
+
 def my_page():
+    # 重いモジュールはこのページを開いたときに読み込む
+    import pandas as pd
+    import calendar
+    import excel_utils
     if "user" not in st.session_state or st.session_state["user"] is None:
         st.error("ログインしてください。")
         return
 
-    # pandas をインポート
-    import pandas as pd
-
     st.title("マイページ")
 
     # ユーザー情報取得
@@ -2167,13 +2356,9 @@ def my_page():
             if st.button("Excelでダウンロード", key="store_visits_excel"):
                 # stats形式を汎用エクスポート関数用に変換
                 visits_data = {selected_user_name: stats}
-                download_link = excel_utils.export_store_visits_to_excel(
-                    visits_data, 
-                    f"{selected_user_name}_{year}年{month}月_店舗訪問履歴.xlsx"
-                )
-                st.markdown(download_link, unsafe_allow_html=True)
-                # デバッグ情報を表示
-                st.info("ダウンロードリンクが表示されない場合は、ページを再読み込みしてからもう一度試してください。")
+                excel_filename = f"{selected_user_name}_{year}年{month}月_店舗訪問履歴.xlsx"
+                excel_path = excel_utils.export_store_visits_to_excel(visits_data)
+                show_export_download(excel_path, excel_filename, "store_visits_excel_download")
             
             st.markdown("---")
             
@@ -2256,102 +2441,15 @@ def my_page():
                 if my_reports:
                     # Excelエクスポート用のボタン
                     if st.button("Excelでダウンロード", key="my_reports_excel"):
-                        download_link = excel_utils.export_to_excel(my_reports, f"マイ日報_{user['name']}.xlsx", include_content=True)
-                        st.markdown(download_link, unsafe_allow_html=True)
+                        excel_filename = f"マイ日報_{user['name']}.xlsx"
+                        excel_path = excel_utils.export_to_excel(my_reports, include_content=True)
+                        show_export_download(excel_path, excel_filename, "my_reports_excel_download")
                     
                     st.markdown("---")
                     
-                    # 専用の表示関数を作成せず、my_reportsを直接表示
+                    # 日報ごとに描画（削除などの操作はそのカードだけを再実行）
                     for i, report in enumerate(my_reports):
-                        # ユニークなプレフィックス
-                        unique_prefix = f"mypage_reports_{i}_{report['id']}"
-                        
-                        # 日報日付から曜日を取得
-                        try:
-                            report_date = datetime.strptime(report["日付"], "%Y-%m-%d")
-                            weekday = ["月", "火", "水", "木", "金", "土", "日"][report_date.weekday()]
-                            formatted_date = f"{report_date.month}月{report_date.day}日（{weekday}）"
-                        except:
-                            formatted_date = report["日付"]
-
-                        # 日報表示カード
-                        with st.expander(f"{formatted_date} ({report['所属部署']})", expanded=(i==0)):
-                            # 訪問店舗情報
-                            visited_stores = report.get("visited_stores", [])
-                            if visited_stores:
-                                store_names = [store["name"] for store in visited_stores]
-                                st.markdown(f"**訪問店舗**: {', '.join(store_names)}")
-                            
-                            # 実施内容（すべて統合表示）
-                            content = ""
-                            if "実施内容" in report and report["実施内容"]:
-                                content = report["実施内容"]
-                            elif "業務内容" in report and report["業務内容"]:
-                                content = report["業務内容"]
-                                
-                            # 所感データがあれば追加
-                            if "所感" in report and report["所感"]:
-                                if content:
-                                    content += "\n\n" + report["所感"]
-                                else:
-                                    content = report["所感"]
-                            elif "メンバー状況" in report and report["メンバー状況"]:
-                                if content:
-                                    content += "\n\n" + report["メンバー状況"]
-                                else:
-                                    content = report["メンバー状況"]
-                            
-                            if content:
-                                st.markdown("**実施内容、所感など**")
-                                formatted_content = content.replace('\n', '<br>')
-                                st.markdown(f"<div class='content-text'>{formatted_content}</div>", unsafe_allow_html=True)
-                            
-                            # 今後のアクション（旧：翌日予定）
-                            if "今後のアクション" in report and report["今後のアクション"]:
-                                st.markdown("#### 今後のアクション")
-                                st.markdown(report["今後のアクション"].replace("\n", "  \n"))
-                            elif "翌日予定" in report and report["翌日予定"]:
-                                st.markdown("#### 今後のアクション")
-                                st.markdown(report["翌日予定"].replace("\n", "  \n"))
-                            
-                            # 画像の表示
-                            report_images = get_report_images(report['id'])
-                            if report_images:
-                                st.markdown("#### 添付画像")
-                                for img_idx, img in enumerate(report_images):
-                                    st.markdown(f"**{img['file_name']}**")
-                                    st.markdown(f"<img src='data:{img['file_type']};base64,{img['image_data']}' style='max-width:100%;'>", unsafe_allow_html=True)
-                            
-                            st.caption(f"投稿日時: {report['投稿日時']}")
-                            
-                            # コメント表示
-                            if report.get("comments", []):
-                                st.markdown("#### コメント")
-                                for comment in report["comments"]:
-                                    st.markdown(f"""
-                                    <div class="comment-text">
-                                    <strong>{comment['投稿者']}</strong> - {comment['投稿日時']}<br/>
-                                    {comment['内容']}
-                                    </div>
-                                    ---
-                                    """, unsafe_allow_html=True)
-                            
-                            # 編集・削除ボタン
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                if st.button("編集", key=f"{unique_prefix}_edit"):
-                                    st.session_state["edit_report_id"] = report["id"]
-                                    switch_page("日報編集")
-                                    st.rerun()
-                            with col2:
-                                if st.button("削除", key=f"{unique_prefix}_delete"):
-                                    from db_utils import delete_report
-                                    if delete_report(report["id"]):
-                                        st.success("日報を削除しました！")
-                                        time.sleep(1)
-                                        st.rerun()
-                                    else:
-                                        st.error("日報の削除に失敗しました。")
+                        my_report_card(report, f"mypage_reports_{report['id']}", expanded=(i==0))
                 else:
                     st.info("表示できる日報はありません。")
             
@@ -2398,48 +2496,24 @@ def my_page():
             
         # 週間予定取得
         from db_utils import load_weekly_schedules, save_weekly_schedule_comment, delete_report
-        weekly_schedules = load_weekly_schedules()
-        
-        # 自分の週間予定だけをフィルタリング
-        my_schedules = [s for s in weekly_schedules if s.get("投稿者") == user["name"]]
-            
-        if not my_schedules:
-            st.info("表示できる週間予定はありません。")
+        # 自分の週間予定を表示期間内の分だけ取得
+        posted_since = None
+        if time_range == "1ヶ月以内":
+            posted_since = datetime.now() - timedelta(days=30)
+        elif time_range == "3ヶ月以内":
+            posted_since = datetime.now() - timedelta(days=90)
+        filtered_schedules = load_weekly_schedules(user_name=user["name"], posted_since=posted_since)
+            
+        if not filtered_schedules:
+            st.info("選択した期間内の週間予定はありません。")
         else:
-            # 時間範囲に基づいてフィルタリング
-            now = datetime.now()
-            filtered_schedules = []
-            
-            for schedule in my_schedules:
-                # 投稿日時を日付オブジェクトに変換
-                post_time_str = schedule.get('投稿日時', '')
-                if isinstance(post_time_str, str) and post_time_str:
-                    try:
-                        post_time = datetime.strptime(post_time_str, "%Y-%m-%d %H:%M:%S")
-                        time_diff = now - post_time
-                        
-                        if time_range == "1ヶ月以内" and time_diff.days <= 30:
-                            filtered_schedules.append(schedule)
-                        elif time_range == "3ヶ月以内" and time_diff.days <= 90:
-                            filtered_schedules.append(schedule)
-                        elif time_range == "すべて表示":
-                            filtered_schedules.append(schedule)
-                    except:
-                        # 日付変換エラーの場合はすべての範囲に含める
-                        filtered_schedules.append(schedule)
-                else:
-                    # 投稿日時がない場合もすべての範囲に含める
-                    filtered_schedules.append(schedule)
-                
-            if not filtered_schedules:
-                st.info(f"選択した期間内の週間予定はありません。")
-            else:
-                # Excelエクスポート用のボタン
-                if st.button("Excelでダウンロード", key="my_schedules_excel"):
-                    download_link = excel_utils.export_weekly_schedules_to_excel(filtered_schedules, f"マイ週間予定_{user['name']}.xlsx")
-                    st.markdown(download_link, unsafe_allow_html=True)
-                
-                st.markdown("---")
+            # Excelエクスポート用のボタン
+            if st.button("Excelでダウンロード", key="my_schedules_excel"):
+                excel_filename = f"マイ週間予定_{user['name']}.xlsx"
+                excel_path = excel_utils.export_weekly_schedules_to_excel(filtered_schedules)
+                show_export_download(excel_path, excel_filename, "my_schedules_excel_download")
+            
+            st.markdown("---")
             
             # 週間予定を表示
             for i, schedule in enumerate(filtered_schedules):
@@ -2638,7 +2712,55 @@ def my_page():
             elif len(filtered_schedules) == 0:
                 st.info("表示できる週間予定はありません。")
 
+# エクスポートジョブの状態を確認する間隔（秒）
+EXPORT_STATUS_INTERVAL = 2
+# 1セッションで表示するエクスポートジョブの数
+EXPORT_JOBS_PER_SESSION = 5
+
+def start_export_job(kind, params, filename):
+    """エクスポートをバックグラウンドのジョブとして開始し、このセッションのジョブ一覧に加える"""
+    import export_jobs
+    job_id = export_jobs.submit_export_job(kind, params, filename)
+    if job_id is None:
+        st.error("エクスポートを開始できませんでした。時間をおいてもう一度お試しください。")
+        return
+    job_ids = st.session_state.setdefault("export_job_ids", [])
+    if job_id in job_ids:
+        job_ids.remove(job_id)
+    job_ids.append(job_id)
+    del job_ids[:-EXPORT_JOBS_PER_SESSION]
+
+@st.fragment(run_every=EXPORT_STATUS_INTERVAL)
+def export_job_panel():
+    """このセッションで開始したエクスポートの状態（進捗・ダウンロード）を表示"""
+    import export_jobs
+    jobs = [export_jobs.get_export_job(job_id) for job_id in st.session_state.get("export_job_ids", [])]
+    jobs = [job for job in jobs if job]
+    if not jobs:
+        return
+
+    st.markdown("#### エクスポート状況")
+    for job in reversed(jobs):
+        if job["status"] == "running":
+            if job["total"]:
+                st.progress(min(job["rows"] / job["total"], 1.0),
+                            text=f"{job['filename']}: {job['stage']}（{job['rows']}/{job['total']}行）")
+            elif job["rows"]:
+                st.progress(0.0, text=f"{job['filename']}: {job['stage']}（{job['rows']}行）")
+            else:
+                st.progress(0.0, text=f"{job['filename']}: {job['stage']}")
+        elif job["status"] == "done":
+            st.markdown(f"**{job['filename']}**")
+            show_export_download(job["path"], job["filename"], f"export_job_{job['id']}")
+        elif job["status"] == "empty":
+            st.warning(f"{job['filename']}: 指定された条件に一致するデータがありません。")
+        else:
+            st.error(f"{job['filename']}: エクスポート中にエラーが発生しました（{job['error']}）")
+
 def export_data():
+    # 重いモジュールはこのページを開いたときに読み込む
+    import pandas as pd
+    import calendar
     if "user" not in st.session_state or st.session_state["user"] is None:
         st.error("ログインしてください。")
         return
@@ -2649,9 +2771,13 @@ def export_data():
         return
 
     st.title("📊 データエクスポート")
-    st.info("各種データをExcel形式でエクスポートできます。")
+    st.info("各種データをExcel形式（分析用データはParquet形式）でエクスポートできます。")
+    
+    # エクスポートはバックグラウンドで実行し、状態とダウンロードボタンはここに表示する
+    job_panel = st.container()
 
-    tab1, tab2, tab3, tab4 = st.tabs(["日報データ", "週間予定データ", "投稿統計", "店舗訪問データ"])
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["日報データ", "週間予定データ", "投稿統計", "店舗訪問データ", "担当店舗カバー率",
+                                                  "分析用データ（Parquet）"])
 
     with tab1:
         st.markdown("### 日報データのエクスポート")
@@ -2670,41 +2796,13 @@ def export_data():
         department = "営業部"
         
         if st.button("日報データをエクスポート", type="primary"):
-            with st.spinner("データを取得しています..."):
-                # 条件に合った日報データを取得
-                from db_utils import load_reports_by_date
-                
-                # 営業部のみに固定
-                dept = department
-                
-                # データ取得
-                reports = load_reports(depart=dept)
-                
-                # 日付フィルタリング
-                start_date_str = start_date.strftime("%Y-%m-%d")
-                end_date_str = end_date.strftime("%Y-%m-%d")
-                
-                # 日付型と文字列型を正しく処理
-                filtered_reports = []
-                for r in reports:
-                    if isinstance(r["日付"], str):
-                        # 日付が文字列の場合
-                        if start_date_str <= r["日付"] <= end_date_str:
-                            filtered_reports.append(r)
-                    else:
-                        # 日付がdatetime.date型の場合
-                        date_str = r["日付"].strftime("%Y-%m-%d")
-                        if start_date_str <= date_str <= end_date_str:
-                            filtered_reports.append(r)
-                
-                if filtered_reports:
-                    # 日付範囲をファイル名に含める
-                    excel_filename = f"日報データ_{start_date_str}_{end_date_str}.xlsx"
-                    # 「内容」と「今後のアクション」列を含める
-                    download_link = excel_utils.export_to_excel(filtered_reports, excel_filename, include_content=True)
-                    st.markdown(download_link, unsafe_allow_html=True)
-                else:
-                    st.warning("指定された条件に一致する日報データがありません。")
+            start_date_str = start_date.strftime("%Y-%m-%d")
+            end_date_str = end_date.strftime("%Y-%m-%d")
+            
+            # 日付範囲をファイル名に含める
+            excel_filename = f"日報データ_{start_date_str}_{end_date_str}.xlsx"
+            start_export_job("reports", {"start_date": start_date, "end_date": end_date, "depart": department},
+                             excel_filename)
 
     with tab2:
         st.markdown("### 週間予定データのエクスポート")
@@ -2721,34 +2819,12 @@ def export_data():
         
         # エクスポートボタン
         if st.button("週間予定データをエクスポート", type="primary"):
-            with st.spinner("データを取得しています..."):
-                # 週間予定データを取得
-                schedules = load_weekly_schedules()
-                
-                # 期間でフィルタリング
-                start_date_str = start_month.strftime("%Y-%m-%d")
-                end_date_str = end_month.strftime("%Y-%m-%d")
-                
-                # 日付フィルタリング（文字列または日付型を考慮）
-                filtered_schedules = []
-                for s in schedules:
-                    # 文字列型の場合
-                    if isinstance(s["開始日"], str) and start_date_str <= s["開始日"] <= end_date_str:
-                        filtered_schedules.append(s)
-                    # 日付型の場合
-                    elif hasattr(s["開始日"], "strftime"):
-                        s_date_str = s["開始日"].strftime("%Y-%m-%d")
-                        if start_date_str <= s_date_str <= end_date_str:
-                            filtered_schedules.append(s)
-                
-                if filtered_schedules:
-                    # 日付範囲をファイル名に含める
-                    excel_filename = f"週間予定データ_{start_date_str}_{end_date_str}.xlsx"
-                    # データをエクスポートしてダウンロードリンクを直接表示
-                    download_link = excel_utils.export_weekly_schedules_to_excel(filtered_schedules, excel_filename)
-                    st.markdown(download_link, unsafe_allow_html=True)
-                else:
-                    st.warning("指定された期間に一致する週間予定データがありません。")
+            start_date_str = start_month.strftime("%Y-%m-%d")
+            end_date_str = end_month.strftime("%Y-%m-%d")
+            
+            # 日付範囲をファイル名に含める（開始日が期間内の週間予定だけを出力）
+            excel_filename = f"週間予定データ_{start_date_str}_{end_date_str}.xlsx"
+            start_export_job("weekly_schedules", {"start_date": start_month, "end_date": end_month}, excel_filename)
 
     with tab3:
         st.markdown("### 投稿統計データ")
@@ -2810,7 +2886,6 @@ def export_data():
                             month_val = int(year_month_parts[1])
                             
                             # 月の初日と末日
-                            import calendar
                             start_date = f"{year_val}-{month_val:02d}-01"
                             last_day = calendar.monthrange(year_val, month_val)[1]
                             end_date = f"{year_val}-{month_val:02d}-{last_day}"
@@ -2994,11 +3069,9 @@ def export_data():
                 
             # エクスポートボタン
             if st.button("投稿統計データをエクスポート", type="primary"):
-                with st.spinner("データをエクスポート中..."):
-                    # Excel形式でエクスポート（年を指定）
-                    excel_filename = f"投稿統計_{year}年.xlsx"
-                    download_link = excel_utils.export_monthly_stats_to_excel(stats, year, excel_filename)
-                    st.markdown(download_link, unsafe_allow_html=True)
+                # Excel形式でエクスポート（年を指定）
+                excel_filename = f"投稿統計_{year}年.xlsx"
+                start_export_job("monthly_stats", {"year": year, "month": month_value}, excel_filename)
         else:
             st.info("投稿統計データがありません。")
     
@@ -3024,6 +3097,19 @@ def export_data():
             # 月の値を適切に設定
             month_value = None if month == 0 else month
             
+            # 期間を含めたファイル名
+            period = f"{year}年"
+            if month_value:
+                period += f"{month_value}月"
+            else:
+                period += "全月"
+            excel_filename = f"店舗訪問データ_{period}.xlsx"
+            
+            # Excelファイルの作成は画面表示用の集計を待たずにバックグラウンドで始め、
+            # ページ上部のエクスポート状況からダウンロードする
+            start_export_job("store_visits", {"year": year, "month": month_value}, excel_filename)
+            st.info("Excelファイルを作成しています。ページ上部のエクスポート状況からダウンロードできます。")
+            
             # 処理開始のフラグを表示
             with st.spinner("店舗訪問データを取得中..."):
                 try:
@@ -3096,30 +3182,6 @@ def export_data():
                                     st.info(f"{user_name}の訪問データはありません。")
                                 
                                 st.markdown("---")
-                        
-                        # エクスポートボタンを別エリアに配置
-                        st.markdown("### データエクスポート")
-                        
-                        # 期間を含めたファイル名
-                        period = f"{year}年"
-                        if month_value:
-                            period += f"{month_value}月"
-                        else:
-                            period += "全月"
-                        
-                        # Excel形式でエクスポート
-                        excel_filename = f"店舗訪問データ_{period}.xlsx"
-                        
-                        # エクスポート処理を直接実行し、リンクを表示
-                        try:
-                            with st.spinner("Excel形式でエクスポート中..."):
-                                download_link = excel_utils.export_store_visits_to_excel(all_visits, excel_filename)
-                                st.markdown(download_link, unsafe_allow_html=True)
-                        except Exception as e:
-                            st.error(f"エクスポート中にエラーが発生しました: {str(e)}")
-                            logging.error(f"店舗訪問エクスポートエラー: {e}")
-                            import traceback
-                            logging.error(traceback.format_exc())
                     else:
                         st.warning("指定された期間の店舗訪問データはありません。")
                         if isinstance(all_visits, dict) and len(all_visits) == 0:
@@ -3130,10 +3192,90 @@ def export_data():
                     st.error(f"データの取得中にエラーが発生しました: {str(e)}")
                     st.info("管理者に連絡してください。")
 
+    with tab5:
+        st.markdown("### 担当店舗カバー率")
+        st.caption("担当店舗（店舗データの担当者社員コード）のうち、日報で実際に訪問した店舗の割合を担当者ごとに集計します。")
+        
+        from datetime import date
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            coverage_year = st.selectbox("年", options=range(date.today().year - 2, date.today().year + 1), index=2, key="coverage_year")
+        with col2:
+            coverage_month = st.selectbox("月", options=range(1, 13), index=date.today().month - 1,
+                                          format_func=lambda x: f"{x}月", key="coverage_month")
+        
+        if st.button("カバー率を集計", type="primary"):
+            from db_utils import get_store_coverage
+            
+            # Excelファイルの作成は画面表示用の集計を待たずにバックグラウンドで始める
+            excel_filename = f"担当店舗カバー率_{coverage_year}年{coverage_month}月.xlsx"
+            start_export_job("store_coverage", {"year": coverage_year, "month": coverage_month}, excel_filename)
+            st.info("Excelファイルを作成しています。ページ上部のエクスポート状況からダウンロードできます。")
+            
+            with st.spinner("担当店舗の訪問状況を集計中..."):
+                coverage = get_store_coverage(coverage_year, coverage_month)
+            
+            if coverage:
+                total_assigned = sum(rep["assigned_count"] for rep in coverage)
+                total_visited = sum(rep["visited_count"] for rep in coverage)
+                st.metric("全体のカバー率", f"{total_visited / total_assigned * 100:.1f}%" if total_assigned else "-",
+                          help=f"担当店舗 {total_assigned}件中 {total_visited}件を訪問")
+                
+                summary_df = pd.DataFrame([{
+                    "担当者名": rep["user_name"],
+                    "担当店舗数": rep["assigned_count"],
+                    "訪問店舗数": rep["visited_count"],
+                    "カバー率(%)": round(rep["coverage_rate"] * 100, 1),
+                    "未訪問店舗数": rep["unvisited_count"],
+                    "訪問実績なし店舗数": rep["never_visited_count"],
+                    "訪問日数": rep["active_days"]
+                } for rep in coverage]).sort_values("カバー率(%)")
+                
+                st.dataframe(
+                    summary_df,
+                    hide_index=True,
+                    use_container_width=True
+                )
+            else:
+                st.warning("担当店舗データがありません。")
+    
+    with tab6:
+        st.markdown("### 分析用データ（Parquet）のエクスポート")
+        st.caption("日付・日時・カテゴリの型を付けたParquet形式で出力します。pandas や DuckDB などの分析ツールでそのまま読み込めます。")
+        
+        import excel_utils
+        from datetime import date
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            parquet_dataset = st.selectbox("データ", options=list(excel_utils.PARQUET_DATASETS),
+                                           format_func=excel_utils.PARQUET_DATASETS.get, key="parquet_dataset")
+        with col2:
+            parquet_year = st.selectbox("期間", options=[None] + list(range(date.today().year, date.today().year - 5, -1)),
+                                        format_func=lambda x: "全期間" if x is None else f"{x}年", key="parquet_year")
+        
+        if st.button("Parquetファイルをエクスポート", type="primary"):
+            params = {
+                "dataset": parquet_dataset,
+                "start_date": date(parquet_year, 1, 1) if parquet_year else None,
+                "end_date": date(parquet_year, 12, 31) if parquet_year else None
+            }
+            period = f"{parquet_year}年" if parquet_year else "全期間"
+            parquet_filename = f"{excel_utils.PARQUET_DATASETS[parquet_dataset]}_{period}.parquet"
+            start_export_job(f"parquet_{parquet_dataset}", params, parquet_filename)
+            st.info("Parquetファイルを作成しています。ページ上部のエクスポート状況からダウンロードできます。")
+    
+    # タブで開始したジョブも含めて表示する（表示位置はタブの上）
+    with job_panel:
+        export_job_panel()
+
 # 店舗データアップロード機能は削除しました
 
 # お気に入りメンバー管理機能
 def manage_favorite_members():
+    # 重いモジュールはこのページを開いたときに読み込む
+    import pandas as pd
     if "user" not in st.session_state or st.session_state["user"] is None:
         st.error("ログインしてください。")
         return
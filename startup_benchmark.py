@@ -0,0 +1,120 @@
+import sys
+import os
+import json
+import time
+import logging
+import argparse
+import statistics
+import subprocess
+
+# 使い方:
+#   python startup_benchmark.py                              ログイン画面の起動時間と再実行時間を計測
+#   python startup_benchmark.py --page タイムライン --user 1001  ログイン済みのページを計測（社員コードは data/users_data.json から）
+#   python startup_benchmark.py --reruns 20                  再実行の計測回数を変更
+#
+# 起動時間はプロセスの起動から最初の描画（スクリプトの1回目の実行完了）まで。
+# 計測のたびに新しいプロセスを起動するため、インポートやプロセスごとの初期化の時間も含まれる。
+# 描画は streamlit.testing の AppTest で行う（ブラウザとの通信時間は含まない）。
+# AppTest は実行のたびにスクリプトをコンパイルし直すため、Streamlit サーバーと同じく
+# コンパイルはプロセスごとに1回にして、スクリプトの実行時間だけを再実行時間として計測する。
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ok-nippou.py")
+USER_FILE = "data/users_data.json"
+
+# 起動時に読み込まれていないことを確認する重いモジュール
+HEAVY_MODULES = ["pandas", "xlsxwriter", "excel_utils", "export_jobs"]
+
+def load_user(user_code):
+    """計測用のログインユーザーを取得"""
+    with open(USER_FILE, "r", encoding="utf-8-sig") as file:
+        for user in json.load(file):
+            if user["code"] == user_code:
+                user.setdefault("admin", False)
+                return user
+    raise SystemExit(f"社員コード {user_code} のユーザーが見つかりません。")
+
+# AppTest から実行するスクリプト（ok-nippou.py の実行時間を記録する）
+TIMED_APP_SCRIPT = """
+import startup_benchmark
+startup_benchmark.run_app()
+"""
+
+app_code = None
+run_seconds = []
+
+def run_app():
+    """ok-nippou.py を1回実行し、所要時間を記録する"""
+    global app_code
+    if app_code is None:
+        with open(APP_FILE, encoding="utf-8") as file:
+            app_code = compile(file.read(), APP_FILE, "exec")
+
+    started = time.perf_counter()
+    try:
+        exec(app_code, {"__name__": "__main__", "__file__": APP_FILE})
+    finally:
+        run_seconds.append(time.perf_counter() - started)
+
+def run_child(page, user_code, reruns):
+    """新しいプロセス内でアプリを描画し、計測結果をJSONで出力する"""
+    from streamlit.testing.v1 import AppTest
+    import startup_benchmark
+
+    app = AppTest.from_string(TIMED_APP_SCRIPT, default_timeout=120)
+    if page:
+        app.session_state["user"] = load_user(user_code)
+        app.session_state["page"] = page
+
+    app.run()
+    first_paint = time.time()
+    loaded_modules = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    for _ in range(reruns):
+        app.run()
+
+    print(json.dumps({
+        "first_paint": first_paint,
+        "rerun_seconds": startup_benchmark.run_seconds[1:],
+        "loaded_modules": loaded_modules,
+        "exceptions": [exception.message for exception in app.exception]
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="ok-nippou.py の起動時間と再実行時間を計測")
+    parser.add_argument("--page", help="計測するページ（省略時はログイン画面）")
+    parser.add_argument("--user", help="ログインユーザーの社員コード（--page を指定する場合）")
+    parser.add_argument("--reruns", type=int, default=10, help="再実行の計測回数")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.page and not args.user:
+        parser.error("--page を指定する場合は --user も指定してください")
+
+    if args.child:
+        logging.disable(logging.WARNING)
+        run_child(args.page, args.user, args.reruns)
+        return 0
+
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--reruns", str(args.reruns)]
+    if args.page:
+        command += ["--page", args.page, "--user", args.user]
+
+    started = time.time()
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(completed.stderr)
+        return 1
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    rerun_seconds = result["rerun_seconds"]
+    print(f"ページ: {args.page or 'ログイン'}")
+    print(f"起動から最初の描画まで: {result['first_paint'] - started:.3f}秒")
+    if rerun_seconds:
+        print(f"再実行: 中央値 {statistics.median(rerun_seconds):.3f}秒 / 最大 {max(rerun_seconds):.3f}秒（{len(rerun_seconds)}回）")
+    print(f"最初の描画までに読み込まれた重いモジュール: {', '.join(result['loaded_modules']) or 'なし'}")
+    for message in result["exceptions"]:
+        print(f"エラー: {message}")
+    return 1 if result["exceptions"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
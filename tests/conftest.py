@@ -0,0 +1,88 @@
+import os
+import sys
+
+import pytest
+
+# リポジトリ直下のモジュール（db_utils など）をインポートできるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_utils
+
+
+class RecordingCursor:
+    """発行されたSQLを記録するだけのカーソル（データベースには接続しない）"""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def execute(self, query, params=None):
+        self.recorder.record("execute", query, params)
+
+    def fetchone(self):
+        return self.recorder.fetchone_result
+
+    def fetchall(self):
+        return list(self.recorder.fetchall_result)
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def cursor(self, *args, **kwargs):
+        return RecordingCursor(self.recorder)
+
+    def commit(self):
+        self.recorder.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StatementRecorder:
+    """get_db_connection と execute_values を差し替えて、1回の保存で発行される文を数える
+
+    statements には (種類, SQL, 行数またはパラメータ) を発行順に記録する。
+    execute_values の場合は渡された行の数、execute の場合は渡されたパラメータ。
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+        self.fetchone_result = (1,)
+        self.fetchall_result = []
+
+    def connect(self):
+        return RecordingConnection(self)
+
+    def record(self, kind, query, rows):
+        self.statements.append((kind, " ".join(str(query).split()), rows))
+
+    def execute_values(self, cur, query, argslist, template=None, page_size=100, fetch=False):
+        argslist = list(argslist)
+        self.record("execute_values", query, len(argslist))
+        # page_size 行ごとに1回のラウンドトリップになる
+        assert page_size >= len(argslist)
+
+    def find(self, prefix):
+        """SQLが prefix で始まる文を取得"""
+        return [statement for statement in self.statements if statement[1].startswith(prefix)]
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    recorder = StatementRecorder()
+    monkeypatch.setattr(db_utils, "get_db_connection", recorder.connect)
+    monkeypatch.setattr(db_utils, "execute_values", recorder.execute_values)
+    # 他のテストの読み取り結果をキャッシュから返さないようにする
+    with db_utils.query_cache_lock:
+        db_utils.query_cache.clear()
+    yield recorder
+    with db_utils.query_cache_lock:
+        db_utils.query_cache.clear()
@@ -0,0 +1,116 @@
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import excel_utils
+
+NS = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+
+def read_cells(path):
+    """書き出したワークブックの1枚目のシートを {セル番地: (値, 表示形式)} として読む"""
+    with zipfile.ZipFile(path) as workbook:
+        sheet = ET.fromstring(workbook.read("xl/worksheets/sheet1.xml"))
+        styles = ET.fromstring(workbook.read("xl/styles.xml"))
+
+    formats = {fmt.get("numFmtId"): fmt.get("formatCode") for fmt in styles.iterfind("x:numFmts/x:numFmt", NS)}
+    cell_formats = [formats.get(xf.get("numFmtId")) for xf in styles.iterfind("x:cellXfs/x:xf", NS)]
+
+    cells = {}
+    for cell in sheet.iterfind("x:sheetData/x:row/x:c", NS):
+        assert cell.find("x:f", NS) is None, "数式として書き込まれたセルがあります"
+        value = cell.find("x:v", NS)
+        if value is None:
+            value = cell.find("x:is/x:t", NS)
+        cells[cell.get("r")] = (value.text, cell_formats[int(cell.get("s", 0))])
+    return cells
+
+
+def test_write_workbook(monkeypatch, tmp_path):
+    monkeypatch.setattr(excel_utils, "EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(excel_utils, "EXPORT_PROGRESS_ROWS", 2)
+    progress = []
+
+    path = excel_utils.write_workbook([{
+        "name": "日報",
+        "columns": [("投稿者", 10), ("日付", 10), ("内容", 40), ("投稿日時", 20)],
+        "rows": iter([
+            ["山田太郎", date(2025, 1, 6), "=HYPERLINK(\"http://example.com\")", datetime(2025, 1, 6, 9, 30)],
+            ["佐藤花子", None, "", datetime(2025, 1, 7, 18, 0)],
+            ["鈴木一郎", date(2025, 1, 8), 3, None]
+        ])
+    }], progress=progress.append)
+    cells = read_cells(path)
+
+    assert cells["A1"][0] == "投稿者"
+    # 日付と日時はシリアル値に表示形式を付けて書き込む
+    assert cells["B2"] == ("45663", "yyyy-mm-dd")
+    assert re.fullmatch(r"45663\.39583\d*", cells["D2"][0])
+    assert cells["D2"][1] == "yyyy-mm-dd hh:mm:ss"
+    # 数式に見える文字列も文字列のまま書き込む
+    assert cells["C2"] == ("=HYPERLINK(\"http://example.com\")", None)
+    # None と空文字のセルは書き込まない
+    assert "B3" not in cells and "C3" not in cells and "D4" not in cells
+    assert cells["C4"] == ("3", None)
+    # EXPORT_PROGRESS_ROWS 行ごとと最後に、書き出した行数を通知する
+    assert progress == [2, 3]
+
+
+def visit_rows(ids):
+    return [{"id": i, "user_code": "1001", "store_code": f"S{i % 2}", "store_name": f"店舗{i % 2}",
+             "visit_date": date(2025, 1, i), "visit_type": "daily_report", "report_id": None if i == 3 else i}
+            for i in ids]
+
+
+def test_write_parquet(monkeypatch, tmp_path):
+    calls = []
+
+    def iter_analytics_rows(dataset, start_date, end_date, batch_size):
+        calls.append((dataset, start_date, end_date, batch_size))
+        yield visit_rows([1, 2])
+        yield visit_rows([3])
+
+    monkeypatch.setattr(excel_utils, "iter_analytics_rows", iter_analytics_rows)
+    progress = []
+    path = excel_utils.write_parquet("store_visits", date(2025, 1, 1), date(2025, 1, 31),
+                                     path=str(tmp_path / "visits.parquet"), progress=progress.append)
+
+    assert calls == [("store_visits", date(2025, 1, 1), date(2025, 1, 31), excel_utils.PARQUET_ROW_GROUP_ROWS)]
+    assert progress == [2, 3]
+
+    # 取得した1回分の行ごとに1つの行グループになる
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.metadata.num_row_groups == 2
+    assert parquet_file.schema_arrow == excel_utils.parquet_schema("store_visits")
+    assert pa.types.is_dictionary(parquet_file.schema_arrow.field("store_code").type)
+    assert parquet_file.schema_arrow.field("visit_date").type == pa.date32()
+
+    table = parquet_file.read()
+    assert table.column("id").to_pylist() == [1, 2, 3]
+    assert table.column("store_name").to_pylist() == ["店舗1", "店舗0", "店舗1"]
+    assert table.column("visit_date").to_pylist() == [date(2025, 1, 1), date(2025, 1, 2), date(2025, 1, 3)]
+    assert table.column("report_id").to_pylist() == [1, 2, None]
+
+
+def test_write_parquet_without_rows_or_with_errors(monkeypatch, tmp_path):
+    path = tmp_path / "visits.parquet"
+
+    # 該当するデータがない場合はファイルを残さない
+    monkeypatch.setattr(excel_utils, "iter_analytics_rows", lambda *args, **kwargs: iter([]))
+    assert excel_utils.write_parquet("store_visits", path=str(path)) is None
+    assert not path.exists()
+
+    # 途中で取得に失敗した場合は不完全なファイルを残さずに例外を送出する
+    def iter_analytics_rows(*args, **kwargs):
+        yield visit_rows([1])
+        raise RuntimeError("接続が切れました")
+
+    monkeypatch.setattr(excel_utils, "iter_analytics_rows", iter_analytics_rows)
+    with pytest.raises(RuntimeError):
+        excel_utils.write_parquet("store_visits", path=str(path))
+    assert not path.exists()
@@ -0,0 +1,152 @@
+import os
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+import pytest
+
+import export_jobs
+
+
+class FakeExecutor:
+    """ジョブを実行せずに Future を返すだけのプロセスプール（テストから結果を設定する）"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.submitted.append((args, future))
+        return future
+
+
+@pytest.fixture
+def jobs(monkeypatch, tmp_path):
+    """データバージョンとプロセスプールを差し替え、ジョブの状態とファイルの置き場所をテストごとに分ける"""
+    versions = {"reports": 1}
+    executor = FakeExecutor()
+    monkeypatch.setattr(export_jobs, "get_data_versions", lambda tables: dict(versions) if versions else None)
+    monkeypatch.setattr(export_jobs, "get_executor", lambda reset=False: executor)
+    monkeypatch.setattr(export_jobs, "EXPORT_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(export_jobs, "EXPORT_JOB_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(export_jobs, "export_jobs", {})
+    monkeypatch.setattr(export_jobs, "running_job_ids", {})
+    return versions, executor
+
+
+PARAMS = {"start_date": "2025-01-01", "end_date": "2025-01-31"}
+
+
+def cache_path(kind, params):
+    key = export_jobs.get_cache_key(kind, params)
+    return os.path.join(export_jobs.EXPORT_CACHE_DIR, f"{key}{export_jobs.get_export_format(kind)['suffix']}")
+
+
+def test_cache_key(monkeypatch, tmp_path, jobs):
+    versions, _ = jobs
+    key = export_jobs.get_cache_key("reports", PARAMS)
+    assert key.startswith("reports-")
+    assert export_jobs.get_cache_key("reports", dict(PARAMS)) == key
+    assert export_jobs.get_cache_key("reports", {**PARAMS, "end_date": "2025-02-28"}) != key
+
+    # データが変わると別のキーになる
+    versions["reports"] = 2
+    assert export_jobs.get_cache_key("reports", PARAMS) != key
+
+    # 依存するファイルが更新されると別のキーになる
+    stores_file = tmp_path / "stores.json"
+    stores_file.write_text("[]")
+    monkeypatch.setitem(export_jobs.EXPORT_JOB_TYPES["store_coverage"], "files", [str(stores_file)])
+    coverage_key = export_jobs.get_cache_key("store_coverage", {"year": 2025, "month": 1})
+    os.utime(stores_file, (time.time() + 60, time.time() + 60))
+    assert export_jobs.get_cache_key("store_coverage", {"year": 2025, "month": 1}) != coverage_key
+
+    # 今日の日付で内容が変わる種類は、日付が変わると別のキーになる
+    class Tomorrow(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + export_jobs.timedelta(days=1)
+
+    coverage_key = export_jobs.get_cache_key("store_coverage", {"year": 2025, "month": 1})
+    monkeypatch.setattr(export_jobs, "datetime", Tomorrow)
+    assert export_jobs.get_cache_key("store_coverage", {"year": 2025, "month": 1}) != coverage_key
+    assert export_jobs.get_cache_key("reports", PARAMS) == export_jobs.get_cache_key("reports", dict(PARAMS))
+
+    # データバージョンを取得できない場合はキャッシュを使わない
+    versions.clear()
+    assert export_jobs.get_cache_key("reports", PARAMS) is None
+
+
+def test_cached_file_is_returned_without_running(jobs):
+    _, executor = jobs
+    path = cache_path("reports", PARAMS)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as file:
+        file.write(b"xlsx")
+    used_at = time.time() - 60
+    os.utime(path, (used_at, used_at))
+
+    job_id = export_jobs.submit_export_job("reports", PARAMS, "日報.xlsx")
+
+    assert executor.submitted == []
+    assert export_jobs.get_export_job(job_id)["status"] == "done"
+    assert export_jobs.get_export_job(job_id)["path"] == path
+    # 使われたファイルは削除を先延ばしにする
+    assert os.path.getmtime(path) > used_at
+
+
+def test_running_job_is_joined(jobs):
+    _, executor = jobs
+    job_id = export_jobs.submit_export_job("reports", PARAMS, "日報.xlsx")
+
+    # 同じ条件のジョブが実行中であれば、新しく実行せずにそのジョブを返す
+    assert export_jobs.submit_export_job("reports", PARAMS, "日報.xlsx") == job_id
+    assert len(executor.submitted) == 1
+
+    # 別の条件のジョブは別に実行する
+    assert export_jobs.submit_export_job("reports", {**PARAMS, "depart": "営業部"}, "日報.xlsx") != job_id
+    assert len(executor.submitted) == 2
+
+    # 終了したジョブには合流しない
+    executor.submitted[0][1].set_result(None)
+    assert export_jobs.submit_export_job("reports", PARAMS, "日報.xlsx") != job_id
+    assert len(executor.submitted) == 3
+
+
+def test_export_job_states(jobs):
+    _, executor = jobs
+    running, done, empty, failed = [
+        export_jobs.submit_export_job("reports", {**PARAMS, "depart": depart}, "日報.xlsx")
+        for depart in ("running", "done", "empty", "failed")
+    ]
+    (_, _, _, progress_path), _ = executor.submitted[0]
+    export_jobs.write_progress(progress_path, stage="Excelファイルを作成中", rows=500, total=1200)
+    executor.submitted[1][1].set_result("/tmp/done.xlsx")
+    executor.submitted[2][1].set_result(None)
+    executor.submitted[3][1].set_exception(RuntimeError("接続できません"))
+
+    status = export_jobs.get_export_job(running)
+    assert (status["status"], status["stage"], status["rows"], status["total"]) == \
+        ("running", "Excelファイルを作成中", 500, 1200)
+    assert export_jobs.get_export_job(done)["status"] == "done"
+    assert export_jobs.get_export_job(done)["path"] == "/tmp/done.xlsx"
+    assert export_jobs.get_export_job(empty)["status"] == "empty"
+    assert export_jobs.get_export_job(failed)["status"] == "failed"
+    assert export_jobs.get_export_job(failed)["error"] == "接続できません"
+    assert export_jobs.get_export_job("unknown") is None
+
+
+def test_prune_export_jobs(jobs):
+    _, executor = jobs
+    old, recent, running = [
+        export_jobs.submit_export_job("reports", {**PARAMS, "depart": depart}, "日報.xlsx")
+        for depart in ("old", "recent", "running")
+    ]
+    executor.submitted[0][1].set_result(None)
+    executor.submitted[1][1].set_result(None)
+    export_jobs.export_jobs[old]["finished_at"] = time.time() - export_jobs.EXPORT_JOB_RETENTION - 1
+
+    export_jobs.prune_export_jobs()
+
+    # 終了してから時間の経ったジョブだけを片付ける（実行中のジョブは残す）
+    assert set(export_jobs.export_jobs) == {recent, running}
@@ -0,0 +1,34 @@
+import pytest
+
+import db_utils
+
+COMMENT_EVENT = (1, "comment_posted", {"commenter": "鈴木", "report_author": "山田", "report_date": "2025-01-06",
+                                       "report_id": 10}, 0, 1.5)
+
+
+def test_failed_batch_records_a_failure_for_every_claimed_event(monkeypatch, recorder):
+    recorder.fetchall_result = [COMMENT_EVENT, (2,) + COMMENT_EVENT[1:]]
+
+    def failing_insert(*args, **kwargs):
+        raise RuntimeError("insert failed")
+
+    monkeypatch.setattr(db_utils, "execute_values", failing_insert)
+
+    assert db_utils.process_notification_outbox() == 0
+
+    # ロールバックの後に、取り出したイベントの試行回数をまとめて進めてコミットする
+    failures = recorder.find("UPDATE notification_outbox SET attempts = attempts + 1")
+    assert len(failures) == 1
+    assert failures[0][2][1:] == (db_utils.OUTBOX_POLL_INTERVAL, [1, 2])
+    assert recorder.commits == 1
+
+
+def test_failed_event_is_retried_with_backoff_inside_the_batch(monkeypatch, recorder):
+    recorder.fetchall_result = [(1, "unknown_event", {}, 2, 1.5)]
+
+    assert db_utils.process_notification_outbox() == 1
+
+    failures = recorder.find("UPDATE notification_outbox SET attempts = attempts + 1")
+    assert [statement[2][2] for statement in failures] == [[1]]
+    assert not recorder.find("INSERT INTO notifications")
+    assert recorder.commits == 1
@@ -0,0 +1,78 @@
+import psycopg2
+
+import db_utils
+
+NOTICE = {"id": 1, "投稿者": "管理者", "タイトル": "お知らせ", "内容": "本文", "対象部署": "営業部",
+          "投稿日時": "2025-01-06 09:00:00", "既読者": []}
+
+
+def flaky_connection(monkeypatch, recorder, failures=1):
+    """最初の failures 回は接続に失敗し、その後は recorder の接続を返す get_db_connection に差し替える"""
+    calls = []
+
+    def connect():
+        calls.append(len(calls) + 1)
+        if len(calls) <= failures:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        return recorder.connect()
+
+    monkeypatch.setattr(db_utils, "get_db_connection", connect)
+    return calls
+
+
+def test_failed_read_is_not_cached(monkeypatch, recorder):
+    calls = flaky_connection(monkeypatch, recorder)
+    recorder.fetchall_result = [dict(NOTICE)]
+    errors = db_utils.get_query_cache_metrics()["errors"]
+
+    # 失敗した読み取りは空の結果を返すが、キャッシュには残さない
+    assert db_utils.load_notices("営業部") == []
+    assert db_utils.get_query_cache_metrics()["errors"] == errors + 1
+
+    # 次の呼び出しはデータベースから読み直す
+    assert db_utils.load_notices("営業部") == [NOTICE]
+    assert len(calls) == 2
+
+    # 成功した結果はキャッシュから返す
+    assert db_utils.load_notices("営業部") == [NOTICE]
+    assert len(calls) == 2
+
+
+def test_failed_read_returns_a_fresh_default(monkeypatch, recorder):
+    flaky_connection(monkeypatch, recorder, failures=2)
+
+    # 呼び出し元が結果を書き換えても、次の失敗時の結果には影響しない
+    db_utils.get_user_monthly_report_summary(user_code="1001")["2025-01"] = 1
+    assert db_utils.get_user_monthly_report_summary(user_code="1001") == {}
+
+
+class StopListening(BaseException):
+    """listen_for_changes のループを抜けるための例外（except Exception では捕まらない）"""
+
+
+def test_listener_clears_cache_after_listen(monkeypatch, recorder):
+    recorder.fetchall_result = [dict(NOTICE)]
+    db_utils.load_notices("営業部")
+    flaky_connection(monkeypatch, recorder)
+    versions = dict(db_utils.table_versions)
+    cached_while_disconnected = []
+
+    def sleep(seconds):
+        # 接続に失敗しただけではキャッシュは破棄しない（再接続前に読み込んだ結果が残るため）
+        cached_while_disconnected.append(len(db_utils.query_cache))
+
+    def wait_for_notification(*args):
+        raise StopListening()
+
+    monkeypatch.setattr(db_utils.time, "sleep", sleep)
+    monkeypatch.setattr(db_utils.select, "select", wait_for_notification)
+    try:
+        db_utils.listen_for_changes()
+    except StopListening:
+        pass
+
+    # LISTEN を開始してからキャッシュを破棄し、すべてのテーブルのバージョンを上げる
+    assert cached_while_disconnected == [1]
+    assert any("LISTEN" in statement[1] for statement in recorder.statements)
+    assert len(db_utils.query_cache) == 0
+    assert all(db_utils.table_versions[table] == version + 1 for table, version in versions.items())
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import db_utils
+
+# 実際のデータベースに対して実行する（DATABASE_URL または PGHOST などで接続先を指定した場合のみ）
+# マイグレーションを適用したうえで、主要クエリの実行計画を確認する。確認中の変更はすべてロールバックされる
+pytestmark = pytest.mark.skipif(
+    not (os.getenv("DATABASE_URL") or os.getenv("PGHOST")),
+    reason="データベースの接続先が設定されていません"
+)
+
+
+def test_hot_queries_use_indexes():
+    assert db_utils.run_migrations() is not None
+    assert db_utils.check_query_plans() == []
+
+
+def test_check_query_plans_reports_seq_scans_and_errors():
+    def unindexed_query():
+        conn = db_utils.get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM reports WHERE 実施内容 = %s", ("訪問",))
+        cur.fetchall()
+
+    failures = dict(db_utils.check_query_plans([
+        ("unindexed", unindexed_query),
+        ("broken", lambda: db_utils.load_reports_by_date("不正な日付", "不正な日付"))
+    ]))
+
+    assert failures["unindexed"].startswith("Seq Scan on reports")
+    assert failures["broken"].startswith("実行エラー")
+
+
+def test_check_query_plans_does_not_affect_other_threads():
+    import threading
+
+    connections = []
+
+    def other_thread():
+        # 確認中に別のスレッドが取得する接続は通常の接続
+        conn = db_utils.get_db_connection()
+        connections.append(type(conn))
+        conn.close()
+
+    def query_in_other_thread():
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+        db_utils.load_reports(limit=1)
+
+    assert db_utils.check_query_plans([("other_thread", query_in_other_thread)]) == []
+    assert connections and connections[0] is not db_utils.PlanCheckConnection
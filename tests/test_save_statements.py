@@ -0,0 +1,88 @@
+from datetime import date
+
+import db_utils
+
+# 保存1回あたりに発行する文の数（増えた場合はループで1行ずつ書き込んでいないか確認すること）
+# いずれも末尾のデータバージョンの更新（1回）と pg_notify（変更したテーブルごとに1回）を含む
+
+
+def stores(*codes):
+    return [{"code": code, "name": f"店舗{code}"} for code in codes]
+
+
+def test_save_report_inserts_store_visits_in_one_statement(recorder):
+    report_id = db_utils.save_report({
+        "投稿者": "山田", "所属部署": "営業部", "日付": "2025-01-06", "実施内容": "訪問",
+        "所感": "", "今後のアクション": "", "user_code": "1001",
+        "visited_stores": stores(*[str(code) for code in range(20)])
+    })
+
+    assert report_id == 1
+    assert recorder.commits == 1
+    # 日報の INSERT + 訪問記録 + 通知イベント + データバージョン + pg_notify 3回
+    assert len(recorder.statements) == 7
+    assert [rows for _, _, rows in recorder.find("INSERT INTO store_visits")] == [20]
+    # データバージョンはテーブル名の順に上げる
+    assert [rows for _, _, rows in recorder.find("INSERT INTO data_versions")] == [(["reports", "store_visits"],)]
+
+
+def test_edit_report_changes_only_added_and_removed_visits(recorder):
+    recorder.fetchone_result = (date(2025, 1, 6),)
+    recorder.fetchall_result = [
+        (1, "1001", "A", "店舗A", date(2025, 1, 6)),
+        (2, "1001", "B", "店舗B", date(2025, 1, 6))
+    ]
+
+    assert db_utils.edit_report(1, {
+        "実施内容": "訪問", "所感": "", "今後のアクション": "", "user_code": "1001",
+        "visited_stores": stores("B", "C", "D")
+    })
+
+    # 日報の UPDATE + 既存の訪問記録の SELECT + DELETE + INSERT + データバージョン + pg_notify 2回
+    assert len(recorder.statements) == 7
+    assert len(recorder.find("DELETE FROM store_visits")) == 1
+    assert [rows for _, _, rows in recorder.find("INSERT INTO store_visits")] == [2]
+
+
+def test_edit_report_without_store_changes_writes_no_visits(recorder):
+    recorder.fetchone_result = (date(2025, 1, 6),)
+    recorder.fetchall_result = [(1, "1001", "A", "店舗A", date(2025, 1, 6))]
+
+    assert db_utils.edit_report(1, {
+        "実施内容": "訪問", "所感": "", "今後のアクション": "", "user_code": "1001",
+        "visited_stores": stores("A")
+    })
+
+    # 日報の UPDATE + 既存の訪問記録の SELECT + データバージョン + pg_notify 2回
+    assert len(recorder.statements) == 5
+    assert not recorder.find("DELETE FROM store_visits")
+    assert not recorder.find("INSERT INTO store_visits")
+
+
+def weekly_schedule(**extra):
+    schedule = {"投稿者": "山田", "user_code": "1001", "開始日": "2025-01-06", "終了日": "2025-01-12"}
+    for weekday in db_utils.WEEKDAYS:
+        schedule[weekday] = "外回り"
+        schedule[f"{weekday}_visited_stores"] = stores(*[f"{weekday}{code}" for code in range(6)])
+    schedule.update(extra)
+    return schedule
+
+
+def test_save_weekly_schedule_inserts_a_week_of_visits_in_one_statement(recorder):
+    assert db_utils.save_weekly_schedule(weekly_schedule()) == 1
+
+    # 週間予定の INSERT + 日別の予定 + 訪問記録 + 通知イベント + データバージョン + pg_notify 3回
+    assert len(recorder.statements) == 8
+    assert [rows for _, _, rows in recorder.find("INSERT INTO schedule_days")] == [7]
+    assert [rows for _, _, rows in recorder.find("INSERT INTO store_visits")] == [42]
+
+
+def test_update_weekly_schedule_syncs_visits_in_fixed_statements(recorder):
+    recorder.fetchall_result = [(1, "1001", "old", "店舗old", date(2025, 1, 6))]
+
+    assert db_utils.save_weekly_schedule(weekly_schedule(id=1)) == 1
+
+    # 週間予定の UPDATE + 日別の予定 + 既存の訪問記録の SELECT + DELETE + INSERT + データバージョン + pg_notify 3回
+    assert len(recorder.statements) == 9
+    assert len(recorder.find("DELETE FROM store_visits")) == 1
+    assert [rows for _, _, rows in recorder.find("INSERT INTO store_visits")] == [42]